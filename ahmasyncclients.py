@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmasyncclients.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import socket
+import asyncore
+from ahmclients import AbstractClient
+
+
+# Modulo aparte de ahmclients para que asyncore se cargue solo al usar estos clientes (ver ahmimportbenchmark)
+
+# Clientes asincronicos (asyncore). Varios clientes pueden compartir un mismo mapa de sockets y ejecutarse en un solo bucle de eventos:
+#
+#	socketMap = {}
+#	for i in range(1000):
+#		AsyncTCPClient(host,port,data,socketMap)
+#	asyncore.loop(use_poll = True,map = socketMap)
+#
+# Al recibir la respuesta completa se invoca handleResponse, que las sub-clases pueden sobreescribir.
+class AbstractAsyncClient(AbstractClient,asyncore.dispatcher):
+	
+	def __init__(self,host,port,sockFamily,sockType,data = None,socketMap = None):
+		self.socketMap = socketMap if socketMap is not None else {}
+		self.response = []
+		asyncore.dispatcher.__init__(self,map = self.socketMap)
+		AbstractClient.__init__(self,host,port,sockFamily,sockType,data)
+		self.pendingData = self.clientData
+		
+	# Override. El socket se crea a traves del dispatcher (no bloqueante y registrado en el mapa de sockets)
+	def createSocket(self):
+		self.create_socket(self.sockFamily,self.sockType)
+		
+	def run(self):
+		asyncore.loop(use_poll = True,map = self.socketMap)
+		
+	def sendData(self,data):
+		self.pendingData += data
+		
+	def writable(self):
+		return len(self.pendingData) > 0
+		
+	def handleResponse(self,data):
+		self.responseData = data
+		
+		
+class AsyncTCPClient(AbstractAsyncClient):
+	
+	def __init__(self,host,port,data = None,socketMap = None):
+		AbstractAsyncClient.__init__(self,host,port,socket.AF_INET,socket.SOCK_STREAM,data,socketMap)
+		self.connect((self.host,self.port))
+		
+	def handle_connect(self):
+		pass
+		
+	def handle_write(self):
+		sent = self.send(self.pendingData)
+		self.pendingData = self.pendingData[sent:]
+		if not self.pendingData:
+			self.socket.shutdown(socket.SHUT_WR)   # Fin de envio. El servidor responde y cierra la conexion
+			
+	def handle_read(self):
+		data = self.recv(self.bufferSize)
+		if data:
+			self.response.append(data)
+			
+	# asyncore invoca handle_close ante un POLLHUP aunque queden datos sin leer en el socket, por lo que se leen antes de cerrar
+	def handle_close(self):
+		while True:
+			try:
+				data = self.socket.recv(self.bufferSize)
+			except socket.error:
+				break
+			if not data:
+				break
+			self.response.append(data)
+		self.close()
+		self.handleResponse(''.join(self.response))
+		
+		
+class AsyncUDPClient(AbstractAsyncClient):
+	
+	def __init__(self,host,port,data = None,socketMap = None):
+		AbstractAsyncClient.__init__(self,host,port,socket.AF_INET,socket.SOCK_DGRAM,data,socketMap)
+		self.connected = True   # UDP no tiene conexion, evito que asyncore intente completar un connect
+		
+	def handle_write(self):
+		self.socket.sendto(self.pendingData,(self.host,self.port))
+		self.pendingData = ""
+		
+	# Una respuesta por datagrama
+	def handle_read(self):
+		data, address = self.socket.recvfrom(self.bufferSize)
+		self.close()
+		self.handleResponse(data)
+		
+		
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmasyncservers.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import socket
+import errno
+import asyncore
+import collections
+from ahmservers import AbstractServer,SO_REUSEPORT
+from ahmprotocols import RequestIdEnvelope
+
+
+##############################   SERVIDORES ASINCRONICOS  - asyncore  ###################################
+
+# Modulo aparte de ahmservers para que asyncore se cargue solo al usar estos servidores (ver ahmimportbenchmark)
+
+# Jerarquia paralela a AbstractTCPServer/AbstractUDPServer, implementada sobre asyncore (sockets no bloqueantes y un unico bucle de eventos).
+# Los servidores concretos mantienen el mismo contrato: implementan manageRequest y responden con sendResponse.
+# Cada servidor tiene su propio mapa de sockets, por lo que varios servidores pueden convivir en un mismo proceso.
+class AbstractAsyncServer(AbstractServer,asyncore.dispatcher):
+	
+	loopTimeout = 30.0
+	
+	def __init__(self,host,port,sockFamily,sockType):
+		self.socketMap = {}
+		asyncore.dispatcher.__init__(self,map = self.socketMap)
+		AbstractServer.__init__(self,host,port,sockFamily,sockType)
+		
+	# Override. El socket se crea a traves del dispatcher (queda en modo no bloqueante y registrado en el mapa del servidor)
+	def createSocket(self):
+		self.create_socket(self.sockFamily,self.sockType)
+		self.set_reuse_addr()
+		if self.reusePort:
+			self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+		self.bind((self.host,self.port))
+		
+	def run(self):
+		while self.running and self.socketMap:
+			asyncore.loop(timeout = self.loopTimeout,use_poll = True,map = self.socketMap,count = 1)
+			
+	def countConnections(self):
+		return max(len(self.socketMap) - 1,0)   # El mapa incluye el socket del servidor
+		
+	# Metodo abstracto a implementar por los servidores concretos.
+	def manageRequest(self,client,data):
+		raise NotImplementedError()
+		
+		
+# Conexion de un cliente contra un AsyncTCPServer. Los datos recibidos se pasan al manageRequest del servidor.
+# dispatcher_with_send encola lo que no se pudo enviar y lo envia cuando el socket esta disponible para escritura.
+class AsyncTCPConnection(asyncore.dispatcher_with_send):
+	
+	def __init__(self,client_sock,server):
+		# Sin Nagle: una respuesta enviada en dos partes (ej: dos lecturas de un mismo pedido) no espera el ACK retardado del cliente
+		client_sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		asyncore.dispatcher_with_send.__init__(self,client_sock,map = server.socketMap)
+		self.server = server
+		
+	def handle_read(self):
+		data = self.recv(self.server.bufferSize)   # recv retorna "" y cierra la conexion si el cliente la cerro
+		if data:
+			self.server.manageRequest(self,data)
+			
+	sendChunkSize = 65536   # dispatcher_with_send envia de a 512 bytes: una llamada a send por cada 512 bytes de respuesta
+	
+	def initiate_send(self):
+		sent = asyncore.dispatcher.send(self,self.out_buffer[:self.sendChunkSize])
+		self.out_buffer = self.out_buffer[sent:]
+		
+	def readable(self):
+		return not self.closing
+		
+	def handle_write(self):
+		self.initiate_send()
+		if self.closing and not self.out_buffer:
+			self.close()
+		
+	# El cliente cerro la conexion. Si quedan datos sin enviar, se cierra luego de enviarlos
+	def handle_close(self):
+		self.closing = True
+		if not self.out_buffer:
+			self.close()
+		
+		
+class AsyncTCPServer(AbstractAsyncServer):
+	
+	connectionsNumber = 128
+	
+	def __init__(self,host,port):
+		AbstractAsyncServer.__init__(self,host,port,socket.AF_INET,socket.SOCK_STREAM)
+		
+	def initializeSocket(self):
+		self.listen(self.connectionsNumber)
+		
+	def handle_accept(self):
+		pair = self.accept()
+		if pair:   # accept puede retornar None si el cliente aborto la conexion
+			client_sock, client_addr = pair
+			AsyncTCPConnection(client_sock,self)
+			
+	# client es la AsyncTCPConnection que recibio los datos
+	def sendResponse(self,client,data):
+		client.send(data)
+		
+		
+class AsyncUDPServer(AbstractAsyncServer):
+	
+	requestIds = False   # Ver AbstractUDPServer
+	
+	def __init__(self,host,port):
+		self.pendingResponses = collections.deque()   # (data,address) a la espera de que el socket este disponible para escritura
+		self.requestId = None
+		AbstractAsyncServer.__init__(self,host,port,socket.AF_INET,socket.SOCK_DGRAM)
+		
+	def initializeSocket(self):
+		self.connected = True   # UDP no tiene conexion, evito que asyncore intente completar un connect
+		
+	def handle_read(self):
+		try:
+			data, address = self.socket.recvfrom(self.bufferSize)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+				return
+			raise
+		if self.requestIds:   # Ver AbstractUDPServer.dispatchRequest
+			self.requestId, data = RequestIdEnvelope.unwrap(data)
+		try:
+			self.manageRequest(address,data)
+		finally:
+			self.requestId = None
+		
+	def writable(self):
+		return len(self.pendingResponses) > 0
+		
+	def getQueueDepth(self):
+		return len(self.pendingResponses)
+		
+	def handle_write(self):
+		while self.pendingResponses:
+			data, address = self.pendingResponses[0]
+			try:
+				self.socket.sendto(data,address)
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+					return
+				print "No se pudo enviar la respuesta a " + str(address) + ": " + str(e)   # Se descarta (ver AbstractUDPServer.sendResponse)
+			self.pendingResponses.popleft()
+			
+	def sendResponse(self,address,data):
+		if self.requestId is not None:
+			data = RequestIdEnvelope.wrap(self.requestId,data)
+		self.pendingResponses.append((data,address))
+
+
+### ECHO SERVERS ##################################
+
+class AsyncEchoTCPServer(AsyncTCPServer):
+	
+	def manageRequest(self,client,data):
+		self.sendResponse(client,data)
+		
+		
+class AsyncEchoUDPServer(AsyncUDPServer):
+	
+	def manageRequest(self,address,data):
+		self.sendResponse(address,data)
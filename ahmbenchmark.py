@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmbenchmark.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import socket
+import random
+import math
+import array
+import time
+import os
+import sys
+import json
+import argparse
+import tempfile
+import platform
+import datetime
+import threading
+import multiprocessing
+import ahmservers
+import ahmclients
+from ahmprotocols import DayTimeProtocol,HTTPStreamParser,SecureChannelProtocol
+
+
+####################################################################################################
+####################################################################################################
+###########       BENCHMARKS DE CARGA DE LOS SERVICIOS ECHO, DAYTIME Y HTTP              ######
+####################################################################################################
+####################################################################################################
+
+# Cada caso levanta un servidor en localhost (en un proceso propio) con un modo de atencion (handler TCP, UDP por lotes,
+# asyncore) y lo carga desde varios procesos generadores, cada uno con varias conexiones. Cada conexion envia un pedido,
+# espera la respuesta y mide la latencia (carga de lazo cerrado). Se reporta throughput y percentiles de latencia en JSON.
+#
+#	python ahmbenchmark.py --services echo-tcp,http --concurrency 32 --processes 4 --duration 5 --output actual.json
+#	python ahmbenchmark.py --compare base.json --output actual.json      # Retorna 1 si hay regresiones
+#
+# Con --input se comparan dos corridas ya guardadas, sin ejecutar benchmarks.
+#
+# secure-tcp es el echo sobre el canal cifrado (ver SecureChannelProtocol), comparado con RSA en cada mensaje. Requiere rsa y
+# cryptography (pip install rsa cryptography):
+#	rsa         RSA en cada mensaje (RSAEchoTCPServer), conexion persistente
+#	session     un handshake por conexion y luego mensajes con SessionCipher (ChaCha20-Poly1305), conexion persistente
+#	resumed     una conexion por pedido, reanudando la sesion anterior (sin RSA)
+#	handshake   una conexion por pedido, con un handshake completo (RSA) cada vez
+#
+#	python ahmbenchmark.py --services secure-tcp --payload-sizes 64,4096 --key-size 2048
+
+
+### SERVIDORES DE PRUEBA ##################################
+
+# Servidor HTTP que responde a cualquier request con un cuerpo fijo
+class BenchmarkHTTPServer(ahmservers.AbstractHTTPServer):
+
+	connectionsNumber = 128
+
+	def __init__(self,host,port,handler = "epoll",bodySize = 64):
+		self.body = "x" * bodySize
+		ahmservers.AbstractHTTPServer.__init__(self,host,port,handler)
+
+	def handleRequestStart(self,clientSock,requestLine,headers):
+		pass
+
+	def handleRequestEnd(self,clientSock,keepAlive):
+		headers = {"Content-Type":"text/plain","Connection":"keep-alive" if keepAlive else "close"}
+		self.sendHTTPResponse(clientSock,200,"OK",headers,self.body)
+
+
+# Las sub-clases solo amplian la cola de conexiones pendientes: con muchas conexiones concurrentes la cola
+# por defecto (10) hace que el kernel descarte SYNs y aparezcan demoras de 1 segundo que no son del servidor
+class BenchmarkEchoTCPServer(ahmservers.EchoTCPServer):
+
+	connectionsNumber = 128
+
+
+class BenchmarkDayTimeTCPServer(ahmservers.DayTimeTCPServer):
+
+	connectionsNumber = 128
+
+
+class BatchedEchoUDPServer(ahmservers.EchoUDPServer):
+
+	batchSize = 64
+
+
+class BatchedDayTimeUDPServer(ahmservers.DayTimeUDPServer):
+
+	batchSize = 64
+
+
+### CLIENTES DE CARGA ##################################
+
+# Conexion de carga. request() envia un pedido y espera la respuesta completa: retorna False si fallo.
+# Si persistent es False, se usa una conexion nueva por pedido (servidores con SimpleTCPHandler, que cierran luego de responder)
+class LoadConnection:
+
+	timeout = 5.0
+
+	def __init__(self,host,port,payloadSize,persistent = True):
+		self.host = host
+		self.port = port
+		self.payloadSize = payloadSize
+		self.persistent = persistent
+		self.socket = None
+
+	def connect(self):
+		raise NotImplementedError()
+
+	def exchange(self):
+		raise NotImplementedError()
+
+	def request(self):
+		try:
+			if not self.socket:
+				self.connect()
+			ok = self.exchange()
+		except (socket.error,socket.timeout,ValueError):
+			ok = False
+		if not ok or not self.persistent:
+			self.close()
+		return ok
+
+	def close(self):
+		if self.socket:
+			self.socket.close()
+			self.socket = None
+
+
+class TCPLoadConnection(LoadConnection):
+
+	def connect(self):
+		self.socket = socket.create_connection((self.host,self.port),self.timeout)
+		self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+
+	# Lee exactamente size bytes
+	def receiveExactly(self,size):
+		received = []
+		while size > 0:
+			data = self.socket.recv(min(size,65536))
+			if not data:
+				return None
+			received.append(data)
+			size -= len(data)
+		return ''.join(received)
+
+
+class UDPLoadConnection(LoadConnection):
+
+	def connect(self):
+		self.socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.socket.settimeout(self.timeout)
+		self.socket.connect((self.host,self.port))   # Solo se aceptan datagramas del servidor
+
+
+# Echo TCP: los datos terminan con "\0". EchoTCPServer responde sin el delimitador, AsyncEchoTCPServer responde lo recibido
+class EchoTCPLoadConnection(TCPLoadConnection):
+
+	echoesDelimiter = False
+
+	def __init__(self,host,port,payloadSize,persistent = True):
+		TCPLoadConnection.__init__(self,host,port,payloadSize,persistent)
+		self.payload = "x" * payloadSize
+
+	def exchange(self):
+		self.socket.sendall(self.payload + "\0")
+		expected = len(self.payload) + (1 if self.echoesDelimiter else 0)
+		return self.receiveExactly(expected) is not None
+
+
+class AsyncEchoTCPLoadConnection(EchoTCPLoadConnection):
+
+	echoesDelimiter = True
+
+
+class EchoUDPLoadConnection(UDPLoadConnection):
+
+	def __init__(self,host,port,payloadSize,persistent = True):
+		UDPLoadConnection.__init__(self,host,port,min(payloadSize,65507),persistent)
+		self.payload = "x" * self.payloadSize
+
+	def exchange(self):
+		self.socket.send(self.payload)
+		return len(self.socket.recv(65535)) == len(self.payload)
+
+
+# DayTime binario: consulta la hora de un pais al azar de countryCodes
+class DayTimeTCPLoadConnection(TCPLoadConnection):
+
+	countryCodes = ["AR","US","BR","ES","RU","AU","CN","IN","DE","MX"]
+
+	def exchange(self):
+		self.socket.sendall(DayTimeProtocol.getBinaryRequestPDU(random.choice(self.countryCodes)))
+		header = self.receiveExactly(DayTimeProtocol.BINARY_HEADER.size)
+		if header is None:
+			return False
+		answerCount = DayTimeProtocol.BINARY_HEADER.unpack(header)[4]
+		return answerCount == 0 or self.receiveExactly(answerCount * DayTimeProtocol.BINARY_ANSWER.size) is not None
+
+
+class DayTimeUDPLoadConnection(UDPLoadConnection):
+
+	countryCodes = DayTimeTCPLoadConnection.countryCodes
+
+	def exchange(self):
+		self.socket.send(DayTimeProtocol.getBinaryRequestPDU(random.choice(self.countryCodes)))
+		return DayTimeProtocol.isBinaryPDU(self.socket.recv(65535))
+
+
+# Echo sobre el canal cifrado. Si la conexion no es persistente cada pedido abre una conexion nueva, que reanuda la sesion
+# de la anterior (resumeSessions) o hace un handshake completo. serverKey es la clave publica del servidor (ver runBenchmarks)
+class SecureLoadConnection(LoadConnection):
+
+	resumeSessions = True
+	serverKey = None
+
+	def __init__(self,host,port,payloadSize,persistent = True):
+		LoadConnection.__init__(self,host,port,payloadSize,persistent)
+		self.payload = "x" * payloadSize
+		self.session = None
+		self.client = None
+
+	def connect(self):
+		self.client = ahmclients.SecureTCPClient(self.host,self.port,timeout = self.timeout,session = self.session if self.resumeSessions else None,
+			serverKey = self.serverKey)
+		self.session = self.client.session
+		self.socket = self.client.socket
+
+	def exchange(self):
+		return self.client.request(self.payload) == self.payload
+
+
+class FullHandshakeLoadConnection(SecureLoadConnection):
+
+	resumeSessions = False
+
+
+# Echo con RSA en cada mensaje. Todas las conexiones usan la misma clave de cliente (privateKey, ver runBenchmarks)
+class RSALoadConnection(SecureLoadConnection):
+
+	privateKey = None
+
+	def connect(self):
+		self.client = ahmclients.RSATCPClient(self.host,self.port,timeout = self.timeout,privateKey = self.privateKey)
+		self.socket = self.client.socket
+
+
+class HTTPLoadConnection(TCPLoadConnection):
+
+	def __init__(self,host,port,payloadSize,persistent = True):
+		TCPLoadConnection.__init__(self,host,port,payloadSize,persistent)
+		connection = "keep-alive" if persistent else "close"
+		self.requestData = "GET /benchmark HTTP/1.1\r\nHost: " + host + "\r\nConnection: " + connection + "\r\n\r\n"
+
+	def exchange(self):
+		self.socket.sendall(self.requestData)
+		parser = HTTPStreamParser(isRequest = False)
+		parser.expectResponseTo("GET")
+		while True:
+			data = self.socket.recv(65536)
+			events = parser.feed(data) if data else parser.close()
+			for event in events:
+				if event[0] == HTTPStreamParser.END:
+					return True
+			if not data:
+				return False
+
+
+### CASOS DE BENCHMARK ##################################
+
+# Los servidores asyncore viven en ahmasyncservers, que se importa solo al levantar esos casos
+def createAsyncServer(className,host,port):
+	import ahmasyncservers
+	return getattr(ahmasyncservers,className)(host,port)
+
+# (servicio,modo) => (crea el servidor (host,port,opciones), clase de conexion de carga, conexiones persistentes)
+def createTargets():
+	TCP = ahmservers.AbstractTCPServer
+	targets = {}
+	for mode in (TCP.SINGLE,TCP.MULTIPLE,TCP.EPOLL,TCP.THREADPOOL):
+		persistent = mode != TCP.SINGLE
+		targets[("echo-tcp",mode)] = (lambda host,port,options,mode = mode: BenchmarkEchoTCPServer(host,port,mode),EchoTCPLoadConnection,persistent)
+		targets[("daytime-tcp",mode)] = (lambda host,port,options,mode = mode: BenchmarkDayTimeTCPServer(host,port,options.zones,handler = mode),DayTimeTCPLoadConnection,persistent)
+		if mode != TCP.SINGLE:   # AbstractHTTPServer no admite SimpleTCPHandler
+			targets[("http",mode)] = (lambda host,port,options,mode = mode: BenchmarkHTTPServer(host,port,mode,options.payloadSize),HTTPLoadConnection,persistent)
+	targets[("echo-tcp","async")] = (lambda host,port,options: createAsyncServer("AsyncEchoTCPServer",host,port),AsyncEchoTCPLoadConnection,True)
+	targets[("echo-udp","blocking")] = (lambda host,port,options: ahmservers.EchoUDPServer(host,port),EchoUDPLoadConnection,True)
+	targets[("echo-udp","batched")] = (lambda host,port,options: BatchedEchoUDPServer(host,port),EchoUDPLoadConnection,True)
+	targets[("echo-udp","async")] = (lambda host,port,options: createAsyncServer("AsyncEchoUDPServer",host,port),EchoUDPLoadConnection,True)
+	targets[("daytime-udp","blocking")] = (lambda host,port,options: ahmservers.DayTimeUDPServer(host,port,options.zones),DayTimeUDPLoadConnection,True)
+	targets[("daytime-udp","batched")] = (lambda host,port,options: BatchedDayTimeUDPServer(host,port,options.zones),DayTimeUDPLoadConnection,True)
+	createSecureServer = lambda host,port,options: ahmservers.SecureEchoTCPServer(host,port,TCP.EPOLL,options.serverKey)
+	targets[("secure-tcp","rsa")] = (lambda host,port,options: ahmservers.RSAEchoTCPServer(host,port,TCP.EPOLL,options.serverKey),RSALoadConnection,True)
+	targets[("secure-tcp","session")] = (createSecureServer,SecureLoadConnection,True)
+	targets[("secure-tcp","resumed")] = (createSecureServer,SecureLoadConnection,False)
+	targets[("secure-tcp","handshake")] = (createSecureServer,FullHandshakeLoadConnection,False)
+	return targets
+
+TARGETS = createTargets()
+SERVICES = ["echo-tcp","echo-udp","daytime-tcp","daytime-udp","http","secure-tcp"]
+PAYLOAD_SERVICES = ["echo-tcp","echo-udp","http","secure-tcp"]   # Servicios en los que el tamaño del payload cambia el pedido o la respuesta
+
+
+### EJECUCION ##################################
+
+def findFreePort(host,sockType):
+	sock = socket.socket(socket.AF_INET,sockType)
+	sock.bind((host,0))
+	port = sock.getsockname()[1]
+	sock.close()
+	return port
+
+# Proceso del servidor. La salida estandar se descarta (los servidores imprimen cada conexion)
+def serveTarget(createServer,host,port,options,ready):
+	sys.stdout = open(os.devnull,"w")
+	server = createServer(host,port,options)
+	ready.set()
+	server.run()
+
+# Proceso generador de carga: connections hilos, cada uno con su conexion, hasta endTime. Solo se miden los pedidos
+# iniciados luego de measureTime (calentamiento). Envia por results (requests,errores,latencias en segundos)
+def generateLoad(connectionClass,host,port,options,persistent,connections,measureTime,endTime,results):
+	latencies = array.array("d")
+	counters = [0,0]   # pedidos,errores
+	lock = threading.Lock()
+	def runConnection():
+		connection = connectionClass(host,port,options.payloadSize,persistent)
+		local = array.array("d")
+		requests = errors = 0
+		while True:
+			start = time.time()
+			if start >= endTime:
+				break
+			ok = connection.request()
+			if start < measureTime:
+				continue
+			requests += 1
+			if ok:
+				local.append(time.time() - start)
+			else:
+				errors += 1
+		connection.close()
+		with lock:
+			latencies.extend(local)
+			counters[0] += requests
+			counters[1] += errors
+	threads = [threading.Thread(target = runConnection) for index in range(connections)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	results.put((counters[0],counters[1],latencies.tostring()))
+
+# Percentil (0 < percentile <= 1) de una lista ordenada
+def percentile(sortedValues,percentile):
+	if not sortedValues:
+		return None
+	index = min(int(math.ceil(percentile * len(sortedValues))) - 1,len(sortedValues) - 1)
+	return sortedValues[max(index,0)]
+
+def toMilliseconds(value):
+	return round(value * 1000.0,3) if value is not None else None
+
+# Ejecuta un caso. Retorna el diccionario de resultados
+def runCase(service,mode,options):
+	createServer, connectionClass, persistent = TARGETS[(service,mode)]
+	host = options.host
+	port = findFreePort(host,socket.SOCK_DGRAM if service.endswith("udp") else socket.SOCK_STREAM)
+	ready = multiprocessing.Event()
+	server = multiprocessing.Process(target = serveTarget,args = (createServer,host,port,options,ready))
+	server.daemon = True
+	server.start()
+	try:
+		if not ready.wait(30) or not server.is_alive():
+			raise RuntimeError("El servidor " + service + "/" + mode + " no inicio")
+		time.sleep(0.2)   # El socket ya esta creado: solo resta que el servidor entre en su bucle principal
+		processes = max(1,min(options.processes,options.concurrency))
+		measureTime = time.time() + 0.5 + options.warmup   # 0.5s para que todos los procesos arranquen
+		endTime = measureTime + options.duration
+		results = multiprocessing.Queue()
+		generators = []
+		for index in range(processes):
+			connections = options.concurrency // processes + (1 if index < options.concurrency % processes else 0)
+			generator = multiprocessing.Process(target = generateLoad,args = (connectionClass,host,port,options,persistent,connections,measureTime,endTime,results))
+			generator.start()
+			generators.append(generator)
+		requests = errors = 0
+		latencies = array.array("d")
+		for generator in generators:   # Se leen los resultados antes del join, para no bloquear a los procesos en el put
+			processRequests, processErrors, processLatencies = results.get()
+			requests += processRequests
+			errors += processErrors
+			latencies.fromstring(processLatencies)
+		for generator in generators:
+			generator.join()
+	finally:
+		server.terminate()
+		server.join()
+	latencies = sorted(latencies)
+	return {
+		"service":service,
+		"mode":mode,
+		"concurrency":options.concurrency,
+		"processes":processes,
+		"payloadSize":options.payloadSize if service in PAYLOAD_SERVICES else None,
+		"duration":options.duration,
+		"requests":requests,
+		"errors":errors,
+		"throughput":round((requests - errors) / float(options.duration),1),
+		"latency":{
+			"mean":toMilliseconds(sum(latencies) / len(latencies) if latencies else None),
+			"p50":toMilliseconds(percentile(latencies,0.5)),
+			"p99":toMilliseconds(percentile(latencies,0.99)),
+			"p999":toMilliseconds(percentile(latencies,0.999)),
+			"max":toMilliseconds(latencies[-1] if latencies else None),
+		},
+	}
+
+# Archivo de zonas (Cod.Pais<TAB>Zona) generado a partir de pytz, para los servidores DayTime
+def createZonesFile():
+	import pytz
+	zonesFile, zonesFileName = tempfile.mkstemp(prefix = "ahmbenchmark",suffix = ".txt")
+	with os.fdopen(zonesFile,"w") as f:
+		for countryCode in sorted(pytz.country_timezones):
+			for zoneName in pytz.country_timezones[countryCode]:
+				f.write(str(countryCode) + "\t" + str(zoneName) + "\n")
+	return zonesFileName
+
+def runBenchmarks(options):
+	removeZones = False
+	if not options.zones and any(service.startswith("daytime") for service in options.services):
+		options.zones = createZonesFile()
+		removeZones = True
+	if "secure-tcp" in options.services:   # Las claves RSA se generan una vez: los procesos de servidor y de carga las heredan
+		options.serverKey = SecureChannelProtocol.createKeys(options.keySize)[1]
+		SecureLoadConnection.serverKey = SecureChannelProtocol.getPublicKey(options.serverKey)
+		RSALoadConnection.privateKey = SecureChannelProtocol.createKeys(options.keySize)[1]
+	results = []
+	try:
+		for service in options.services:
+			modes = [mode for targetService,mode in sorted(TARGETS) if targetService == service and (not options.modes or mode in options.modes)]
+			payloadSizes = options.payloadSizes if service in PAYLOAD_SERVICES else options.payloadSizes[:1]
+			for mode in modes:
+				for payloadSize in payloadSizes:
+					options.payloadSize = payloadSize
+					result = runCase(service,mode,options)
+					printResult(result)
+					results.append(result)
+	finally:
+		if removeZones:
+			os.remove(options.zones)
+			removeZoneIndex(options.zones)
+	return {
+		"timestamp":datetime.datetime.utcnow().isoformat() + "Z",
+		"python":platform.python_version(),
+		"platform":platform.platform(),
+		"cpus":multiprocessing.cpu_count(),
+		"results":results,
+	}
+
+# El indice compilado del archivo de zonas (ver CompiledZoneDatabase) se crea junto al archivo
+def removeZoneIndex(zonesFileName):
+	try:
+		os.remove(zonesFileName + ".idx")
+	except OSError:
+		pass
+
+def printResult(result):
+	latency = result["latency"]
+	print "%-12s %-10s payload=%-6s c=%-4d %10.1f req/s  p50=%sms p99=%sms p999=%sms errores=%d" % (result["service"],result["mode"],
+		result["payloadSize"],result["concurrency"],result["throughput"],latency["p50"],latency["p99"],latency["p999"],result["errors"])
+
+
+### COMPARACION DE CORRIDAS ##################################
+
+def resultKey(result):
+	return (result["service"],result["mode"],result["concurrency"],result["payloadSize"])
+
+# Compara los casos presentes en ambas corridas. Es una regresion si el throughput baja, o el p99 sube, mas de tolerance (fraccion)
+# Retorna la lista de regresiones (textos)
+def compareRuns(baseline,current,tolerance):
+	baseResults = dict((resultKey(result),result) for result in baseline["results"])
+	regressions = []
+	for result in current["results"]:
+		base = baseResults.get(resultKey(result))
+		if not base:
+			continue
+		name = "%s/%s c=%d payload=%s" % resultKey(result)
+		throughputChange = (result["throughput"] - base["throughput"]) / base["throughput"] if base["throughput"] else 0.0
+		p99, baseP99 = result["latency"]["p99"], base["latency"]["p99"]
+		p99Change = (p99 - baseP99) / baseP99 if p99 is not None and baseP99 else 0.0
+		print "%-40s throughput %+6.1f%%  p99 %+6.1f%%" % (name,throughputChange * 100,p99Change * 100)
+		if throughputChange < -tolerance:
+			regressions.append(name + ": throughput " + str(base["throughput"]) + " -> " + str(result["throughput"]) + " req/s")
+		if p99Change > tolerance:
+			regressions.append(name + ": p99 " + str(baseP99) + " -> " + str(p99) + " ms")
+	return regressions
+
+
+def parseArguments(arguments):
+	def csv(value):
+		return [item for item in value.split(",") if item]
+	def intCsv(value):
+		return [int(item) for item in csv(value)]
+	parser = argparse.ArgumentParser(description = "Benchmarks de carga de los servicios echo, daytime y HTTP")
+	parser.add_argument("--services",type = csv,default = SERVICES,help = "Servicios separados por coma: " + ",".join(SERVICES))
+	parser.add_argument("--modes",type = csv,default = None,help = "Modos de atencion (single,multiple,epoll,threadpool,async,blocking,batched,rsa,session,resumed,handshake). Por defecto todos")
+	parser.add_argument("--concurrency",type = int,default = 16,help = "Conexiones concurrentes en total")
+	parser.add_argument("--processes",type = int,default = multiprocessing.cpu_count(),help = "Procesos generadores de carga")
+	parser.add_argument("--payload-sizes",dest = "payloadSizes",type = intCsv,default = [64],help = "Tamaños de payload en bytes, separados por coma")
+	parser.add_argument("--duration",type = float,default = 5.0,help = "Segundos medidos por caso")
+	parser.add_argument("--warmup",type = float,default = 1.0,help = "Segundos de calentamiento (no medidos) por caso")
+	parser.add_argument("--key-size",dest = "keySize",type = int,default = 2048,help = "Bits de las claves RSA de secure-tcp")
+	parser.add_argument("--host",default = "127.0.0.1")
+	parser.add_argument("--zones",default = None,help = "Archivo de zonas de los servidores DayTime. Por defecto se genera a partir de pytz")
+	parser.add_argument("--output",default = None,help = "Archivo JSON de resultados. Por defecto se imprime por salida estandar")
+	parser.add_argument("--input",default = None,help = "Usar los resultados de este JSON en lugar de ejecutar los benchmarks")
+	parser.add_argument("--compare",default = None,help = "JSON de una corrida anterior contra la que se compara")
+	parser.add_argument("--tolerance",type = float,default = 0.10,help = "Variacion tolerada antes de considerar una regresion (0.10 = 10%%)")
+	options = parser.parse_args(arguments)
+	for service in options.services:
+		if service not in SERVICES:
+			parser.error("Servicio desconocido: " + service)
+	return options
+
+def main(arguments):
+	options = parseArguments(arguments)
+	if options.input:
+		with open(options.input) as f:
+			current = json.load(f)
+	else:
+		current = runBenchmarks(options)
+	if options.output:
+		with open(options.output,"w") as f:
+			json.dump(current,f,indent = 2,sort_keys = True,separators = (",",": "))
+	elif not options.input:
+		print json.dumps(current,indent = 2,sort_keys = True)
+	if options.compare:
+		with open(options.compare) as f:
+			regressions = compareRuns(json.load(f),current,options.tolerance)
+		for regression in regressions:
+			print "REGRESION " + regression
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
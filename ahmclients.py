@@ -22,16 +22,15 @@
 #  
 #  
 import socket
-import struct
-from urlparse import urlparse
-from ahmprotocols import DayTimeProtocol,HTTPProtocol,TCPDataReceiver,Now
-import json
+import select
+import errno
+import heapq
+import random
+import threading
+import Queue
+import collections
+from ahmprotocols import DayTimeProtocol,HTTPProtocol,TCPDataReceiver,Now,BufferPool,ReceiveBuffer,HTTPStreamParser,RequestIdEnvelope,HTTPResponse,LengthPrefixFrameDecoder,DelimiterFrameDecoder,SecureChannelProtocol,SessionCipher,RSAMessageProtocol
 import time
-import rsa
-import datetime
-import pprint
-import thread
-from base64 import b64encode
 
 	
 	
@@ -45,9 +44,12 @@ from base64 import b64encode
 	#    		AbstractTCPClient		  											   AbstractUDPClient
 	#               |																			|		
 	#				|																			|
-	#		--------------------------------------------------------------				        ----------
-	#		|					|					|					 |			   					|	
-	#	BasicTCPClient		BasicHTTPClient		DayTimeTCPClient   RemoteTerminalClient	         BasicUDPClient
+	#		--------------------------------------------------------------				        --------------------------------
+	#		|					|					|					 |			   					|
+	#	BasicTCPClient		BasicHTTPClient		DayTimeTCPClient   RemoteTerminalClient	       BasicUDPClient		ReliableUDPClient
+	#																																|
+	#																																|
+	#																													   ReliableDayTimeUDPClient
 
 ####################################################################################################
 ####################################################################################################
@@ -104,24 +106,20 @@ class AbstractTCPClient(AbstractClient):
 		data = self.socket.recv(bufferSize)
 		return data		
 	
-	# Override. fuente: http://code.activestate.com/recipes/408859-socketrecv-three-ways-to-turn-it-into-recvall/
+	# Override. Recibe hasta el caracter de corte "\0" (aunque llegue junto con los datos)
 	def receiveEndData(self,bufferSize):
-		total_data=[]
-		while True:
-			data = self.socket.recv(bufferSize)
-			if not data or data == "\0":
-				break
-			total_data.append(data)
-		return ''.join(total_data)
+		return TCPDataReceiver.receiveEndData(self.socket,"\0",bufferSize)
+		
+	# Recibe las tramas completas enviadas por un AbstractFramedTCPServer. El decodificador se debe conservar entre llamadas
+	def receiveFrames(self,decoder,bufferSize):
+		return TCPDataReceiver.receiveFrames(self.socket,decoder,bufferSize)
 		
+	# Recibe hasta que el servidor cierra la conexion. Los datos se reciben con recv_into sobre un unico bytearray
 	def receiveData(self,bufferSize):
-		total_data=[]
-		while True:
-			data = self.socket.recv(bufferSize)
-			if not data:
-				break
-			total_data.append(data)
-		return ''.join(total_data)
+		receiveBuffer = ReceiveBuffer(BufferPool(bufferSize,0))
+		while receiveBuffer.receive(self.socket):
+			pass
+		return receiveBuffer.getData().tobytes()
 		
 	def connectSocket(self):
 		self.socket.connect((self.host, self.port))         # Inicia la conexión TCP contra el servidor
@@ -152,13 +150,17 @@ class AbstractUDPClient(AbstractClient):
 		receive = self.socket.recvfrom(bufferSize) 
 		return receive	
 	
+	# Recibe datagramas hasta recibir uno vacio. Cada datagrama se recibe con recvfrom_into a continuacion del anterior
 	def receiveData(self,bufferSize):
-		data = ""
-		receive = self.socket.recvfrom(bufferSize)
-		while len(receive):
-			data += receive
-			receive = self.socket.recvfrom(bufferSize) 
-		return data	
+		receiveBuffer = ReceiveBuffer(BufferPool(bufferSize,0))
+		while True:
+			if len(receiveBuffer.buffer) - receiveBuffer.size < bufferSize:
+				receiveBuffer.grow()
+			received, address = self.socket.recvfrom_into(receiveBuffer.view[receiveBuffer.size:],bufferSize)
+			if not received:
+				break
+			receiveBuffer.size += received
+		return receiveBuffer.getData().tobytes()
 		
 # Cliente TCP Basico
 # Inicia conexion contra un servidor TCP, envia una serie de datos, e imprime por salida estandar la respuesta del servidor
@@ -176,8 +178,152 @@ class BasicTCPClient(AbstractTCPClient):
 		self.socket.close()
 
 			
+# Cliente UDP confiable. Cada pedido viaja con un id (RequestIdEnvelope), por lo que se pueden tener muchos pedidos en vuelo
+# sobre un mismo socket: las respuestas se asocian al pedido por su id, sin importar el orden en que lleguen.
+# Si la respuesta no llega en timeout segundos se retransmite el pedido, duplicando la espera (backoff exponencial, hasta maxTimeout).
+# Luego de retries retransmisiones el pedido se da por perdido y su respuesta es None.
+# Las respuestas duplicadas o que llegan luego de vencido el pedido se descartan. El socket se conecta al servidor, por lo que el
+# kernel descarta los datagramas de cualquier otra direccion (un id de pedido adivinado no alcanza para falsificar una respuesta).
+# El servidor debe atender el sobre (requestIds = True, ej: ReliableEchoUDPServer o ReliableDayTimeUDPServer en ahmservers).
+#
+#	client = ReliableUDPClient(host,port)
+#	responses = client.requestMany(["a","b","c"])           # Sincronico, respuestas en el orden de los pedidos
+#
+#	requestId = client.submit("a",callback)                   # Asincronico: callback(requestId,respuesta)
+#	while client.inFlight():
+#		client.poll()
+class ReliableUDPClient(AbstractUDPClient):
+	
+	bufferSize = 65535
+	
+	def __init__(self,host,port,data = None,timeout = 0.5,retries = 4,backoff = 2.0,maxTimeout = 8.0,maxInFlight = 1024):
+		AbstractUDPClient.__init__(self,host,port,data)
+		self.socket.connect((self.host,self.port))   # Solo se reciben datagramas del servidor
+		self.socket.setblocking(0)
+		self.timeout = timeout           # Espera de la primera respuesta
+		self.retries = retries           # Retransmisiones antes de dar por perdido el pedido
+		self.backoff = backoff
+		self.maxTimeout = maxTimeout
+		self.maxInFlight = maxInFlight   # Pedidos en vuelo como maximo en requestMany
+		self.nextRequestId = random.randint(0,RequestIdEnvelope.MAX_REQUEST_ID)   # Respuestas tardias de otro cliente no coinciden
+		self.pending = {}     # id => [datos,retransmisiones,espera actual,callback]
+		self.timers = []      # heap de (vencimiento,id,retransmisiones). Las entradas de pedidos ya respondidos se descartan al salir
+		self.responses = {}   # id => respuesta, para los pedidos sin callback
+		self.retransmissions = 0
+		self.timeouts = 0
+		
+	def inFlight(self):
+		return len(self.pending)
+		
+	# Envia un pedido y retorna su id. La respuesta se entrega a callback(requestId,respuesta) o queda en responses
+	def submit(self,data,callback = None):
+		requestId = self.nextRequestId
+		self.nextRequestId = (requestId + 1) & RequestIdEnvelope.MAX_REQUEST_ID
+		data = RequestIdEnvelope.wrap(requestId,data)
+		self.pending[requestId] = [data,0,self.timeout,callback]
+		heapq.heappush(self.timers,(time.time() + self.timeout,requestId,0))
+		self.sendData(data)
+		return requestId
+		
+	def sendData(self,data):
+		try:
+			self.socket.send(data)
+		except socket.error as e:
+			if e.args[0] not in (errno.EAGAIN,errno.EWOULDBLOCK,errno.ENOBUFS,errno.ECONNREFUSED):
+				raise
+			# Buffer de envio lleno (o ICMP port unreachable de un envio anterior): se trata como un datagrama perdido,
+			# se retransmite al vencer la espera
+			
+	# Espera respuestas hasta timeout segundos (None: hasta el proximo vencimiento). Retorna la cantidad de pedidos finalizados
+	def poll(self,timeout = None):
+		finished = 0
+		wait = timeout
+		if self.timers:
+			untilExpiry = max(self.timers[0][0] - time.time(),0)
+			wait = untilExpiry if wait is None else min(wait,untilExpiry)
+		try:
+			readSockets = select.select([self.socket],[],[],wait)[0]
+		except select.error as e:
+			if e.args[0] != errno.EINTR:
+				raise
+			readSockets = []
+		if readSockets:
+			finished += self.receiveResponses()
+		return finished + self.checkTimers()
+		
+	# Lee todas las respuestas disponibles en el socket
+	def receiveResponses(self):
+		finished = 0
+		while True:
+			try:
+				data, address = self.socket.recvfrom(self.bufferSize)
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+					return finished
+				if e.args[0] == errno.ECONNREFUSED:   # ICMP port unreachable de un envio anterior
+					continue
+				raise
+			requestId, data = RequestIdEnvelope.unwrap(data)
+			if requestId in self.pending:
+				self.finishRequest(requestId,data)
+				finished += 1
+				
+	# Retransmite los pedidos vencidos y da por perdidos los que agotaron las retransmisiones
+	def checkTimers(self):
+		finished = 0
+		now = time.time()
+		while self.timers and self.timers[0][0] <= now:
+			expiry, requestId, retransmissions = heapq.heappop(self.timers)
+			request = self.pending.get(requestId)
+			if request is None or request[1] != retransmissions:
+				continue
+			if retransmissions >= self.retries:
+				self.timeouts += 1
+				self.finishRequest(requestId,None)
+				finished += 1
+				continue
+			request[1] += 1
+			request[2] = min(request[2] * self.backoff,self.maxTimeout)
+			heapq.heappush(self.timers,(now + request[2],requestId,request[1]))
+			self.retransmissions += 1
+			self.sendData(request[0])
+		return finished
+		
+	def finishRequest(self,requestId,response):
+		callback = self.pending.pop(requestId)[3]
+		if callback:
+			callback(requestId,response)
+		else:
+			self.responses[requestId] = response
+			
+	# Envia un pedido y espera su respuesta (None si se perdio)
+	def request(self,data):
+		requestId = self.submit(data)
+		while requestId in self.pending:
+			self.poll()
+		return self.responses.pop(requestId)
+		
+	# Envia todos los pedidos, con hasta maxInFlight en vuelo a la vez. Retorna las respuestas en el orden de los pedidos
+	def requestMany(self,requests):
+		responses = [None] * len(requests)
+		requestIndexes = {}
+		def store(requestId,response):
+			responses[requestIndexes.pop(requestId)] = response
+		for index,data in enumerate(requests):
+			while len(self.pending) >= self.maxInFlight:
+				self.poll()
+			requestIndexes[self.submit(data,store)] = index
+		while requestIndexes:
+			self.poll()
+		return responses
+		
+	def close(self):
+		self.socket.close()
+		
+		
 # Cliente UDP Basico
-# Inicia conexion contra un servidor TCP, envia una serie de datos, e imprime por salida estandar la respuesta del servidor			
+# Inicia conexion contra un servidor UDP, envia una serie de datos, e imprime por salida estandar la respuesta del servidor
+# (para reintentos ante datagramas perdidos, ver ReliableUDPClient)
 class BasicUDPClient(AbstractUDPClient):
 	
 	def __init__(self,host,port,data = None):
@@ -192,3 +338,351 @@ class BasicUDPClient(AbstractUDPClient):
 		self.socket.close()
 		
 		
+# Cliente DayTime UDP
+# Consulta la hora de un pais (getTime) o de varios paises en un unico query (getTimes). Por defecto usa el formato binario del protocolo.
+class DayTimeUDPClient(AbstractUDPClient):
+	
+	bufferSize = 65535   # Las respuestas de varios paises pueden superar los 4096 bytes
+	
+	def __init__(self,host,port,data = None,binary = True,timeout = 5.0):
+		AbstractUDPClient.__init__(self,host,port,data)
+		self.binary = binary
+		self.socket.settimeout(timeout)
+		
+	def query(self,pdu):
+		self.sendData(pdu)
+		return self.receiveSingleData(self.bufferSize)[0]
+		
+	# Retorna la respuesta parseada (DayTimeResponse o BinaryDayTimeResponse): answers = [[nombre_zona,tiempo],...]
+	def getTime(self,countryCode = None):
+		if self.binary:
+			return DayTimeProtocol.parseBinaryResponse(self.query(DayTimeProtocol.getBinaryRequestPDU(countryCode)))
+		return DayTimeProtocol.parseResponse(self.query(DayTimeProtocol.getRequestPDU(countryCode)))
+		
+	# Retorna diccionario { Cod.Pais => [[nombre_zona,tiempo],...] } (None para los paises no encontrados)
+	def getTimes(self,countryCodes):
+		return DayTimeProtocol.parseBinaryBatchResponse(self.query(DayTimeProtocol.getBinaryBatchRequestPDU(countryCodes)))
+		
+	def run(self):
+		for zoneName,time in self.getTime().answers:
+			print zoneName.strip() + ": " + time
+		self.socket.close()
+		
+		
+# Cliente DayTime UDP confiable: muchas consultas en vuelo sobre un mismo socket, con retransmisiones (ver ReliableUDPClient).
+# Requiere un ReliableDayTimeUDPServer
+class ReliableDayTimeUDPClient(ReliableUDPClient):
+	
+	# Retorna la respuesta parseada (igual que DayTimeUDPClient.getTime), o None si no hubo respuesta
+	def getTime(self,countryCode = None):
+		return self.getTimeMany([countryCode])[0]
+		
+	# Una consulta por pais, todas en vuelo a la vez. Retorna las respuestas parseadas en el orden de countryCodes
+	def getTimeMany(self,countryCodes):
+		responses = self.requestMany([DayTimeProtocol.getBinaryRequestPDU(countryCode) for countryCode in countryCodes])
+		return [DayTimeProtocol.parseBinaryResponse(response) if response is not None else None for response in responses]
+		
+		
+# Pool de conexiones persistentes (keep-alive) contra un host:puerto.
+#	- Como maximo maxConnections conexiones abiertas. Si estan todas en uso, checkout espera a que se libere una.
+#	- Las conexiones libres por mas de idleTimeout segundos se cierran.
+#	- Al tomar una conexion libre se verifica que el servidor no la haya cerrado (health-check).
+class HTTPConnectionPool:
+	
+	def __init__(self,host,port,maxConnections = 8,idleTimeout = 30.0,timeout = 10.0):
+		self.host = host
+		self.port = port
+		self.maxConnections = maxConnections
+		self.idleTimeout = idleTimeout
+		self.timeout = timeout
+		self.idleConnections = []   # (sock,momento en que se libero). La ultima es la usada mas recientemente
+		self.openConnections = 0
+		self.condition = threading.Condition()
+		
+	# Retorna (sock,reutilizada)
+	def checkout(self):
+		with self.condition:
+			while True:
+				while self.idleConnections:
+					sock, releasedAt = self.idleConnections.pop()
+					if time.time() - releasedAt < self.idleTimeout and HTTPConnectionPool.isAlive(sock):
+						return sock,True
+					self.closeConnection(sock)
+				if self.openConnections < self.maxConnections:
+					self.openConnections += 1
+					break
+				self.condition.wait()
+		try:
+			sock = socket.create_connection((self.host,self.port),self.timeout)
+			sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		except:
+			with self.condition:
+				self.openConnections -= 1
+				self.condition.notify()
+			raise
+		return sock,False
+		
+	# Devuelve una conexion que puede reutilizarse
+	def checkin(self,sock):
+		with self.condition:
+			self.idleConnections.append((sock,time.time()))
+			self.condition.notify()
+			
+	# Cierra una conexion que no se puede reutilizar
+	def discard(self,sock):
+		with self.condition:
+			self.closeConnection(sock)
+			self.condition.notify()
+			
+	def closeConnection(self,sock):
+		self.openConnections -= 1
+		sock.close()
+		
+	def close(self):
+		with self.condition:
+			while self.idleConnections:
+				self.closeConnection(self.idleConnections.pop()[0])
+				
+	# Una conexion libre no deberia tener datos para leer: si es legible, el servidor la cerro (o envio datos inesperados)
+	@staticmethod
+	def isAlive(sock):
+		try:
+			readable, writable, errors = select.select([sock],[],[sock],0)
+		except (select.error,socket.error):
+			return False
+		return not readable and not errors
+		
+		
+# Cliente HTTP/1.1 que reutiliza conexiones: mantiene un HTTPConnectionPool por host:puerto.
+# Los requests se arman con HTTPProtocol.createRequest y las respuestas se leen con HTTPStreamParser.
+# request retorna la respuesta como HTTPProtocol.parseHTTPResponse: HTTPResponse, indexable como [[httpVersion,status-code,reason-phrase],{headers},body]
+#
+#	client = PooledHTTPClient()
+#	response = client.request("localhost",8080,"GET","/status")
+#	responses = client.requestMany([("localhost",8080,"GET","/a"),("localhost",8080,"GET","/b")])
+class PooledHTTPClient:
+	
+	httpVersion = "HTTP/1.1"
+	IDEMPOTENT_METHODS = ("GET","HEAD","PUT","DELETE","OPTIONS","TRACE")   # Se pueden reintentar: el servidor pudo haber procesado el request
+	
+	def __init__(self,maxConnectionsPerHost = 8,idleTimeout = 30.0,timeout = 10.0):
+		self.maxConnectionsPerHost = maxConnectionsPerHost
+		self.idleTimeout = idleTimeout
+		self.timeout = timeout
+		self.pools = {}   # (host,port) => HTTPConnectionPool
+		self.lock = threading.Lock()
+		
+	def getPool(self,host,port):
+		with self.lock:
+			pool = self.pools.get((host,port))
+			if not pool:
+				pool = self.pools[(host,port)] = HTTPConnectionPool(host,port,self.maxConnectionsPerHost,self.idleTimeout,self.timeout)
+			return pool
+			
+	def request(self,host,port,method,resource,headers = None,body = ""):
+		requestHeaders = {"Host":host + ":" + str(port)}
+		if headers:
+			requestHeaders.update(headers)
+		if body:
+			requestHeaders["Content-Length"] = str(len(body))
+		requestData = HTTPProtocol.createRequest(host,port,requestHeaders,method,resource,self.httpVersion) + body
+		pool = self.getPool(host,port)
+		while True:
+			sock, reused = pool.checkout()
+			try:
+				response, keepAlive = self.sendRequest(sock,method,requestData)
+			except (socket.error,ValueError) as e:
+				pool.discard(sock)
+				if reused and not isinstance(e,socket.timeout) and not getattr(e,"responseStarted",False) and method.upper() in self.IDEMPOTENT_METHODS:
+					continue   # El servidor cerro la conexion persistente: reintento con una nueva
+				raise
+			if keepAlive:
+				pool.checkin(sock)
+			else:
+				pool.discard(sock)
+			return response
+			
+	# Envia el request y lee la respuesta completa. Retorna (respuesta,keepAlive)
+	def sendRequest(self,sock,method,requestData):
+		sock.sendall(requestData)
+		parser = HTTPStreamParser(False)
+		parser.expectResponseTo(method)
+		response = None
+		body = []
+		while True:
+			data = sock.recv(AbstractClient.bufferSize)
+			try:
+				events = parser.feed(data) if data else parser.close()
+			except ValueError as e:
+				e.responseStarted = response is not None or bool(data)
+				raise
+			for event in events:
+				if event[0] == HTTPStreamParser.MESSAGE:
+					response = event
+				elif event[0] == HTTPStreamParser.BODY:
+					body.append(event[1])
+				elif response[1][1][:1] == "1":   # Respuesta intermedia (100 Continue): se espera la final
+					body = []
+				else:
+					return HTTPResponse.fromParts(response[1],response[2],''.join(body)),event[1] and data != ""
+			if not data:
+				error = socket.error("La conexion se cerro sin respuesta")
+				error.responseStarted = response is not None
+				raise error
+				
+	# Ejecuta varios requests en paralelo con un conjunto fijo de threads que toman los requests de una cola: a lo sumo
+	# maxConnectionsPerHost por cada host distinto (mas threads solo esperarian una conexion del pool).
+	# requests: lista de tuplas con los parametros de request. Retorna las respuestas en el mismo orden (o la excepcion producida)
+	def requestMany(self,requests):
+		responses = [None] * len(requests)
+		pending = Queue.Queue()
+		for index,requestArgs in enumerate(requests):
+			pending.put((index,requestArgs))
+		def work():
+			while True:
+				try:
+					index, requestArgs = pending.get_nowait()
+				except Queue.Empty:
+					return
+				try:
+					responses[index] = self.request(*requestArgs)
+				except Exception as e:
+					responses[index] = e
+		hosts = len(set((requestArgs[0],requestArgs[1]) for requestArgs in requests))
+		threads = [threading.Thread(target = work) for index in range(min(len(requests),self.maxConnectionsPerHost * hosts))]
+		for requestThread in threads:
+			requestThread.start()
+		for requestThread in threads:
+			requestThread.join()
+		return responses
+		
+	def close(self):
+		with self.lock:
+			for pool in self.pools.values():
+				pool.close()
+				
+				
+# Cliente TCP de un AbstractFramedTCPServer. Conserva el decodificador y las tramas recibidas que todavia no se leyeron
+class AbstractFramedTCPClient(AbstractTCPClient):
+	
+	bufferSize = 65536
+	
+	def __init__(self,host,port,data = None,timeout = None):
+		self.timeout = timeout
+		self.decoder = self.createFrameDecoder()
+		self.pendingFrames = collections.deque()
+		AbstractTCPClient.__init__(self,host,port,data)
+		
+	def connectSocket(self):
+		self.socket.settimeout(self.timeout)
+		self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)   # Cada trama se envia completa: no esperar a juntar datos
+		AbstractTCPClient.connectSocket(self)
+		
+	def createFrameDecoder(self):
+		return LengthPrefixFrameDecoder()
+		
+	def sendFrame(self,frame):
+		self.sendData(self.decoder.encode(frame))
+		
+	def receiveFrame(self):
+		while not self.pendingFrames:
+			frames = self.receiveFrames(self.decoder,self.bufferSize)
+			if not frames:
+				raise socket.error("El servidor cerro la conexion")
+			self.pendingFrames.extend(frames)
+		return self.pendingFrames.popleft()
+		
+	def close(self):
+		self.socket.close()
+		
+		
+# Cliente del canal cifrado (ver AbstractSecureTCPServer en ahmservers). Hace el handshake al conectarse; request envia un mensaje
+# cifrado y retorna la respuesta descifrada. session (session_id,clave_maestra) se puede pasar a un cliente nuevo del mismo servidor
+# para reanudar la sesion sin RSA (resumed indica si el servidor la reanudo).
+# serverKey (rsa.PublicKey) es la clave publica del servidor, obtenida por un medio confiable: un handshake completo sin ella no
+# autenticaria al servidor (cualquiera en el camino podria presentar su propia clave), por lo que se rechaza con ValueError, igual
+# que un servidor con otra clave publica. Solo se puede omitir al reanudar una sesion, que el servidor autentica con la clave maestra.
+#
+#	client = SecureTCPClient(host,port,serverKey = publicKey)
+#	response = client.request("hola")
+#	client.close()
+#	client = SecureTCPClient(host,port,session = client.session,serverKey = publicKey)
+class SecureTCPClient(AbstractFramedTCPClient):
+	
+	def __init__(self,host,port,data = None,timeout = None,session = None,serverKey = None):
+		self.session = session
+		self.serverKey = serverKey
+		self.cipher = None
+		self.resumed = False
+		AbstractFramedTCPClient.__init__(self,host,port,data,timeout)
+		try:
+			self.handshake()
+		except:
+			self.close()   # Ej: servidor rechazado. No queda la conexion abierta hasta que se libere el cliente
+			raise
+		
+	def handshake(self):
+		clientRandom = SecureChannelProtocol.createRandom()
+		self.sendFrame(SecureChannelProtocol.createClientHello(clientRandom,self.session[0] if self.session else ""))
+		serverRandom, sessionId, publicKey = SecureChannelProtocol.parseServerHello(self.receiveFrame())
+		if publicKey is None:   # El servidor reanudo la sesion
+			if not self.session or sessionId != self.session[0]:
+				raise ValueError("El servidor reanudo una sesion desconocida")
+			masterKey = self.session[1]
+		else:
+			if self.serverKey is None:
+				raise ValueError("Handshake completo sin la clave publica del servidor (serverKey)")
+			if publicKey != self.serverKey:
+				raise ValueError("Clave publica del servidor inesperada")
+			masterKey = SecureChannelProtocol.createRandom(SecureChannelProtocol.MASTER_KEY_SIZE)
+			self.sendFrame(SecureChannelProtocol.createKeyExchange(masterKey,publicKey))
+			self.session = (sessionId,masterKey)
+		self.resumed = publicKey is None
+		self.cipher = SessionCipher(masterKey,clientRandom,serverRandom,True)
+		
+	def sendMessage(self,message):
+		self.sendFrame(SecureChannelProtocol.createDataPDU(self.cipher,message))
+		
+	def receiveMessage(self):
+		return SecureChannelProtocol.parseDataPDU(self.cipher,self.receiveFrame())
+		
+	def request(self,message):
+		self.sendMessage(message)
+		return self.receiveMessage()
+		
+	def run(self):
+		print "Respuesta del servidor: \n" + self.request(self.clientData)
+		self.close()
+		
+		
+# Cliente de un AbstractRSATCPServer (RSA en cada mensaje, ver RSAMessageProtocol en ahmprotocols). Se conserva para comparar con
+# SecureTCPClient. Generar la clave del cliente demora: conviene pasar la misma privateKey a todos los clientes
+class RSATCPClient(AbstractFramedTCPClient):
+	
+	keySize = 2048
+	
+	def __init__(self,host,port,data = None,timeout = None,privateKey = None):
+		if privateKey is None:
+			privateKey = SecureChannelProtocol.createKeys(self.keySize)[1]
+		self.privateKey = privateKey
+		self.publicKey = SecureChannelProtocol.getPublicKey(privateKey)
+		AbstractFramedTCPClient.__init__(self,host,port,data,timeout)
+		self.sendFrame(RSAMessageProtocol.createKeyLine(self.publicKey))
+		self.serverKey = RSAMessageProtocol.parseKeyLine(self.receiveFrame())
+		
+	def createFrameDecoder(self):
+		return DelimiterFrameDecoder("\n")
+		
+	def sendMessage(self,message):
+		self.sendFrame(RSAMessageProtocol.encryptMessage(message,self.serverKey))
+		
+	def receiveMessage(self):
+		return RSAMessageProtocol.decryptMessage(self.receiveFrame(),self.privateKey)
+		
+	def request(self,message):
+		self.sendMessage(message)
+		return self.receiveMessage()
+		
+	def run(self):
+		print "Respuesta del servidor: \n" + self.request(self.clientData)
+		self.close()
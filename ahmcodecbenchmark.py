@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmcodecbenchmark.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import gc
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+from datetime import datetime
+import pytz
+from ahmprotocols import DayTimeProtocol,HTTPProtocol,MRTokenRingProtocol
+
+
+####################################################################################################
+####################################################################################################
+###########          MICRO-BENCHMARKS DE LOS CODECS DE AHMPROTOCOLS                      ######
+####################################################################################################
+####################################################################################################
+
+# Mide el costo de las funciones de codificacion/decodificacion de los protocolos, sin sockets, para varios tamaños de mensaje.
+# Por cada caso reporta:
+#	nsPerOp: tiempo por operacion (el minimo de varias repeticiones, como timeit)
+#	allocsPerOp / bytesPerOp: objetos (y bytes) que crea la operacion y que forman su resultado. Python 2 no tiene tracemalloc,
+#	por lo que no se cuentan los temporales que la operacion libera antes de retornar (ej: los strings intermedios de una concatenacion).
+#	Los datos de entrada que el resultado solo referencia (ej: la PDU que guarda un mensaje parseado) tampoco se cuentan.
+# Los casos ".messageCode" / ".method" miden parsear y leer un solo campo (el camino de un servidor que solo despacha por codigo),
+# y los casos ".fields" parsear y decodificar todos los campos.
+#
+# Los tiempos dependen de la maquina: no hay un baseline en el repositorio. La comparacion es opcional, contra una corrida
+# guardada con --output en la misma maquina; contra una corrida de otra maquina o de otro Python solo se comparan los objetos
+# creados por operacion, que no dependen del hardware.
+#
+#	python ahmcodecbenchmark.py                                   # Solo ejecuta
+#	python ahmcodecbenchmark.py --output base.json                # Guarda la corrida
+#	python ahmcodecbenchmark.py --compare base.json               # Compara contra una corrida guardada (retorna 1 si hay regresiones)
+#	python ahmcodecbenchmark.py --filter http                     # Solo los casos cuyo nombre contiene "http"
+
+
+### CASOS ##################################
+
+# Retorna lista de (nombre,tamaño del mensaje en bytes,funcion sin parametros a medir[,datos de entrada que no se cuentan])
+def createCases():
+	cases = []
+	utcDate = datetime(2013,6,1,12,0,0)
+	zoneNames = [str(zoneName) for zoneName in pytz.common_timezones]
+	# DayTime (formato de texto)
+	requestPDU = DayTimeProtocol.getRequestPDU("AR")
+	cases.append(("daytime.getRequestPDU",len(requestPDU),lambda: DayTimeProtocol.getRequestPDU("AR")))
+	cases.append(("daytime.parseRequest",len(requestPDU),lambda: DayTimeProtocol.parseRequest(requestPDU),[requestPDU]))
+	cases.append(("daytime.parseRequest.messageCode",len(requestPDU),lambda: DayTimeProtocol.parseRequest(requestPDU).messageCode))
+	binaryRequestPDU = DayTimeProtocol.getBinaryRequestPDU("AR")
+	cases.append(("daytime.parseBinaryRequest.messageCode",len(binaryRequestPDU),lambda: DayTimeProtocol.parseBinaryRequest(binaryRequestPDU).messageCode))
+	cases.append(("daytime.makeAnswerField",0,lambda: DayTimeProtocol.makeAnswerField("America/Argentina/Buenos_Aires",utcDate)))
+	for answerCount in (1,8,64):
+		answers = [DayTimeProtocol.makeAnswerField(zoneName,utcDate) for zoneName in zoneNames[:answerCount]]
+		responsePDU = DayTimeProtocol.getResponsePDU("1",answers,"AR")
+		cases.append(("daytime.getResponsePDU",len(responsePDU),lambda answers = answers: DayTimeProtocol.getResponsePDU("1",answers,"AR")))
+		cases.append(("daytime.parseResponse",len(responsePDU),lambda responsePDU = responsePDU: DayTimeProtocol.parseResponse(responsePDU),[responsePDU]))
+		cases.append(("daytime.parseResponse.fields",len(responsePDU),lambda responsePDU = responsePDU: list(DayTimeProtocol.parseResponse(responsePDU))))
+	# HTTP
+	for headerCount,bodySize in ((2,0),(16,1024),(32,65536)):
+		headers = dict(("X-Header-" + str(index),"valor-" + str(index)) for index in range(headerCount))
+		request = HTTPProtocol.createRequest("localhost",80,headers,"POST","/recurso","HTTP/1.1") + "x" * bodySize
+		response = HTTPProtocol.createResponse("HTTP/1.1",200,"OK",headers,"x" * bodySize)
+		cases.append(("http.createRequest",len(request) - bodySize,lambda headers = headers: HTTPProtocol.createRequest("localhost",80,headers,"POST","/recurso","HTTP/1.1")))
+		cases.append(("http.parseHTTPRequest",len(request),lambda request = request: HTTPProtocol.parseHTTPRequest(request),[request]))
+		cases.append(("http.parseHTTPRequest.method",len(request),lambda request = request: HTTPProtocol.parseHTTPRequest(request).method))
+		cases.append(("http.parseHTTPRequest.fields",len(request),lambda request = request: list(HTTPProtocol.parseHTTPRequest(request))))
+		cases.append(("http.parseHTTPResponse",len(response),lambda response = response: HTTPProtocol.parseHTTPResponse(response),[response]))
+		cases.append(("http.parseHTTPResponse.fields",len(response),lambda response = response: list(HTTPProtocol.parseHTTPResponse(response))))
+	# Token Ring
+	for messageSize in (0,64,4096):
+		message = "m" * messageSize
+		pdu = MRTokenRingProtocol.createPDU("01","02","03",message)
+		cases.append(("tokenring.createPDU",len(pdu),lambda message = message: MRTokenRingProtocol.createPDU("01","02","03",message)))
+		cases.append(("tokenring.parsePDU",len(pdu),lambda pdu = pdu: MRTokenRingProtocol.parsePDU(pdu),[pdu]))
+		cases.append(("tokenring.parsePDU.messageCode",len(pdu),lambda pdu = pdu: MRTokenRingProtocol.parsePDU(pdu).messageCode))
+		cases.append(("tokenring.parsePDU.fields",len(pdu),lambda pdu = pdu: MRTokenRingProtocol.parsePDU(pdu).values()))
+	return cases
+
+
+### MEDICION ##################################
+
+# Segundos que tarda en ejecutar function iterations veces (con el recolector de basura desactivado, como timeit)
+def timeLoop(function,iterations):
+	gcEnabled = gc.isenabled()
+	gc.disable()
+	try:
+		start = time.time()
+		for index in itertools.repeat(None,iterations):
+			function()
+		return time.time() - start
+	finally:
+		if gcEnabled:
+			gc.enable()
+
+# Retorna (ns/op,iteraciones). Calibra las iteraciones para que cada medicion dure al menos minTime segundos
+def measureTime(function,minTime,repeat):
+	iterations = 1
+	while True:
+		elapsed = timeLoop(function,iterations)
+		if elapsed >= minTime:
+			break
+		iterations = iterations * 10 if elapsed < minTime / 10 else int(iterations * minTime * 1.2 / elapsed) + 1
+	best = min([elapsed] + [timeLoop(function,iterations) for index in range(repeat - 1)])
+	return best * 1e9 / iterations, iterations
+
+# Cuenta los objetos (y bytes) de un resultado. Los objetos compartidos (ej: strings de un caracter, enteros chicos) cuentan una vez.
+# En los objetos con __slots__ se recorren los valores de los slots asignados
+def countObjects(value,seen = None):
+	if seen is None:
+		seen = set()
+	if id(value) in seen or value is None or isinstance(value,bool):
+		return 0, 0
+	seen.add(id(value))
+	objects, size = 1, sys.getsizeof(value)
+	if isinstance(value,dict):
+		children = itertools.chain(value.iterkeys(),value.itervalues())
+	elif isinstance(value,(list,tuple)):
+		children = value
+	elif hasattr(type(value),"__slots__"):
+		slots = [name for valueType in type(value).__mro__ for name in getattr(valueType,"__slots__",())]
+		children = [getattr(value,name) for name in slots if hasattr(value,name)]
+	else:
+		children = ()
+	for child in children:
+		childObjects, childSize = countObjects(child,seen)
+		objects += childObjects
+		size += childSize
+	return objects, size
+
+def runCases(cases,minTime,repeat):
+	results = []
+	for case in cases:
+		name, size, function = case[:3]
+		nsPerOp, iterations = measureTime(function,minTime,repeat)
+		inputs = set(id(value) for value in case[3]) if len(case) > 3 else None
+		allocs, allocatedBytes = countObjects(function(),inputs)
+		result = {"name":name,"size":size,"nsPerOp":round(nsPerOp,1),"allocsPerOp":allocs,"bytesPerOp":allocatedBytes,"iterations":iterations}
+		print "%-38s size=%-7d %12.1f ns/op %6d allocs/op %9d B/op" % (name,size,nsPerOp,allocs,allocatedBytes)
+		results.append(result)
+	return {
+		"timestamp":datetime.utcnow().isoformat() + "Z",
+		"python":platform.python_version(),
+		"platform":platform.platform(),
+		"results":results,
+	}
+
+
+### COMPARACION ##################################
+
+# Es una regresion si ns/op sube mas de tolerance (fraccion) o si aumentan los objetos creados por operacion. ns/op solo se
+# compara si ambas corridas son del mismo Python y plataforma. Retorna la lista de regresiones (textos)
+def compareRuns(baseline,current,tolerance):
+	baseResults = dict(((result["name"],result["size"]),result) for result in baseline["results"])
+	compareTimes = (baseline.get("python"),baseline.get("platform")) == (current["python"],current["platform"])
+	if not compareTimes:
+		print "La corrida base es de otro Python o plataforma: solo se comparan los objetos creados por operacion"
+	regressions = []
+	for result in current["results"]:
+		base = baseResults.get((result["name"],result["size"]))
+		if not base:
+			continue
+		name = result["name"] + " size=" + str(result["size"])
+		change = (result["nsPerOp"] - base["nsPerOp"]) / base["nsPerOp"] if base["nsPerOp"] else 0.0
+		print "%-52s %+7.1f%% ns/op  allocs %d -> %d" % (name,change * 100,base["allocsPerOp"],result["allocsPerOp"])
+		if compareTimes and change > tolerance:
+			regressions.append(name + ": " + str(base["nsPerOp"]) + " -> " + str(result["nsPerOp"]) + " ns/op")
+		if result["allocsPerOp"] > base["allocsPerOp"]:
+			regressions.append(name + ": " + str(base["allocsPerOp"]) + " -> " + str(result["allocsPerOp"]) + " allocs/op")
+	return regressions
+
+
+def parseArguments(arguments):
+	parser = argparse.ArgumentParser(description = "Micro-benchmarks de los codecs de ahmprotocols")
+	parser.add_argument("--filter",default = None,help = "Solo los casos cuyo nombre contiene este texto")
+	parser.add_argument("--min-time",dest = "minTime",type = float,default = 0.2,help = "Segundos minimos por medicion")
+	parser.add_argument("--repeat",type = int,default = 5,help = "Mediciones por caso (se toma la mejor)")
+	parser.add_argument("--compare",default = None,help = "JSON de una corrida anterior (de esta maquina) contra la que se compara")
+	parser.add_argument("--tolerance",type = float,default = 0.25,help = "Aumento de ns/op tolerado antes de considerar una regresion (0.25 = 25%%)")
+	parser.add_argument("--output",default = None,help = "Archivo JSON de resultados")
+	return parser.parse_args(arguments)
+
+def main(arguments):
+	options = parseArguments(arguments)
+	cases = [case for case in createCases() if not options.filter or options.filter in case[0]]
+	current = runCases(cases,options.minTime,options.repeat)
+	if options.output:
+		with open(options.output,"w") as f:
+			json.dump(current,f,indent = 2,sort_keys = True,separators = (",",": "))
+	if not options.compare:
+		return 0
+	with open(options.compare) as f:
+		regressions = compareRuns(json.load(f),current,options.tolerance)
+	for regression in regressions:
+		print "REGRESION " + regression
+	return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmimportbenchmark.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import sys
+import json
+import glob
+import argparse
+import platform
+import py_compile
+import subprocess
+from ast import literal_eval
+from datetime import datetime
+
+
+####################################################################################################
+####################################################################################################
+###########          PRESUPUESTO DE TIEMPO DE IMPORTACION DE LOS MODULOS                  ######
+####################################################################################################
+####################################################################################################
+
+# Mide el tiempo de importar los modulos (y de levantar un servidor simple) en un interprete nuevo, y lo compara contra un presupuesto.
+# Las dependencias pesadas (pytz, json, rsa, cryptography, multiprocessing, ctypes.util...) se cargan recien cuando las usa el subsistema que las
+# necesita; ademas del tiempo, cada caso lista modulos que NO se deben cargar al importar. Un caso falla si supera su presupuesto
+# de milisegundos o si aparece alguno de los modulos prohibidos.
+# Python 2 no tiene "-X importtime": el detalle por modulo (--tree) se obtiene reemplazando __builtin__.__import__ en el proceso
+# hijo, con el mismo formato (self / acumulado en microsegundos, indentado por nivel de importacion).
+#
+#	python ahmimportbenchmark.py                     # Ejecuta y compara contra el presupuesto (retorna 1 si alguno lo excede)
+#	python ahmimportbenchmark.py --tree ahmservers   # Detalle por modulo de la importacion de ahmservers
+#	python ahmimportbenchmark.py --scale 2           # Presupuestos al doble (maquinas lentas)
+
+HEAVY_MODULES = ["pytz","json","rsa","cryptography","subprocess","multiprocessing","ctypes","mmap","asyncore","urlparse","pprint","ahmprofiler","ahmzones","ahmasyncservers","ahmasyncclients"]
+
+# (nombre,codigo a medir,presupuesto en ms,modulos prohibidos)
+CASES = [
+	("ahmprotocols","import ahmprotocols",15.0,HEAVY_MODULES),
+	("ahmclients","import ahmclients",20.0,HEAVY_MODULES),
+	("ahmservers","import ahmservers",20.0,HEAVY_MODULES),
+	("EchoUDPServer","import ahmservers\nahmservers.EchoUDPServer('127.0.0.1',0).socket.close()",25.0,HEAVY_MODULES),
+]
+
+# Codigo del proceso hijo. Solo usa modulos que el interprete ya cargo al iniciar (sys, time), para no ocultar los que importa el caso.
+# La ultima linea de la salida es el repr de {"ms":...,"modules":[...],"tree":[...]}
+CHILD_SCRIPT = """
+import sys, time
+tree = []
+if %(tree)r:
+	import __builtin__
+	originalImport = __builtin__.__import__
+	stack = [[0.0]]   # Tiempo acumulado de los hijos de cada importacion en curso
+	def timedImport(name,*args,**kwargs):
+		loaded = name in sys.modules
+		stack.append([0.0])
+		start = time.time()
+		try:
+			return originalImport(name,*args,**kwargs)
+		finally:
+			elapsed = time.time() - start
+			children = stack.pop()[0]
+			stack[-1][0] += elapsed
+			if not loaded and name in sys.modules:
+				tree.append((len(stack) - 1,name,int((elapsed - children) * 1e6),int(elapsed * 1e6)))
+	__builtin__.__import__ = timedImport
+before = set(name for name,module in sys.modules.items() if module is not None)
+start = time.time()
+exec compile(%(code)r,"<caso>","exec")
+elapsed = time.time() - start
+modules = sorted(set(name for name,module in sys.modules.items() if module is not None) - before)
+sys.stdout.write("\\n" + repr({"ms":elapsed * 1000.0,"modules":modules,"tree":tree}) + "\\n")
+"""
+
+
+### MEDICION ##################################
+
+# Compila los modulos antes de medir: con un .pyc desactualizado (o con PYTHONDONTWRITEBYTECODE) cada proceso hijo compilaria
+# el fuente y se mediria la compilacion en lugar de la importacion
+def compileModules():
+	directory = os.path.dirname(os.path.abspath(__file__))
+	for fileName in glob.glob(os.path.join(directory,"ahm*.py")):
+		py_compile.compile(fileName,doraise = True)
+
+# Ejecuta code en un interprete nuevo (importacion en frio, salvo el cache de disco del sistema operativo)
+def runChild(code,tree = False):
+	directory = os.path.dirname(os.path.abspath(__file__))
+	output = subprocess.check_output([sys.executable,"-c",CHILD_SCRIPT % {"code":code,"tree":tree}],cwd = directory)
+	return literal_eval(output.strip().splitlines()[-1])
+
+# Retorna el minimo de repeat mediciones y los modulos cargados
+def measureCase(code,repeat):
+	runs = [runChild(code) for index in range(repeat)]
+	return min(run["ms"] for run in runs), runs[0]["modules"]
+
+def runCases(cases,repeat,scale):
+	results = []
+	for name, code, budget, forbidden in cases:
+		ms, modules = measureCase(code,repeat)
+		loadedForbidden = [module for module in forbidden if module in modules]
+		result = {"name":name,"ms":round(ms,2),"budgetMs":budget * scale,"modules":len(modules),"forbiddenLoaded":loadedForbidden}
+		print "%-16s %8.2f ms (presupuesto %6.1f ms) %4d modulos %s" % (name,ms,budget * scale,len(modules),
+			"prohibidos: " + ",".join(loadedForbidden) if loadedForbidden else "")
+		results.append(result)
+	return {
+		"timestamp":datetime.utcnow().isoformat() + "Z",
+		"python":platform.python_version(),
+		"platform":platform.platform(),
+		"results":results,
+	}
+
+# Retorna la lista de casos que exceden el presupuesto (textos)
+def checkBudgets(run):
+	violations = []
+	for result in run["results"]:
+		if result["ms"] > result["budgetMs"]:
+			violations.append(result["name"] + ": " + str(result["ms"]) + " ms > " + str(result["budgetMs"]) + " ms")
+		if result["forbiddenLoaded"]:
+			violations.append(result["name"] + ": carga " + ",".join(result["forbiddenLoaded"]))
+	return violations
+
+# Detalle por modulo, en el formato de "python3 -X importtime"
+def printTree(code):
+	print "import time: self [us] | cumulative | imported package"
+	for depth, name, selfTime, cumulative in runChild(code,True)["tree"]:
+		print "import time: %9d | %10d | %s%s" % (selfTime,cumulative,"  " * (depth - 1),name)
+
+
+def parseArguments(arguments):
+	parser = argparse.ArgumentParser(description = "Presupuesto de tiempo de importacion de los modulos")
+	parser.add_argument("--filter",default = None,help = "Solo los casos cuyo nombre contiene este texto")
+	parser.add_argument("--repeat",type = int,default = 5,help = "Mediciones por caso (se toma la mejor)")
+	parser.add_argument("--scale",type = float,default = 1.0,help = "Factor aplicado a los presupuestos de tiempo")
+	parser.add_argument("--tree",default = None,metavar = "CASO",help = "Muestra el detalle por modulo del caso en lugar de verificar")
+	parser.add_argument("--output",default = None,help = "Archivo JSON de resultados")
+	return parser.parse_args(arguments)
+
+def main(arguments):
+	options = parseArguments(arguments)
+	compileModules()
+	if options.tree:
+		codes = dict((case[0],case[1]) for case in CASES)
+		printTree(codes.get(options.tree,"import " + options.tree))
+		return 0
+	cases = [case for case in CASES if not options.filter or options.filter in case[0]]
+	current = runCases(cases,options.repeat,options.scale)
+	if options.output:
+		with open(options.output,"w") as f:
+			json.dump(current,f,indent = 2,sort_keys = True,separators = (",",": "))
+	violations = checkBudgets(current)
+	for violation in violations:
+		print "EXCEDIDO " + violation
+	return 1 if violations else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
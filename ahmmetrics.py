@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmmetrics.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import re
+import time
+import socket
+import threading
+
+
+####################################################################################################
+####################################################################################################
+###########            METRICAS DE LOS SERVIDORES (histogramas, contadores, gauges)       ######
+####################################################################################################
+####################################################################################################
+
+# Los servidores no miden nada hasta que se invoca enableMetrics (ver AbstractServer). Al habilitarlas, ServerMetrics.instrument
+# reemplaza en la instancia del servidor acceptConnection/receiveData/manageRequest y los metodos de envio (sendResponse, y en los
+# servidores TCP sendResponseParts/sendFile) por versiones que miden tiempos
+# y bytes, por lo que con las metricas deshabilitadas el camino de cada pedido no tiene ningun costo extra.
+#
+#	server = EchoUDPServer(host,port)
+#	metrics = server.enableMetrics()
+#	StatsDExporter(metrics,"127.0.0.1",8125).start()
+#	PrometheusExporter(metrics,"0.0.0.0",9100).start()    # ver ahmservers
+#	server.run()
+
+
+# Histograma de valores enteros no negativos al estilo HDR: los primeros 2 * subBuckets valores tienen un bucket cada uno, y
+# luego cada potencia de 2 se divide en subBuckets buckets, por lo que el error relativo de los percentiles es menor a 1 / subBuckets
+# (128 subBuckets: menos de 0.8%) con una cantidad de buckets que solo crece con el logaritmo del valor maximo.
+# Los servidores registran latencias en microsegundos.
+class Histogram():
+
+	SUB_BUCKET_BITS = 7
+
+	def __init__(self,highestValue = 3600 * 1000000):
+		self.subBuckets = 1 << self.SUB_BUCKET_BITS
+		self.linearLimit = 2 * self.subBuckets   # Valores menores se guardan sin perdida de precision
+		self.highestValue = highestValue         # Valores mayores se registran como highestValue
+		self.counts = [0] * (self.indexOf(highestValue) + 1)
+		self.count = 0
+		self.total = 0
+		self.maxValue = 0
+
+	def indexOf(self,value):
+		if value < self.linearLimit:
+			return value
+		shift = value.bit_length() - self.SUB_BUCKET_BITS - 1
+		return self.linearLimit + (shift - 1) * self.subBuckets + (value >> shift) - self.subBuckets
+
+	# Mayor valor que se registra en el bucket index
+	def highestEquivalentValue(self,index):
+		if index < self.linearLimit:
+			return index
+		shift, subBucket = divmod(index - self.linearLimit,self.subBuckets)
+		return ((self.subBuckets + subBucket + 1) << (shift + 1)) - 1
+
+	def record(self,value):
+		value = int(value)
+		if value >= self.linearLimit:
+			if value > self.highestValue:
+				value = self.highestValue
+			shift = value.bit_length() - self.SUB_BUCKET_BITS - 1
+			self.counts[self.linearLimit + (shift - 1) * self.subBuckets + (value >> shift) - self.subBuckets] += 1
+		elif value >= 0:
+			self.counts[value] += 1
+		else:
+			value = 0
+			self.counts[0] += 1
+		self.count += 1
+		self.total += value
+		if value > self.maxValue:
+			self.maxValue = value
+
+	# Valor del percentil (0 < percentile <= 1). Retorna 0 si el histograma esta vacio
+	def percentile(self,percentile):
+		if not self.count:
+			return 0
+		target = max(int(percentile * self.count + 0.5),1)
+		accumulated = 0
+		for index,count in enumerate(self.counts):
+			accumulated += count
+			if accumulated >= target:
+				return min(self.highestEquivalentValue(index),self.maxValue)
+		return self.maxValue
+
+	def mean(self):
+		return self.total / float(self.count) if self.count else 0.0
+
+	# Cantidad acumulada de valores menores o iguales a cada limite de bounds (de menor a mayor), con la precision de los buckets
+	def cumulativeCounts(self,bounds):
+		counts = []
+		accumulated = 0
+		index = 0
+		for bound in bounds:
+			last = min(self.indexOf(int(bound)),len(self.counts) - 1)
+			while index <= last:
+				accumulated += self.counts[index]
+				index += 1
+			counts.append(accumulated)
+		return counts
+
+	def merge(self,other):
+		for index,count in enumerate(other.counts):
+			if count:
+				self.counts[index] += count
+		self.count += other.count
+		self.total += other.total
+		self.maxValue = max(self.maxValue,other.maxValue)
+
+	def reset(self):
+		self.counts = [0] * len(self.counts)
+		self.count = 0
+		self.total = 0
+		self.maxValue = 0
+
+
+# Reemplaza metodos en la instancia de un servidor. wrappers es {nombre: funcion que recibe el metodo a envolver y retorna su
+# reemplazo}. Los reemplazos se encadenan (ej: metricas y profiling) como capas en una pila del servidor (methodLayers), y cada
+# metodo se arma envolviendo el original con las capas en orden. Retorna la capa, que se quita con restoreMethods en cualquier
+# orden: los metodos que envolvia se vuelven a armar con las capas restantes
+def replaceMethods(server,wrappers):
+	layers = server.__dict__.setdefault("methodLayers",[])
+	originals = server.__dict__.setdefault("originalMethods",{})
+	for name in wrappers:
+		if name not in originals:
+			originals[name] = server.__dict__.get(name)   # None: el metodo era el de la clase
+	layer = dict(wrappers)
+	layers.append(layer)
+	buildMethods(server,layer.keys())
+	return layer
+
+def restoreMethods(server,layer):
+	layers = server.__dict__.get("methodLayers",[])
+	for index,current in enumerate(layers):
+		if current is layer:
+			del layers[index]
+			buildMethods(server,layer.keys())
+			return
+
+# Arma los metodos names de la instancia: el original envuelto por cada capa de la pila que lo reemplaza
+def buildMethods(server,names):
+	originals = server.originalMethods
+	for name in names:
+		original = originals[name]
+		if original is None:
+			server.__dict__.pop(name,None)
+			method = getattr(server,name)
+		else:
+			method = original
+		wrapped = False
+		for layer in server.methodLayers:
+			if name in layer:
+				method = layer[name](method)
+				wrapped = True
+		if wrapped:
+			setattr(server,name,method)
+		else:
+			if original is not None:
+				setattr(server,name,original)
+			del originals[name]
+
+
+# Retorna la cantidad de bytes de los datos de un pedido (string, memoryview o lista de tramas)
+def dataSize(data):
+	if isinstance(data,list):
+		return sum(len(frame) for frame in data)
+	return len(data) if data is not None else 0
+
+
+# Metricas de un servidor:
+#	contadores: accepts, requests (llamadas a manageRequest), errors (excepciones en manageRequest), bytesIn, bytesOut
+#	histogramas (microsegundos): receiveData, manageRequest (incluye los envios que haga), sendResponse (incluye sendResponseParts y sendFile)
+#	gauges: funciones que se evaluan al exportar (ej: activeConnections, queueDepth). Si varios servidores comparten las metricas,
+#	cada uno agrega sus funciones (addGauge) y el gauge es la suma, igual que los contadores
+# Con ThreadPoolTCPHandler los contadores se actualizan desde varios threads sin lock: son aproximados.
+class ServerMetrics():
+
+	COUNTERS = ("accepts","requests","errors","bytesIn","bytesOut")
+	TIMERS = ("receiveData","manageRequest","sendResponse")
+
+	def __init__(self):
+		self.counters = dict((name,0) for name in self.COUNTERS)
+		self.histograms = dict((name,Histogram()) for name in self.TIMERS)
+		self.gauges = {}
+
+	# Reemplaza las funciones del gauge por function
+	def setGauge(self,name,function):
+		self.gauges[name] = [function]
+
+	# Agrega una funcion al gauge (ej: la de otro servidor que comparte las metricas)
+	def addGauge(self,name,function):
+		self.gauges.setdefault(name,[]).append(function)
+
+	def removeGauge(self,name,function):
+		functions = self.gauges.get(name,[])
+		if function in functions:
+			functions.remove(function)
+		if not functions:
+			self.gauges.pop(name,None)
+
+	def readGauges(self):
+		values = {}
+		for name,functions in self.gauges.items():
+			for function in functions:
+				try:
+					values[name] = values.get(name,0) + function()
+				except Exception:   # El servidor puede estar cerrando
+					pass
+		return values
+
+	# Reemplaza en la instancia del servidor los metodos medidos. Solo se reemplazan los que el servidor tiene
+	def instrument(self,server):
+		counters = self.counters
+		wrappers = {}
+		if hasattr(server,"acceptConnection"):
+			def wrapAcceptConnection(acceptConnection):
+				def countedAcceptConnection():
+					result = acceptConnection()
+					counters["accepts"] += 1
+					return result
+				return countedAcceptConnection
+			wrappers["acceptConnection"] = wrapAcceptConnection
+		if hasattr(server,"handle_accept"):   # Servidores asyncore
+			def wrapHandleAccept(handleAccept):
+				def countedHandleAccept():
+					counters["accepts"] += 1
+					return handleAccept()
+				return countedHandleAccept
+			wrappers["handle_accept"] = wrapHandleAccept
+		if hasattr(server,"receiveData"):
+			receiveHistogram = self.histograms["receiveData"]
+			def wrapReceiveData(receiveData):
+				def timedReceiveData(client_sock):
+					start = time.time()
+					try:
+						return receiveData(client_sock)
+					finally:
+						receiveHistogram.record((time.time() - start) * 1000000)
+				return timedReceiveData
+			wrappers["receiveData"] = wrapReceiveData
+		manageHistogram = self.histograms["manageRequest"]
+		def wrapManageRequest(manageRequest):
+			def timedManageRequest(client,data):
+				start = time.time()
+				try:
+					manageRequest(client,data)
+				except Exception:
+					counters["errors"] += 1
+					raise
+				finally:
+					manageHistogram.record((time.time() - start) * 1000000)
+					counters["requests"] += 1
+					counters["bytesIn"] += dataSize(data)
+			return timedManageRequest
+		wrappers["manageRequest"] = wrapManageRequest
+		sendHistogram = self.histograms["sendResponse"]
+		def wrapSendResponse(sendResponse):
+			def timedSendResponse(client,data):
+				start = time.time()
+				try:
+					return sendResponse(client,data)
+				finally:
+					sendHistogram.record((time.time() - start) * 1000000)
+					counters["bytesOut"] += len(data)
+			return timedSendResponse
+		wrappers["sendResponse"] = wrapSendResponse
+		if hasattr(server,"sendResponseParts"):   # Servidores TCP: respuestas en varias partes (ej: sendHTTPResponse)
+			def wrapSendResponseParts(sendResponseParts):
+				def timedSendResponseParts(client,parts):
+					start = time.time()
+					try:
+						return sendResponseParts(client,parts)
+					finally:
+						sendHistogram.record((time.time() - start) * 1000000)
+						counters["bytesOut"] += sum(len(part) for part in parts)
+				return timedSendResponseParts
+			wrappers["sendResponseParts"] = wrapSendResponseParts
+		if hasattr(server,"sendFile"):   # Servidores TCP: archivos enviados con sendfile (ej: sendHTTPFile)
+			def wrapSendFile(sendFile):
+				def timedSendFile(client,fileObject,offset = 0,count = None):
+					if count is None:
+						count = os.fstat(fileObject.fileno()).st_size - offset
+					start = time.time()
+					try:
+						return sendFile(client,fileObject,offset,count)
+					finally:
+						sendHistogram.record((time.time() - start) * 1000000)
+						counters["bytesOut"] += count
+				return timedSendFile
+			wrappers["sendFile"] = wrapSendFile
+		server.instrumentedMethods = replaceMethods(server,wrappers)
+
+	# Restaura los metodos originales del servidor
+	def uninstrument(self,server):
+		restoreMethods(server,getattr(server,"instrumentedMethods",None))
+		server.instrumentedMethods = None
+
+	# Retorna {"counters":{...},"gauges":{...},"histograms":{nombre:{count,mean,p50,p90,p99,p999,max}}}
+	def snapshot(self):
+		histograms = {}
+		for name,histogram in self.histograms.items():
+			histograms[name] = {
+				"count":histogram.count,
+				"mean":histogram.mean(),
+				"p50":histogram.percentile(0.5),
+				"p90":histogram.percentile(0.9),
+				"p99":histogram.percentile(0.99),
+				"p999":histogram.percentile(0.999),
+				"max":histogram.maxValue,
+			}
+		return {"counters":dict(self.counters),"gauges":self.readGauges(),"histograms":histograms}
+
+
+# "manageRequest" => "manage_request"
+def snakeCase(name):
+	return re.sub("([a-z0-9])([A-Z])",r"\1_\2",name).lower()
+
+# Limites (en segundos) de los buckets de los histogramas exportados a Prometheus
+PROMETHEUS_BUCKETS = (0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+LABEL_NAME = re.compile("^[a-zA-Z_][a-zA-Z0-9_]*$")
+
+# Valor de una etiqueta: se escapan la barra invertida, las comillas y los saltos de linea
+def escapeLabelValue(value):
+	return str(value).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+# {labels} de una muestra. extra: lista de (nombre,valor) que van despues de labels (ej: le de los buckets)
+def formatLabels(labels,extra = ()):
+	pairs = sorted(labels.items()) + list(extra)
+	if not pairs:
+		return ""
+	for name,value in pairs:
+		if not LABEL_NAME.match(name):
+			raise ValueError("Nombre de etiqueta invalido: " + name)
+	return "{" + ",".join(name + '="' + escapeLabelValue(value) + '"' for name,value in pairs) + "}"
+
+# Formato de texto de Prometheus (version 0.0.4). Los contadores terminan en _total y los histogramas (en segundos) se exportan
+# como histogram: buckets acumulados (_bucket con le), _sum y _count. labels se agregan a todas las muestras (ej: {"worker":"1"})
+def formatPrometheus(metrics,prefix = "ahm",labels = None):
+	labels = labels or {}
+	sampleLabels = formatLabels(labels)
+	lines = []
+	snapshot = metrics.snapshot()
+	for name in sorted(snapshot["counters"]):
+		metricName = prefix + "_" + snakeCase(name) + "_total"
+		lines.append("# TYPE " + metricName + " counter")
+		lines.append(metricName + sampleLabels + " " + str(snapshot["counters"][name]))
+	for name in sorted(snapshot["gauges"]):
+		metricName = prefix + "_" + snakeCase(name)
+		lines.append("# TYPE " + metricName + " gauge")
+		lines.append(metricName + sampleLabels + " " + str(snapshot["gauges"][name]))
+	for name in sorted(metrics.histograms):
+		histogram = metrics.histograms[name]
+		metricName = prefix + "_" + snakeCase(name) + "_seconds"
+		lines.append("# TYPE " + metricName + " histogram")
+		counts = histogram.cumulativeCounts([bound * 1000000 for bound in PROMETHEUS_BUCKETS])
+		for bound,count in zip(PROMETHEUS_BUCKETS,counts):
+			lines.append(metricName + "_bucket" + formatLabels(labels,[("le",repr(bound))]) + " " + str(count))
+		lines.append(metricName + "_bucket" + formatLabels(labels,[("le","+Inf")]) + " " + str(histogram.count))
+		lines.append(metricName + "_sum" + sampleLabels + " " + repr(histogram.total / 1000000.0))
+		lines.append(metricName + "_count" + sampleLabels + " " + str(histogram.count))
+	return "\n".join(lines) + "\n"
+
+
+# Envia las metricas cada interval segundos a un agente StatsD por UDP (normalmente local).
+# Los contadores se envian como la diferencia desde el envio anterior (|c); los gauges y los percentiles de los histogramas
+# (en milisegundos) como gauges (|g). Las lineas se agrupan en datagramas de hasta maxDatagramSize bytes.
+class StatsDExporter():
+
+	maxDatagramSize = 1432
+
+	def __init__(self,metrics,host = "127.0.0.1",port = 8125,interval = 10.0,prefix = "ahm"):
+		self.metrics = metrics
+		self.address = (host,port)
+		self.interval = interval
+		self.prefix = prefix
+		self.lastCounters = dict(metrics.counters)
+		self.socket = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			self.flush()
+		self.flush()
+
+	def getLines(self):
+		lines = []
+		counters = dict(self.metrics.counters)
+		for name in sorted(counters):
+			lines.append(self.prefix + "." + name + ":" + str(counters[name] - self.lastCounters.get(name,0)) + "|c")
+		self.lastCounters = counters
+		for name,value in sorted(self.metrics.readGauges().items()):
+			lines.append(self.prefix + "." + name + ":" + str(value) + "|g")
+		for name in sorted(self.metrics.histograms):
+			histogram = self.metrics.histograms[name]
+			for label,percentile in (("p50",0.5),("p99",0.99),("p999",0.999)):
+				lines.append(self.prefix + "." + name + "." + label + ":" + repr(histogram.percentile(percentile) / 1000.0) + "|g")
+		return lines
+
+	def flush(self):
+		datagram = []
+		size = 0
+		for line in self.getLines():
+			if datagram and size + len(line) + 1 > self.maxDatagramSize:
+				self.send("\n".join(datagram))
+				datagram, size = [], 0
+			datagram.append(line)
+			size += len(line) + 1
+		if datagram:
+			self.send("\n".join(datagram))
+
+	def send(self,data):
+		try:
+			self.socket.sendto(data,self.address)
+		except socket.error:   # El agente no esta disponible: se descartan las metricas de este intervalo
+			pass
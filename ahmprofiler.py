@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmprofiler.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import sys
+import json
+import time
+import threading
+from ahmmetrics import replaceMethods,restoreMethods,dataSize
+
+
+####################################################################################################
+####################################################################################################
+###########         PROFILING DE LOS SERVIDORES (muestreo de stacks, requests lentos)     ######
+####################################################################################################
+####################################################################################################
+
+# Modo de profiling opcional de los servidores (ver AbstractServer.enableProfiling):
+#	- StackSampler: un thread toma muestras de los stacks de los threads del proceso sampleRate veces por segundo
+#	  (sys._current_frames) y las acumula en formato "collapsed" (una linea "frame;frame;...;frame cantidad" por stack),
+#	  que es el formato de entrada de flamegraph.pl y de speedscope.
+#	- SlowRequestLog: mide cada manageRequest (y el receiveData previo y los envios que haga) y escribe una linea JSON
+#	  por cada pedido que supera slowThreshold segundos, con los campos del pedido (describeRequest del servidor) y los tiempos.
+#
+#	profiler = server.enableProfiling(sampleRate = 200,slowThreshold = 0.05,slowLog = open("lentos.log","a"))
+#	...
+#	profiler.dumpCollapsed("servidor.folded")     # flamegraph.pl servidor.folded > servidor.svg
+
+
+# Muestreo de stacks. El costo es del thread de muestreo (no se agrega nada al camino de cada pedido), aunque al compartir el GIL
+# cada muestra demora un poco a los threads del servidor. Con sampleRate = 100 el impacto es despreciable.
+class StackSampler():
+
+	def __init__(self,sampleRate = 100):
+		self.interval = 1.0 / sampleRate
+		self.stacks = {}   # stack collapsed => cantidad de muestras
+		self.samples = 0
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.stopped.clear()
+		self.thread = threading.Thread(target = self.run,name = "StackSampler")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+		if self.thread and self.thread is not threading.current_thread():
+			self.thread.join()
+
+	def run(self):
+		ownId = threading.current_thread().ident
+		while not self.stopped.wait(self.interval):
+			self.sample(ownId)
+
+	def sample(self,ownId):
+		threadNames = dict((thread.ident,thread.name) for thread in threading.enumerate())
+		frames = sys._current_frames()
+		with self.lock:
+			for threadId,frame in frames.items():
+				if threadId == ownId:
+					continue
+				stack = self.collapse(threadNames.get(threadId,str(threadId)),frame)
+				self.stacks[stack] = self.stacks.get(stack,0) + 1
+			self.samples += 1
+
+	# "thread;archivo:funcion;...;archivo:funcion", de la raiz a la hoja
+	@staticmethod
+	def collapse(threadName,frame):
+		names = []
+		while frame is not None:
+			code = frame.f_code
+			names.append(os.path.basename(code.co_filename) + ":" + code.co_name)
+			frame = frame.f_back
+		names.append(threadName.replace(" ","_"))
+		names.reverse()
+		return ";".join(names)
+
+	def getCollapsed(self):
+		with self.lock:
+			return "".join(stack + " " + str(count) + "\n" for stack,count in sorted(self.stacks.items()))
+
+	def dumpCollapsed(self,fileName):
+		with open(fileName,"w") as f:
+			f.write(self.getCollapsed())
+
+	def reset(self):
+		with self.lock:
+			self.stacks = {}
+			self.samples = 0
+
+
+# Log de requests lentos. Los tiempos de cada pedido se guardan por thread (ThreadPoolTCPHandler atiende pedidos en paralelo)
+class SlowRequestLog():
+
+	def __init__(self,server,slowThreshold = 0.1,output = None):
+		self.server = server
+		self.slowThreshold = slowThreshold
+		self.output = output if output is not None else sys.stderr
+		self.timings = threading.local()
+		self.lock = threading.Lock()
+		self.slowRequests = 0
+		self.layer = None   # Capa de metodos reemplazados (ver ahmmetrics.replaceMethods)
+
+	# Reemplaza receiveData/manageRequest y los metodos de envio de la instancia del servidor (ver ahmmetrics.replaceMethods)
+	def install(self):
+		server = self.server
+		timings = self.timings
+		wrappers = {}
+		if hasattr(server,"receiveData"):
+			def wrapReceiveData(receiveData):
+				def timedReceiveData(client_sock):
+					start = time.time()
+					try:
+						return receiveData(client_sock)
+					finally:
+						timings.receive = time.time() - start
+				return timedReceiveData
+			wrappers["receiveData"] = wrapReceiveData
+		def wrapManageRequest(manageRequest):
+			def timedManageRequest(client,data):
+				timings.send = 0.0
+				start = time.time()
+				error = None
+				try:
+					manageRequest(client,data)
+				except Exception as e:
+					error = e
+					raise
+				finally:
+					elapsed = time.time() - start
+					if elapsed >= self.slowThreshold:
+						self.logRequest(client,data,elapsed,getattr(timings,"receive",None),timings.send,error)
+					timings.receive = None
+			return timedManageRequest
+		wrappers["manageRequest"] = wrapManageRequest
+		def wrapSend(send):
+			def timedSend(client,*args,**kwargs):
+				start = time.time()
+				try:
+					return send(client,*args,**kwargs)
+				finally:
+					timings.send = getattr(timings,"send",0.0) + time.time() - start
+			return timedSend
+		for name in ("sendResponse","sendResponseParts","sendFile"):   # sendResponseParts y sendFile: solo servidores TCP
+			if hasattr(server,name):
+				wrappers[name] = wrapSend
+		self.layer = replaceMethods(server,wrappers)
+
+	def uninstall(self):
+		restoreMethods(self.server,self.layer)
+		self.layer = None
+
+	def logRequest(self,client,data,elapsed,receiveTime,sendTime,error):
+		try:
+			request = self.server.describeRequest(data)
+		except Exception as e:   # Pedido invalido: se registra igual
+			request = {"error":"No se pudo parsear: " + str(e)}
+		entry = {
+			"time":time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"server":self.server.__class__.__name__,
+			"client":self.describeClient(client),
+			"bytesIn":dataSize(data),
+			"totalMs":round(elapsed * 1000.0,3),
+			"receiveMs":round(receiveTime * 1000.0,3) if receiveTime is not None else None,
+			"sendMs":round(sendTime * 1000.0,3),
+			"processMs":round((elapsed - sendTime) * 1000.0,3),   # manageRequest sin los envios
+			"request":request,
+		}
+		if error is not None:
+			entry["error"] = repr(error)
+		line = json.dumps(entry,sort_keys = True,default = str)
+		with self.lock:
+			self.slowRequests += 1
+			self.output.write(line + "\n")
+			self.output.flush()
+
+	# client es el sock del cliente (TCP), su direccion (UDP) o la conexion asyncore
+	@staticmethod
+	def describeClient(client):
+		if isinstance(client,tuple):
+			return "%s:%s" % client[:2]
+		try:
+			return "%s:%s" % client.getpeername()[:2]
+		except Exception:
+			return None
+
+
+# Agrupa el muestreo de stacks y el log de requests lentos de un servidor
+class ServerProfiler():
+
+	def __init__(self,server,sampleRate = 100,slowThreshold = 0.1,slowLog = None):
+		self.sampler = StackSampler(sampleRate) if sampleRate else None
+		self.slowRequestLog = SlowRequestLog(server,slowThreshold,slowLog) if slowThreshold is not None else None
+
+	def start(self):
+		if self.slowRequestLog:
+			self.slowRequestLog.install()
+		if self.sampler:
+			self.sampler.start()
+
+	def stop(self):
+		if self.sampler:
+			self.sampler.stop()
+		if self.slowRequestLog:
+			self.slowRequestLog.uninstall()
+
+	def dumpCollapsed(self,fileName):
+		self.sampler.dumpCollapsed(fileName)
@@ -23,7 +23,15 @@
 #
 
 from datetime import datetime,timedelta
-import pytz
+import calendar
+import bisect
+import collections
+import threading
+import time
+import os
+import struct
+import socket
+import errno
 
 
 ### DAYTIME ###
@@ -85,9 +93,451 @@ import pytz
 # Cada respuesta tendrá un tamaño de 6 bytes, mas (49 bytes * answer_count)
 
 
+### PDU de Aplicacion Daytime - Formato binario (version 2)
+
+# Todos los campos en orden de red (big endian).
+#
+#	 	Campo    			|		Tamaño
+#	-----------------------------------------------
+#	   version				|		1 byte    (= 2. En el formato texto el primer byte es "0" o "1", por lo que ambos formatos se distinguen)
+#	   is_query 			|		1 byte
+#      message_code			|		1 byte
+#	   country_code			|		2 bytes   (ASCII)
+#	   answer_count			|		2 bytes   (entero sin signo)
+#
+# Cada entrada de la seccion respuesta:
+#
+#		 	Campo    			|		Tamaño
+#		timestamp				|		8 bytes   (segundos desde epoch, UTC)
+#		utc_offset				|		4 bytes   (segundos a sumar al timestamp para obtener la hora local de la zona)
+#		zone_id					|		2 bytes   (indice de la zona en la tabla fija ahmzones.ZONE_NAMES. 0xFFFF = zona desconocida)
+#
+# TOTAL : 14 bytes cada entrada en la respuesta. Cada query tiene 7 bytes.
+# El servidor responde en el mismo formato en que recibe el query (ver answerRequest).
+# La version identifica tambien la tabla de zonas: la version 1 usaba el orden de pytz.all_timezones, que cambia entre versiones
+# de pytz. Una PDU binaria (primer byte menor a 0x20) de otra version se rechaza con ValueError.
+#
+# Query de varios paises (message_code = 2, "find_countries"):
+#	El query lleva country_code = "00" y en answer_count la cantidad N de paises, seguido de los N codigos de pais (2 bytes cada uno).
+#	La respuesta lleva message_code = 2 y en answer_count la cantidad de secciones (una por pais, en el mismo orden). Cada seccion:
+#
+#		 	Campo    			|		Tamaño
+#		country_code			|		2 bytes
+#		message_code			|		1 byte    (1 = pais encontrado, 0 = pais no encontrado)
+#		answer_count			|		2 bytes
+#		respuestas				|		14 bytes * answer_count
+#
+#	Todas las secciones se calculan con el mismo instante.
+#	Un query con mas de MAX_BATCH_COUNTRIES paises, o cuya respuesta tendria mas de MAX_BATCH_ANSWERS respuestas en total, se
+#	responde con message_code = 0 y answer_count = 0 (query incorrecto): la respuesta siempre entra en un datagrama UDP y no
+#	crece sin limite respecto del query.
+
+
+# Cache de zonas horarias para DayTimeProtocol.
+#	- Los objetos de pytz se resuelven una sola vez por zona.
+#	- El offset UTC de cada zona se guarda junto con el intervalo en el que es valido (hasta la proxima transicion de horario de verano),
+#	  por lo que solo se recalcula cuando cambia.
+#	- La hora formateada de cada zona se guarda para el segundo en que se calculo (TIME_FORMAT tiene resolucion de un segundo).
+#	  Hay una sola entrada por zona: al cambiar el segundo se reemplaza.
+# Los instantes se manejan como datetime UTC sin tzinfo.
+class TimeZoneCache():
+	
+	defaultOffsetValidity = timedelta(hours = 1)   # Para zonas de las que pytz no expone sus transiciones
+	
+	def __init__(self,timeFormat):
+		self.timeFormat = timeFormat
+		self.zones = {}            # nombre => tzinfo de pytz
+		self.offsets = {}          # nombre => (offset,valido_desde,valido_hasta)
+		self.formattedTimes = {}   # nombre => (segundo,hora_formateada)
+		
+	def getZone(self,zoneName):
+		zone = self.zones.get(zoneName)
+		if zone is None:
+			import pytz   # pytz se carga con la primera zona que se resuelve
+			zone = self.zones[zoneName] = pytz.timezone(zoneName.strip())
+		return zone
+		
+	def getUTCOffset(self,zoneName,utcDate):
+		entry = self.offsets.get(zoneName)
+		if entry and entry[1] <= utcDate < entry[2]:
+			return entry[0]
+		zone = self.getZone(zoneName)
+		import pytz
+		transitions = getattr(zone,"_utc_transition_times",None)
+		if transitions:   # Zona con horario de verano (DstTzInfo)
+			index = bisect.bisect_right(transitions,utcDate)
+			validFrom = transitions[index - 1] if index else datetime.min
+			validUntil = transitions[index] if index < len(transitions) else datetime.max
+		elif isinstance(zone,pytz.tzinfo.StaticTzInfo) or zone is pytz.utc:   # Offset fijo
+			validFrom, validUntil = datetime.min, datetime.max
+		else:
+			validFrom, validUntil = utcDate, utcDate + self.defaultOffsetValidity
+		offset = pytz.utc.localize(utcDate).astimezone(zone).utcoffset()
+		self.offsets[zoneName] = (offset,validFrom,validUntil)
+		return offset
+		
+	def formatTime(self,zoneName,utcDate):
+		second = utcDate.replace(microsecond = 0)
+		entry = self.formattedTimes.get(zoneName)
+		if entry and entry[0] == second:
+			return entry[1]
+		time = datetime.strftime(second + self.getUTCOffset(zoneName,second),self.timeFormat)
+		self.formattedTimes[zoneName] = (second,time)
+		return time
+		
+		
+# Base de datos de zonas horarias compilada a partir del archivo de zonas (Cod.Pais \t Nombre de Zona por linea, ver loadCountryZones).
+# El archivo se compila una sola vez a un indice binario (archivo de zonas + ".idx") que luego se mapea en memoria (mmap),
+# por lo que todos los procesos que lo abren comparten las mismas paginas. Si el archivo de zonas cambia (mtime o tamaño), se vuelve a compilar.
+# Se usa igual que el diccionario que retorna loadCountryZones: "countryCode in zones" y "zones[countryCode]".
+#
+# Formato del indice (orden de red):
+#	Cabecera:	magic (4 bytes) | version (1 byte) | mtime del archivo de zonas (8 bytes) | tamaño del archivo de zonas (8 bytes) |
+#				cantidad de paises (2 bytes) | cantidad de zonas (2 bytes) | cantidad de entradas pais-zona (2 bytes)
+#	Paises:		por cada pais, ordenados por codigo: codigo (2 bytes) | primera entrada (2 bytes) | cantidad de zonas (2 bytes)
+#	Entradas:	por cada entrada pais-zona: id de zona (2 bytes)
+#	Nombres:	por cada zona: fin del nombre dentro del bloque de nombres (4 bytes), seguido del bloque con todos los nombres
+class CompiledZoneDatabase():
+	
+	MAGIC = "AHMZ"
+	VERSION = 1
+	HEADER = struct.Struct("!4sBdQHHH")
+	COUNTRY = struct.Struct("!2sHH")
+	ZONE_ID = struct.Struct("!H")
+	NAME_END = struct.Struct("!I")
+	
+	def __init__(self,indexFileName):
+		import mmap
+		with open(indexFileName,"rb") as indexFile:
+			self.data = mmap.mmap(indexFile.fileno(),0,access = mmap.ACCESS_READ)
+		magic,version,self.sourceMtime,self.sourceSize,self.countryCount,self.zoneCount,entryCount = self.HEADER.unpack_from(self.data)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError("Indice de zonas invalido: " + indexFileName)
+		self.countriesOffset = self.HEADER.size
+		self.entriesOffset = self.countriesOffset + self.countryCount * self.COUNTRY.size
+		self.namesOffset = self.entriesOffset + entryCount * self.ZONE_ID.size
+		self.namesBlockOffset = self.namesOffset + self.zoneCount * self.NAME_END.size
+		self.zoneNames = {}   # id de zona => nombre (se decodifica una sola vez por proceso)
+		
+	# Abre el indice del archivo de zonas, compilandolo si no existe o si esta desactualizado. Con un indice vigente solo lo mapea
+	# en memoria: las zonas se resuelven en la primera consulta de cada una, o todas antes de retornar si warmUp es True (ver warmUp)
+	@staticmethod
+	def open(zonesFileName,warmUp = False):
+		indexFileName = zonesFileName + ".idx"
+		sourceStat = os.stat(zonesFileName)
+		database = None
+		try:
+			database = CompiledZoneDatabase(indexFileName)
+			if database.sourceMtime != sourceStat.st_mtime or database.sourceSize != sourceStat.st_size:
+				database.close()
+				database = None
+		except (IOError,OSError,ValueError,struct.error):   # No existe o esta corrupto
+			database = None
+		if database is None:
+			CompiledZoneDatabase.compile(zonesFileName,indexFileName)
+			database = CompiledZoneDatabase(indexFileName)
+		if warmUp:
+			database.warmUp()
+		return database
+		
+	# Resuelve una sola vez cada zona del indice (ver TimeZoneCache), igual que loadCountryZones, para que el primer pedido de
+	# cada zona no pague la carga de pytz
+	def warmUp(self):
+		import pytz
+		for zoneId in xrange(self.zoneCount):
+			try:
+				DayTimeProtocol.zoneCache.getZone(self.getZoneName(zoneId))
+			except pytz.UnknownTimeZoneError:
+				pass
+		
+	@staticmethod
+	def compile(zonesFileName,indexFileName):
+		sourceStat = os.stat(zonesFileName)
+		with open(zonesFileName) as zonesFile:
+			timeZones = DayTimeProtocol.loadCountryZones(zonesFile)
+		zoneIds = {}
+		zoneNames = []
+		countries = []
+		entries = []
+		for countryCode in sorted(timeZones):
+			countries.append(CompiledZoneDatabase.COUNTRY.pack(countryCode[:2].ljust(2),len(entries),len(timeZones[countryCode])))
+			for zoneName in timeZones[countryCode]:
+				if zoneName not in zoneIds:
+					zoneIds[zoneName] = len(zoneNames)
+					zoneNames.append(zoneName)
+				entries.append(CompiledZoneDatabase.ZONE_ID.pack(zoneIds[zoneName]))
+		nameEnds = []
+		nameEnd = 0
+		for zoneName in zoneNames:
+			nameEnd += len(zoneName)
+			nameEnds.append(CompiledZoneDatabase.NAME_END.pack(nameEnd))
+		header = CompiledZoneDatabase.HEADER.pack(CompiledZoneDatabase.MAGIC,CompiledZoneDatabase.VERSION,sourceStat.st_mtime,sourceStat.st_size,len(countries),len(zoneNames),len(entries))
+		temporaryFileName = indexFileName + "." + str(os.getpid())
+		with open(temporaryFileName,"wb") as indexFile:
+			indexFile.write(''.join([header] + countries + entries + nameEnds + zoneNames))
+		os.rename(temporaryFileName,indexFileName)   # Reemplazo atomico: otros procesos ven el indice anterior o el nuevo
+		
+	def close(self):
+		self.data.close()
+		
+	# Busqueda binaria del pais. Retorna (primera entrada,cantidad de zonas) o None
+	def findCountry(self,countryCode):
+		low, high = 0, self.countryCount - 1
+		while low <= high:
+			middle = (low + high) // 2
+			code,firstEntry,count = self.COUNTRY.unpack_from(self.data,self.countriesOffset + middle * self.COUNTRY.size)
+			if code == countryCode:
+				return firstEntry,count
+			if code < countryCode:
+				low = middle + 1
+			else:
+				high = middle - 1
+		return None
+		
+	def getZoneName(self,zoneId):
+		zoneName = self.zoneNames.get(zoneId)
+		if zoneName is None:
+			start = self.NAME_END.unpack_from(self.data,self.namesOffset + (zoneId - 1) * self.NAME_END.size)[0] if zoneId else 0
+			end = self.NAME_END.unpack_from(self.data,self.namesOffset + zoneId * self.NAME_END.size)[0]
+			zoneName = self.zoneNames[zoneId] = intern(self.data[self.namesBlockOffset + start:self.namesBlockOffset + end])
+		return zoneName
+		
+	def getZoneIds(self,countryCode):
+		country = self.findCountry(countryCode)
+		if country is None:
+			raise KeyError(countryCode)
+		firstEntry,count = country
+		return struct.unpack_from("!" + "H" * count,self.data,self.entriesOffset + firstEntry * self.ZONE_ID.size)
+		
+	def __contains__(self,countryCode):
+		return self.findCountry(countryCode) is not None
+		
+	def __getitem__(self,countryCode):
+		return [self.getZoneName(zoneId) for zoneId in self.getZoneIds(countryCode)]
+		
+	def get(self,countryCode,default = None):
+		return self[countryCode] if countryCode in self else default
+		
+		
+# Cache LRU de respuestas con tiempo de vida (ttl, en segundos). Cuenta aciertos y fallos.
+# Es seguro usarlo desde varios threads (ej: ThreadPoolTCPHandler)
+class ResponseCache():
+	
+	def __init__(self,maxEntries = 1024,ttl = 1.0):
+		self.maxEntries = maxEntries
+		self.ttl = ttl
+		self.entries = collections.OrderedDict()   # clave => (vencimiento,respuesta). El primero es el menos usado
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		
+	def get(self,key,now = None):
+		if now is None:
+			now = time.time()
+		with self.lock:
+			entry = self.entries.pop(key,None)
+			if entry is None or entry[0] <= now:
+				self.misses += 1
+				return None
+			self.entries[key] = entry   # Vuelve al final (usado recientemente)
+			self.hits += 1
+			return entry[1]
+			
+	def put(self,key,value,now = None):
+		if now is None:
+			now = time.time()
+		with self.lock:
+			self.entries.pop(key,None)
+			self.entries[key] = (now + self.ttl,value)
+			while len(self.entries) > self.maxEntries:
+				self.entries.popitem(last = False)
+				
+	def getStats(self):
+		return {"hits":self.hits,"misses":self.misses,"entries":len(self.entries)}
+
+		
+# Mensajes parseados de los protocolos (DayTime, HTTP, Token Ring). Guardan la PDU recibida y decodifican cada campo recien
+# cuando se lo accede, salvo el que se usa para despachar (messageCode, o la linea inicial en HTTP), que se lee al crearlo.
+# Asi un camino que solo consulta messageCode no corta ni crea el resto de los campos.
+# Usan __slots__ (sin __dict__ por instancia), que requiere clases de nuevo estilo (object).
+# Para los usos anteriores se pueden indexar y desempaquetar con el orden de FIELDS (como las listas que retornaban los
+# metodos parse*), o por nombre de campo. Los que reemplazan a un diccionario (parsePDU) se comportan como tal (ver KeyedMessage).
+class ParsedMessage(object):
+	
+	__slots__ = ()
+	FIELDS = ()
+	
+	def __getitem__(self,key):
+		if isinstance(key,basestring):
+			if key not in self.FIELDS:
+				raise KeyError(key)
+			return getattr(self,key)
+		if isinstance(key,slice):
+			return [getattr(self,name) for name in self.FIELDS[key]]
+		return getattr(self,self.FIELDS[key])
+		
+	def __len__(self):
+		return len(self.FIELDS)
+		
+	def __iter__(self):
+		return iter(self.decode())
+		
+	# Tupla con todos los campos, en el orden de FIELDS. Las sub-clases la redefinen para decodificarlos de una vez
+	def decode(self):
+		return tuple(getattr(self,name) for name in self.FIELDS)
+		
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join(name + "=" + repr(getattr(self,name)) for name in self.FIELDS) + ")"
+		
+		
+# Mensaje parseado que reemplaza a un diccionario: "campo in mensaje", keys/values/items/get, la iteracion recorre los nombres de
+# los campos (no sus valores) y los campos se asignan por nombre. Asignar un campo que no esta en FIELDS lanza KeyError
+class KeyedMessage(ParsedMessage):
+	
+	__slots__ = ()
+	
+	def __contains__(self,key):
+		return key in self.FIELDS
+		
+	def __iter__(self):
+		return iter(self.FIELDS)
+		
+	def __setitem__(self,key,value):
+		if not isinstance(key,basestring) or key not in self.FIELDS:
+			raise KeyError(key)
+		setattr(self,key,value)
+		
+	def keys(self):
+		return list(self.FIELDS)
+		
+	def values(self):
+		return list(self.decode())
+		
+	def items(self):
+		return zip(self.FIELDS,self.decode())
+		
+	def get(self,key,default = None):
+		return getattr(self,key) if key in self.FIELDS else default
+		
+		
+# Query/respuesta DayTime en formato de texto. Los campos son strings, como en la PDU
+class DayTimeRequest(ParsedMessage):
+	
+	__slots__ = ("pdu","messageCode")
+	FIELDS = ("isQuery","messageCode","countryCode","answerCount")
+	
+	def __init__(self,pdu):
+		self.pdu = pdu
+		self.messageCode = pdu[1:2]
+		
+	@property
+	def isQuery(self):
+		return self.pdu[0:1]
+		
+	@property
+	def countryCode(self):
+		return self.pdu[2:4]
+		
+	@property
+	def answerCount(self):
+		return self.pdu[4:6]
+		
+	def decode(self):
+		pdu = self.pdu
+		return (pdu[0:1],self.messageCode,pdu[2:4],pdu[4:6])
+		
+		
+class DayTimeResponse(DayTimeRequest):
+	
+	__slots__ = ("_answers",)
+	FIELDS = DayTimeRequest.FIELDS + ("answers",)
+	
+	def __init__(self,pdu):
+		self.pdu = pdu
+		self.messageCode = pdu[1:2]
+		self._answers = None
+		
+	def decode(self):
+		return DayTimeRequest.decode(self) + (self.answers,)
+		
+	# Lista de [nombre_zona,tiempo]
+	@property
+	def answers(self):
+		if self._answers is None:
+			self._answers = DayTimeProtocol.parseAnswers(self.pdu,int(self.answerCount))
+		return self._answers
+		
+		
+# Query/respuesta DayTime en formato binario (BINARY_HEADER: version,is_query,message_code,country_code,answer_count).
+# is_query, message_code y answer_count son enteros
+class BinaryDayTimeRequest(DayTimeRequest):
+	
+	__slots__ = ()
+	ANSWER_COUNT = struct.Struct("!H")
+	
+	def __init__(self,pdu):
+		self.pdu = pdu
+		self.messageCode = ord(pdu[2])
+		
+	@property
+	def isQuery(self):
+		return ord(self.pdu[1])
+		
+	@property
+	def countryCode(self):
+		return self.pdu[3:5]
+		
+	@property
+	def answerCount(self):
+		return self.ANSWER_COUNT.unpack_from(self.pdu,5)[0]
+		
+	def decode(self):
+		return (self.isQuery,self.messageCode,self.countryCode,self.answerCount)
+		
+		
+class BinaryDayTimeResponse(BinaryDayTimeRequest):
+	
+	__slots__ = ("_answers",)
+	FIELDS = DayTimeResponse.FIELDS
+	
+	def __init__(self,pdu):
+		self.pdu = pdu
+		self.messageCode = ord(pdu[2])
+		self._answers = None
+		
+	def decode(self):
+		return BinaryDayTimeRequest.decode(self) + (self.answers,)
+		
+	# Lista de [nombre_zona,tiempo], con el tiempo formateado con TIME_FORMAT (igual que en el formato de texto)
+	@property
+	def answers(self):
+		if self._answers is None:
+			self._answers = [DayTimeProtocol.formatBinaryAnswer(answer) for answer in self.rawAnswers]
+		return self._answers
+		
+	# Lista de (timestamp,utc_offset,zone_id), sin formatear
+	@property
+	def rawAnswers(self):
+		return DayTimeProtocol.parseBinaryAnswers(self.pdu,self.answerCount)
+		
+		
 class DayTimeProtocol():
 	
 	TIME_FORMAT = '%d/%m/%y %H:%M:%S'
+	zoneCache = TimeZoneCache(TIME_FORMAT)
+	
+	# Formato binario
+	BINARY_VERSION = 2   # Formato y tabla de zonas (ver ahmzones)
+	BINARY_HEADER = struct.Struct("!BBB2sH")
+	BINARY_ANSWER = struct.Struct("!qiH")
+	BINARY_ANSWER_FORMAT = "qiH"
+	BINARY_SECTION = struct.Struct("!2sBH")
+	FIND_COUNTRIES = 2
+	MAX_BATCH_COUNTRIES = 32    # Paises por query de varios paises
+	MAX_BATCH_ANSWERS = 128     # Respuestas (zonas) en total por query de varios paises
+	UNKNOWN_ZONE_ID = 0xFFFF
+	zoneTable = None   # (nombres,nombre => id) de las zonas del formato binario. Se arma en el primer uso (ver getZoneTable)
+	binaryResponseStructs = {}   # answer_count => struct.Struct de la PDU completa
 	
 	# Campos de la PDU
 	# (byte_inicio,byte_final,tamaño_total)
@@ -98,6 +548,16 @@ class DayTimeProtocol():
 	BYTES_ANSWER_ZONE_NAME  = (6,38,32)
 	BYTES_ANSWER_ZONE_TIME  = (38,55,17)
 	
+	# Tabla de zonas del formato binario: lista de nombres (la tabla fija de ahmzones, no la de pytz) y diccionario nombre => indice.
+	# ahmzones se importa recien aca, no al importar el modulo
+	@staticmethod
+	def getZoneTable():
+		if DayTimeProtocol.zoneTable is None:
+			from ahmzones import ZONE_NAMES
+			zoneNames = list(ZONE_NAMES)
+			DayTimeProtocol.zoneTable = (zoneNames,dict((zoneName,zoneId) for zoneId,zoneName in enumerate(zoneNames)))
+		return DayTimeProtocol.zoneTable
+		
 	# Retorna diccionario con la estructura:
 	# timeZones = { Cod.Pais1 => [Nombre_Zona1,Nombre_Zona2,Nombre_ZonaN]
 	#				 Cod. Pais2 => [Nombre Zona]
@@ -107,41 +567,46 @@ class DayTimeProtocol():
 	#
 	@staticmethod
 	def loadCountryZones(zonesFile):
+		import pytz
 		timeZones = {}
 		for countryLine in zonesFile:  # CONTIENE: {Cod.Pais:[Nombre de Zona1,Nombre Zona2,...]}
+			countryLine = countryLine.rstrip("\r\n")
+			if not countryLine:
+				continue
 			countryEntry = countryLine.split("\t")
 			if countryEntry[0] in timeZones: # ya existe el pais en el diccionario. Agrego a la lista de time zones el valor
 				timeZones[countryEntry[0]].append(countryEntry[1])
 			else: # creo lista con el time zone
 				timeZones[countryEntry[0]] = [countryEntry[1]]
+			try:   # Resuelvo la zona una sola vez (ver TimeZoneCache)
+				DayTimeProtocol.zoneCache.getZone(countryEntry[1])
+			except pytz.UnknownTimeZoneError:
+				pass
 		return timeZones
 	
 	
 	# Parseo request del protocolo DayTime.
-	# Retorna lista [is_query,message_code,country_code,answer_count]
+	# Retorna DayTimeRequest: isQuery,messageCode,countryCode,answerCount (indexable como [is_query,message_code,country_code,answer_count])
 	@staticmethod
 	def parseRequest(request):
-		result  = []
-		result.append(request[DayTimeProtocol.BYTES_IS_QUERY[0]:DayTimeProtocol.BYTES_IS_QUERY[1]]) # leo primeros N bytes (2)
-		result.append(request[DayTimeProtocol.BYTES_MESSAGE_CODE[0]:DayTimeProtocol.BYTES_MESSAGE_CODE[1]])
-		result.append(request[DayTimeProtocol.BYTES_COUNTRY_CODE[0]:DayTimeProtocol.BYTES_COUNTRY_CODE[1]])
-		result.append(request[DayTimeProtocol.BYTES_ANSWER_COUNT[0]:DayTimeProtocol.BYTES_ANSWER_COUNT[1]])
-		return result
+		return DayTimeRequest(request)
 		
 	# Parseo response del protocolo DayTime.
-	# Retorna lista [is_query,message_code,country_code,answer_count,[answer_section]]
+	# Retorna DayTimeResponse: los campos del request y answers (indexable como [is_query,message_code,country_code,answer_count,[answer_section]])
 	@staticmethod
 	def parseResponse(response):
-		result  = DayTimeProtocol.parseRequest(response) # obtengo primeros datos (cabeceras)
-		# tengo que leer la seccion de respuestas
+		return DayTimeResponse(response)
+		
+	# Seccion de respuestas de una PDU de texto. Retorna lista de [nombre_zona,tiempo]
+	@staticmethod
+	def parseAnswers(response,answerCount):
 		answers = []
 		tamanoEntrada = DayTimeProtocol.BYTES_ANSWER_ZONE_NAME[2] + DayTimeProtocol.BYTES_ANSWER_ZONE_TIME[2]
-		for index in range(int(result[3])):  # itero sobre todas las respuestas
+		for index in range(answerCount):  # itero sobre todas las respuestas
 			zoneName =  response[DayTimeProtocol.BYTES_ANSWER_ZONE_NAME[0] + (index * tamanoEntrada) :DayTimeProtocol.BYTES_ANSWER_ZONE_NAME[1] + (index * tamanoEntrada)]
 			time =  response[DayTimeProtocol.BYTES_ANSWER_ZONE_TIME[0] + (index * tamanoEntrada) : DayTimeProtocol.BYTES_ANSWER_ZONE_TIME[1] + (index * tamanoEntrada)]
 			answers.append([zoneName,time])
-		result.append(answers)
-		return result	
+		return answers
 		
 	@staticmethod
 	def getRequestPDU(countryCode = None):
@@ -157,44 +622,46 @@ class DayTimeProtocol():
 		
 	@staticmethod
 	def getResponsePDU(messageCode,answers,countryCode = None):
-		pduResponse = "0"
-		pduResponse += messageCode
-		pduResponse += countryCode if countryCode else "00"
-		pduResponse += str(len(answers)).zfill(2) # seteo a 2 bytes el campo
+		pduResponse = ["0",messageCode]
+		pduResponse.append(countryCode if countryCode else "00")
+		pduResponse.append(str(len(answers)).zfill(2)) # seteo a 2 bytes el campo
 		for answer in answers: # contruyo seccion de respuestas al query
-			pduResponse += answer[0] + answer[1]  # nombre de zona + tiempo
-		return pduResponse
+			pduResponse.append(answer[0])  # nombre de zona
+			pduResponse.append(answer[1])  # tiempo
+		return ''.join(pduResponse)
 		
-	# El request es una lista:  [is_query,message_code,country_code,answer_count]
 	# Parametros:
+	# El request es una lista:  [is_query,message_code,country_code,answer_count], o el DayTimeRequest de parseRequest
 	#	Request del cliente parseado.
 	#   Diccionario con los Time Zones 
+	#   Instante UTC de la respuesta (opcional, por defecto el actual)
 	@staticmethod
-	def constructResponse(request,timeZones,defaultZone): 
-		isQuery = request[0]
+	def constructResponse(request,timeZones,defaultZone,utcDate = None): 
 		messageCode = request[1]
 		countryCode = request[2]
 		# Si recibo un query, que busca un determinado pais, verifico que sea valido.
 		responseCode = "1"
 		answer = []
+		if utcDate is None:
+			utcDate = datetime.utcnow()   # Todas las respuestas usan el mismo instante
 		if int(messageCode):
 			if countryCode in timeZones:
 				for countryEntry in timeZones[countryCode]: # countryEntry = [nombreZona] 
-					answer.append(DayTimeProtocol.makeAnswerField(countryEntry))
+					answer.append(DayTimeProtocol.makeAnswerField(countryEntry,utcDate))
 			else:
 				# El codigo de pais en invalido, retornar meesage_code = 0 y lista de respuestas vacia 
 				responseCode = "0"
 		else: # El cliente quiere obtener hora en el time zone por defecto (ubicado en el archivo defaultZone.txt)
-			answer.append(DayTimeProtocol.makeAnswerField(defaultZone))
+			answer.append(DayTimeProtocol.makeAnswerField(defaultZone,utcDate))
 		return DayTimeProtocol.getResponsePDU(responseCode,answer,countryCode)
 		
 	
+	# utcDate: instante UTC (datetime sin tzinfo). Si no se especifica se usa el instante actual
 	@staticmethod
-	def makeAnswerField(zoneName):
-		utcDate = datetime.utcnow()
-		utcDate = utcDate.replace(tzinfo=pytz.utc)
-		time = datetime.astimezone(utcDate, pytz.timezone(zoneName))
-		time = datetime.strftime(time,DayTimeProtocol.TIME_FORMAT)
+	def makeAnswerField(zoneName,utcDate = None):
+		if utcDate is None:
+			utcDate = datetime.utcnow()
+		time = DayTimeProtocol.zoneCache.formatTime(zoneName,utcDate)
 		'''if not deltaTime:
 			time = datetime.strftime(datetime.utcnow(),DayTimeProtocol.TIME_FORMAT)
 		else:
@@ -205,6 +672,224 @@ class DayTimeProtocol():
 		return [zoneName.ljust(DayTimeProtocol.BYTES_ANSWER_ZONE_NAME[2]),time]
 	
 	
+	### Formato binario ###
+	
+	# True si la PDU esta en formato binario, de cualquier version (ver checkBinaryVersion)
+	@staticmethod
+	def isBinaryPDU(pdu):
+		return len(pdu) > 0 and ord(pdu[0]) < 0x20
+		
+	# ValueError si la PDU binaria es de otra version (otra tabla de zonas)
+	@staticmethod
+	def checkBinaryVersion(pdu):
+		if ord(pdu[0]) != DayTimeProtocol.BINARY_VERSION:
+			raise ValueError("Version del formato binario distinta: " + str(ord(pdu[0])) + " (se esperaba " + str(DayTimeProtocol.BINARY_VERSION) + ")")
+		
+	@staticmethod
+	def getBinaryRequestPDU(countryCode = None):
+		if countryCode:
+			return DayTimeProtocol.BINARY_HEADER.pack(DayTimeProtocol.BINARY_VERSION,1,1,countryCode[:2],0)
+		return DayTimeProtocol.BINARY_HEADER.pack(DayTimeProtocol.BINARY_VERSION,1,0,"00",0)
+		
+	# answers: lista de (timestamp,utc_offset,zone_id)
+	# La PDU completa se arma con un unico pack_into, usando un struct compilado por cantidad de respuestas
+	@staticmethod
+	def getBinaryResponsePDU(messageCode,answers,countryCode = None):
+		answerCount = len(answers)
+		pduStruct = DayTimeProtocol.binaryResponseStructs.get(answerCount)
+		if not pduStruct:
+			pduStruct = struct.Struct(DayTimeProtocol.BINARY_HEADER.format + DayTimeProtocol.BINARY_ANSWER_FORMAT * answerCount)
+			DayTimeProtocol.binaryResponseStructs[answerCount] = pduStruct
+		values = [DayTimeProtocol.BINARY_VERSION,0,int(messageCode),countryCode if countryCode else "00",answerCount]
+		for answer in answers:
+			values.extend(answer)
+		pdu = bytearray(pduStruct.size)
+		pduStruct.pack_into(pdu,0,*values)
+		return str(pdu)
+		
+	# Retorna BinaryDayTimeRequest (is_query, message_code y answer_count como enteros)
+	@staticmethod
+	def parseBinaryRequest(request):
+		if len(request) < DayTimeProtocol.BINARY_HEADER.size:
+			raise struct.error("PDU incompleta")
+		DayTimeProtocol.checkBinaryVersion(request)
+		return BinaryDayTimeRequest(request)
+		
+	# Retorna BinaryDayTimeResponse, con la misma forma que parseResponse: cada respuesta es [nombre_zona,tiempo] y el tiempo
+	# se formatea con TIME_FORMAT
+	@staticmethod
+	def parseBinaryResponse(response):
+		if len(response) < DayTimeProtocol.BINARY_HEADER.size:
+			raise struct.error("PDU incompleta")
+		DayTimeProtocol.checkBinaryVersion(response)
+		return BinaryDayTimeResponse(response)
+		
+	# Retorna lista de (timestamp,utc_offset,zone_id), leidos con un unico unpack_from
+	@staticmethod
+	def parseBinaryAnswers(response,answerCount,offset = None):
+		if offset is None:
+			offset = DayTimeProtocol.BINARY_HEADER.size
+		values = struct.unpack_from("!" + DayTimeProtocol.BINARY_ANSWER_FORMAT * answerCount,response,offset)
+		return [values[index:index + 3] for index in range(0,len(values),3)]
+		
+	# Convierte (timestamp,utc_offset,zone_id) en [nombre_zona,tiempo]
+	@staticmethod
+	def formatBinaryAnswer(answer):
+		timestamp,utcOffset,zoneId = answer
+		zoneNames = DayTimeProtocol.getZoneTable()[0]
+		zoneName = zoneNames[zoneId] if zoneId < len(zoneNames) else ""
+		return [zoneName,datetime.strftime(datetime.utcfromtimestamp(timestamp + utcOffset),DayTimeProtocol.TIME_FORMAT)]
+		
+	### Query de varios paises (formato binario) ###
+	
+	@staticmethod
+	def getBinaryBatchRequestPDU(countryCodes):
+		header = DayTimeProtocol.BINARY_HEADER.pack(DayTimeProtocol.BINARY_VERSION,1,DayTimeProtocol.FIND_COUNTRIES,"00",len(countryCodes))
+		return header + ''.join(str(countryCode[:2]).ljust(2) for countryCode in countryCodes)
+		
+	# Retorna la lista de codigos de pais del query
+	@staticmethod
+	def parseBinaryBatchRequest(request):
+		DayTimeProtocol.checkBinaryVersion(request)
+		countryCount = DayTimeProtocol.BINARY_HEADER.unpack_from(request)[4]
+		start = DayTimeProtocol.BINARY_HEADER.size
+		if len(request) < start + countryCount * 2:
+			raise ValueError("Query incompleto")
+		return [request[start + index * 2:start + index * 2 + 2] for index in range(countryCount)]
+		
+	# Arma la respuesta con un unico pack (el formato depende de la cantidad de respuestas de cada seccion).
+	# Si el query supera MAX_BATCH_COUNTRIES o MAX_BATCH_ANSWERS retorna la respuesta de query incorrecto
+	@staticmethod
+	def constructBinaryBatchResponse(countryCodes,timeZones,utcDate = None):
+		if len(countryCodes) > DayTimeProtocol.MAX_BATCH_COUNTRIES:
+			return DayTimeProtocol.getBinaryResponsePDU(0,[])
+		sections = []
+		answerCount = 0
+		for countryCode in countryCodes:
+			zoneNames = timeZones.get(countryCode) or []
+			answerCount += len(zoneNames)
+			if answerCount > DayTimeProtocol.MAX_BATCH_ANSWERS:
+				return DayTimeProtocol.getBinaryResponsePDU(0,[])
+			sections.append((countryCode,zoneNames))
+		if utcDate is None:
+			utcDate = datetime.utcnow()   # Todas las secciones usan el mismo instante
+		pduFormat = [DayTimeProtocol.BINARY_HEADER.format]
+		values = [DayTimeProtocol.BINARY_VERSION,0,DayTimeProtocol.FIND_COUNTRIES,"00",len(countryCodes)]
+		for countryCode,zoneNames in sections:
+			pduFormat.append("2sBH" + DayTimeProtocol.BINARY_ANSWER_FORMAT * len(zoneNames))
+			values.extend((countryCode,1 if countryCode in timeZones else 0,len(zoneNames)))
+			for zoneName in zoneNames:
+				values.extend(DayTimeProtocol.makeBinaryAnswerField(zoneName,utcDate))
+		return struct.pack(''.join(pduFormat),*values)
+		
+	# Retorna diccionario { Cod.Pais => [[nombre_zona,tiempo],...] }. Los paises no encontrados tienen valor None.
+	# ValueError si la respuesta es de otra version, esta incompleta o el servidor rechazo el query (ver MAX_BATCH_COUNTRIES)
+	@staticmethod
+	def parseBinaryBatchResponse(response):
+		if len(response) < DayTimeProtocol.BINARY_HEADER.size:
+			raise ValueError("PDU incompleta")
+		DayTimeProtocol.checkBinaryVersion(response)
+		version,isQuery,messageCode,countryCode,sectionCount = DayTimeProtocol.BINARY_HEADER.unpack_from(response)
+		if messageCode != DayTimeProtocol.FIND_COUNTRIES:
+			raise ValueError("El servidor rechazo el query de varios paises")
+		offset = DayTimeProtocol.BINARY_HEADER.size
+		result = {}
+		for index in range(sectionCount):
+			if len(response) < offset + DayTimeProtocol.BINARY_SECTION.size:
+				raise ValueError("PDU incompleta")
+			countryCode,found,answerCount = DayTimeProtocol.BINARY_SECTION.unpack_from(response,offset)
+			offset += DayTimeProtocol.BINARY_SECTION.size
+			if len(response) < offset + answerCount * DayTimeProtocol.BINARY_ANSWER.size:
+				raise ValueError("PDU incompleta")
+			answers = DayTimeProtocol.parseBinaryAnswers(response,answerCount,offset)
+			offset += answerCount * DayTimeProtocol.BINARY_ANSWER.size
+			result[countryCode] = [DayTimeProtocol.formatBinaryAnswer(answer) for answer in answers] if found else None
+		return result
+		
+	# Igual que constructResponse, pero retorna una PDU en formato binario. El request es una lista o el BinaryDayTimeRequest de
+	# parseBinaryRequest
+	@staticmethod
+	def constructBinaryResponse(request,timeZones,defaultZone,utcDate = None):
+		messageCode = request[1]
+		countryCode = request[2]
+		responseCode = 1
+		answer = []
+		if utcDate is None:
+			utcDate = datetime.utcnow()   # Todas las respuestas usan el mismo instante
+		if int(messageCode):
+			if countryCode in timeZones:
+				for countryEntry in timeZones[countryCode]:
+					answer.append(DayTimeProtocol.makeBinaryAnswerField(countryEntry,utcDate))
+			else:
+				responseCode = 0
+		else:
+			answer.append(DayTimeProtocol.makeBinaryAnswerField(defaultZone,utcDate))
+		return DayTimeProtocol.getBinaryResponsePDU(responseCode,answer,countryCode)
+		
+	# Retorna (timestamp,utc_offset,zone_id) de la zona en el instante utcDate (UTC, sin tzinfo)
+	@staticmethod
+	def makeBinaryAnswerField(zoneName,utcDate):
+		utcOffset = DayTimeProtocol.zoneCache.getUTCOffset(zoneName,utcDate)
+		timestamp = calendar.timegm(utcDate.utctimetuple())
+		zoneId = DayTimeProtocol.getZoneTable()[1].get(zoneName.strip(),DayTimeProtocol.UNKNOWN_ZONE_ID)
+		return (timestamp,utcOffset.days * 86400 + utcOffset.seconds,zoneId)
+		
+	# Negociacion de formato: parsea el query recibido y responde en el mismo formato (binario o texto)
+	# Si se especifica un ResponseCache, se reutiliza la respuesta construida para el mismo query en el mismo segundo
+	# (la hora tiene resolucion de un segundo, por lo que la PDU es identica)
+	@staticmethod
+	def answerRequest(pdu,timeZones,defaultZone,responseCache = None):
+		binary = DayTimeProtocol.isBinaryPDU(pdu)
+		request = DayTimeProtocol.parseBinaryRequest(pdu) if binary else DayTimeProtocol.parseRequest(pdu)
+		batch = binary and request.messageCode == DayTimeProtocol.FIND_COUNTRIES
+		if batch:
+			if request.answerCount > DayTimeProtocol.MAX_BATCH_COUNTRIES:   # Sin parsear ni guardar en el cache los codigos de pais
+				return DayTimeProtocol.getBinaryResponsePDU(0,[])
+			countryCodes = DayTimeProtocol.parseBinaryBatchRequest(pdu)
+		now = time.time()
+		utcDate = datetime.utcfromtimestamp(now)
+		if responseCache is None:
+			cacheKey = None
+		else:
+			countryKey = tuple(countryCodes) if batch else request.countryCode
+			cacheKey = (binary,int(request.messageCode),countryKey,int(now))   # (formato,message_code,country_code,segundo)
+			response = responseCache.get(cacheKey,now)
+			if response is not None:
+				return response
+		if batch:
+			response = DayTimeProtocol.constructBinaryBatchResponse(countryCodes,timeZones,utcDate)
+		elif binary:
+			response = DayTimeProtocol.constructBinaryResponse(request,timeZones,defaultZone,utcDate)
+		else:
+			response = DayTimeProtocol.constructResponse(request,timeZones,defaultZone,utcDate)
+		if cacheKey:
+			responseCache.put(cacheKey,response,now)
+		return response
+		
+	# Campos de un request en cualquiera de los dos formatos, para logs: {format,isQuery,messageCode,countryCode(s)}
+	@staticmethod
+	def describeRequest(pdu):
+		if DayTimeProtocol.isBinaryPDU(pdu):
+			request = DayTimeProtocol.parseBinaryRequest(pdu)
+			description = {"format":"binary","isQuery":request.isQuery,"messageCode":request.messageCode}
+			if request.messageCode == DayTimeProtocol.FIND_COUNTRIES:
+				description["countryCodes"] = DayTimeProtocol.parseBinaryBatchRequest(pdu)
+			else:
+				description["countryCode"] = request.countryCode
+			return description
+		request = DayTimeProtocol.parseRequest(pdu)
+		return {"format":"text","isQuery":request.isQuery,"messageCode":request.messageCode,"countryCode":request.countryCode}
+		
+	# Parsea una respuesta en cualquiera de los dos formatos
+	@staticmethod
+	def parseAnyResponse(pdu):
+		if DayTimeProtocol.isBinaryPDU(pdu):
+			if DayTimeProtocol.BINARY_HEADER.unpack_from(pdu)[2] == DayTimeProtocol.FIND_COUNTRIES:
+				return DayTimeProtocol.parseBinaryBatchResponse(pdu)
+			return DayTimeProtocol.parseBinaryResponse(pdu)
+		return DayTimeProtocol.parseResponse(pdu)
+	
+	
 	'''@staticmethod	
 	def getUTCBaseAnswer():
 		zoneName = "UTC+0"
@@ -214,6 +899,86 @@ class DayTimeProtocol():
 		
 		
 		
+# Request/response HTTP parseado (parseHTTPRequest/parseHTTPResponse). La linea inicial se parsea al crearlo; los headers y el
+# cuerpo se decodifican (y se copian del mensaje recibido) recien al accederlos. Se indexa como [startLine,headers,body]
+class HTTPMessage(ParsedMessage):
+	
+	__slots__ = ("_raw","_headersStart","_bodyStart","_headers","_body")
+	FIELDS = ("startLine","headers","body")
+	
+	# raw: mensaje completo. Los headers van de headersStart hasta la linea vacia, y el cuerpo desde bodyStart
+	def __init__(self,raw,headersStart,bodyStart):
+		self._raw = raw
+		self._headersStart = headersStart
+		self._bodyStart = bodyStart
+		self._headers = None
+		self._body = None
+		
+	# Mensaje con los headers y el cuerpo ya decodificados (ej: leidos con HTTPStreamParser)
+	@classmethod
+	def fromParts(cls,startLine,headers,body):
+		message = cls.__new__(cls)
+		message._raw = None
+		message._headers = headers
+		message._body = body
+		message.setStartLine(startLine)
+		return message
+		
+	def decode(self):
+		return (self.startLine,self.headers,self.body)
+		
+	# {header1:value1,header2:value2,...}
+	@property
+	def headers(self):
+		if self._headers is None:
+			headers = {}
+			if self._headersStart < self._bodyStart - 4:
+				for line in self._raw[self._headersStart:self._bodyStart - 4].split("\r\n"):
+					k,separator,v = line.partition(":")   # Igual que HTTPProtocol.parseHeaderLine, sin la llamada por header
+					if separator:
+						headers[k.strip()] = v.strip()
+					elif line:
+						raise ValueError("Header invalido: " + line)
+			self._headers = headers
+			if self._body is not None:
+				self._raw = None
+		return self._headers
+		
+	@property
+	def body(self):
+		if self._body is None:
+			self._body = self._raw[self._bodyStart:]
+			if self._headers is not None:
+				self._raw = None
+		return self._body
+		
+		
+class HTTPRequest(HTTPMessage):
+	
+	__slots__ = ("method","resource","version")
+	
+	def setStartLine(self,startLine):
+		self.method, self.resource, self.version = startLine
+		
+	# [requestType,resource,version]
+	@property
+	def startLine(self):
+		return [self.method,self.resource,self.version]
+		
+		
+class HTTPResponse(HTTPMessage):
+	
+	__slots__ = ("version","statusCode","reasonPhrase")
+	
+	def setStartLine(self,startLine):
+		self.version, self.statusCode, self.reasonPhrase = startLine
+		
+	# [httpVersion,status-code,reason-phrase]
+	@property
+	def startLine(self):
+		return [self.version,self.statusCode,self.reasonPhrase]
+		
+		
 class HTTPProtocol:
 	
 	# La peticion tiene tres partes:
@@ -242,61 +1007,593 @@ class HTTPProtocol:
 	#    \r\n
 	#   - Cuerpo respuesta
 	#
-	#	Retorna lista de 3 elementos:
+	#	Retorna HTTPResponse (indexable como lista de 3 elementos):
 	#		1er elemento (Status Line) = [httpVersion,status-code,reason-phrase] (lista)
 	#		2do elemento (Headers) = {header1:value1,header2,value2,...}   (diccionario)
 	#		3er elemento (Response body) = responseBody (string)
-	#
+	#	Los headers se parsean al accederlos, por lo que un header invalido produce ValueError recien en ese momento.
 	#
 	@staticmethod
 	def parseHTTPResponse(response):
-		HTTPResponseParsed = []    # lista que devolvera el metodo como resultado
-		response,bodyRequest = response.split("\r\n\r\n",1)   # esta linea separa la linea de status-line y los headers de todo el cuerpo de la respuesta. Tiene dos objetos
-		responseParsed = response.split("\r\n") # separo cada parte del response. El primer item es el status-line, los siguientes son los headers
+		headersEnd = response.find("\r\n\r\n")   # fin de la status-line y los headers
+		if headersEnd < 0:
+			raise ValueError("Mensaje HTTP incompleto")
+		lineEnd = response.find("\r\n",0,headersEnd)
+		if lineEnd < 0:
+			lineEnd = headersEnd
+		statusLine = response[:lineEnd]
+		message = HTTPResponse(response,lineEnd + 2,headersEnd + 4)
 		# parseo status-line
-		httpVersion = responseParsed[0][:8]
-		statusCode = responseParsed[0][9:12]
-		reasonPhrase = responseParsed[0][13:]
-		HTTPResponseParsed.append([httpVersion,statusCode,reasonPhrase])
-		# parseo headers
-		headers = {}
-		for headerIndex in range(1,len(responseParsed) - 1):
-			k,v = responseParsed[headerIndex].split(": ")
-			headers[k] = v
-		HTTPResponseParsed.append(headers)
-		# inserto el body del response a la respuesta
-		HTTPResponseParsed.append(bodyRequest)
-		# Retorna response parseado
-		return HTTPResponseParsed
+		message.setStartLine((statusLine[:8],statusLine[9:12],statusLine[13:]))
+		return message
 	
 	
 	#
-	#	Retorna lista de 3 elementos:
+	#	Retorna HTTPRequest (indexable como lista de 3 elementos):
 	#		1er elemento (Status Line) = [requestType,resource,version] (lista)
 	#		2do elemento (Headers) = {header1:value1,header2,value2,...}   (diccionario)
 	#		3er elemento (request body) = requestBody (string)	
 	@staticmethod
 	def parseHTTPRequest(request):
-		HTTPrequestParsed = []    # lista que devolvera el metodo como resultado
-		request,bodyRequest = request.split("\r\n\r\n",1)   # esta linea separa la linea de status-line y los headers de todo el cuerpo de la respuesta. Tiene dos objetos
-		requestParsed = request.split("\r\n") # separo cada parte del request. El primer item es el status-line, los siguientes son los headers
+		headersEnd = request.find("\r\n\r\n")
+		if headersEnd < 0:
+			raise ValueError("Mensaje HTTP incompleto")
+		lineEnd = request.find("\r\n",0,headersEnd)
+		if lineEnd < 0:
+			lineEnd = headersEnd
+		message = HTTPRequest(request,lineEnd + 2,headersEnd + 4)
 		# parseo status-line
-		statusLine =  requestParsed[0].split()
-		requestType = statusLine[0]
-		resource = statusLine[1]
-		version = statusLine[2]
-		HTTPrequestParsed.append([requestType,resource,version])
-		# parseo headers
+		statusLine = request[:lineEnd].split()
+		message.setStartLine(statusLine[:3])
+		return message
+		
+	# Crea una respuesta HTTP completa. Agrega el header Content-Length con el tamaño del cuerpo
+	@staticmethod
+	def createResponse(httpVersion,statusCode,reasonPhrase,headers,body = ""):
+		return HTTPProtocol.createResponseHead(httpVersion,statusCode,reasonPhrase,headers,len(body)) + body
+		
+	# Status-line y headers de una respuesta (hasta la linea vacia), para enviar el cuerpo por separado
+	@staticmethod
+	def createResponseHead(httpVersion,statusCode,reasonPhrase,headers,contentLength):
+		response = [httpVersion + " " + str(statusCode) + " " + reasonPhrase + "\r\n"]
+		for k,v in headers.items():
+			response.append(k + ": " + v + "\r\n")
+		response.append("Content-Length: " + str(contentLength) + "\r\n\r\n")
+		return ''.join(response)
+		
+	# Parsea una linea de header. Retorna (headerKey,headerValue). El valor puede contener ":"
+	@staticmethod
+	def parseHeaderLine(line):
+		k,separator,v = line.partition(":")
+		if not separator:
+			raise ValueError("Header invalido: " + line)
+		return k.strip(),v.strip()
+	
+	
+# Parser incremental de mensajes HTTP/1.1 (requests o responses).
+# Se alimenta con los datos de cada recv (feed), aunque lleguen mensajes partidos o varios mensajes juntos (pipelining),
+# y retorna una lista de eventos:
+#	(MESSAGE,startLine,headers)   Linea inicial y headers de un nuevo mensaje. startLine tiene la misma forma que en parseHTTPRequest/parseHTTPResponse
+#	(BODY,datos)                  Parte del cuerpo del mensaje. El cuerpo no se acumula: se entrega a medida que llega
+#	(END,keepAlive)               Fin del mensaje. keepAlive indica si la conexion sigue abierta para el siguiente mensaje
+# Soporta cuerpos con Content-Length, Transfer-Encoding: chunked y (en responses) hasta el cierre de la conexion.
+# Los errores de formato se informan con ValueError.
+class HTTPStreamParser:
+	
+	# Eventos
+	MESSAGE = "message"
+	BODY = "body"
+	END = "end"
+	
+	# Estados
+	STATE_HEADERS = 0
+	STATE_BODY = 1
+	STATE_CHUNK_SIZE = 2
+	STATE_CHUNK_DATA = 3
+	STATE_CHUNK_END = 4
+	STATE_TRAILERS = 5
+	STATE_BODY_UNTIL_CLOSE = 6
+	
+	maxHeaderSize = 65536
+	
+	def __init__(self,isRequest = True):
+		self.isRequest = isRequest
+		self.buffer = ""
+		self.state = HTTPStreamParser.STATE_HEADERS
+		self.remaining = 0          # bytes que faltan del cuerpo o del chunk actual
+		self.keepAlive = True
+		self.requestMethods = collections.deque()   # Metodos de los requests enviados (para saber si la respuesta tiene cuerpo)
+		
+	# En modo response: registra el metodo del request enviado. Las respuestas a HEAD no tienen cuerpo
+	def expectResponseTo(self,method):
+		self.requestMethods.append(method)
+		
+	def feed(self,data):
+		self.buffer += data
+		events = []
+		while self.step(events):
+			pass
+		return events
+		
+	# Debe llamarse cuando el otro extremo cierra la conexion
+	def close(self):
+		if self.state == HTTPStreamParser.STATE_BODY_UNTIL_CLOSE:
+			self.state = HTTPStreamParser.STATE_HEADERS
+			return [(HTTPStreamParser.END,False)]
+		if self.state != HTTPStreamParser.STATE_HEADERS or self.buffer.strip():
+			raise ValueError("Conexion cerrada con un mensaje incompleto")
+		return []
+		
+	# Procesa los datos del buffer segun el estado actual. Retorna False si se necesitan mas datos
+	def step(self,events):
+		if self.state == HTTPStreamParser.STATE_HEADERS:
+			return self.readHeaders(events)
+		if self.state in (HTTPStreamParser.STATE_BODY,HTTPStreamParser.STATE_CHUNK_DATA):
+			if not self.buffer:
+				return False
+			data = self.buffer[:self.remaining]
+			self.buffer = self.buffer[len(data):]
+			self.remaining -= len(data)
+			events.append((HTTPStreamParser.BODY,data))
+			if not self.remaining:
+				if self.state == HTTPStreamParser.STATE_BODY:
+					self.endMessage(events)
+				else:
+					self.state = HTTPStreamParser.STATE_CHUNK_END
+			return True
+		if self.state == HTTPStreamParser.STATE_CHUNK_SIZE:
+			line = self.readLine()
+			if line is None:
+				return False
+			sizeText = line.split(";")[0].strip()   # Se ignoran las extensiones del chunk
+			if not sizeText or sizeText.lstrip("0123456789abcdefABCDEF"):   # int(...,16) admite signo y prefijo 0x
+				raise ValueError("Tamaño de chunk invalido: " + line)
+			size = int(sizeText,16)
+			if size:
+				self.remaining = size
+				self.state = HTTPStreamParser.STATE_CHUNK_DATA
+			else:
+				self.state = HTTPStreamParser.STATE_TRAILERS
+			return True
+		if self.state == HTTPStreamParser.STATE_CHUNK_END:
+			if len(self.buffer) < 2:
+				return False
+			if self.buffer[:2] != "\r\n":
+				raise ValueError("Falta el fin de linea luego del chunk")
+			self.buffer = self.buffer[2:]
+			self.state = HTTPStreamParser.STATE_CHUNK_SIZE
+			return True
+		if self.state == HTTPStreamParser.STATE_TRAILERS:
+			line = self.readLine()
+			if line is None:
+				return False
+			if not line:   # Los trailers se ignoran
+				self.endMessage(events)
+			return True
+		# STATE_BODY_UNTIL_CLOSE
+		if self.buffer:
+			events.append((HTTPStreamParser.BODY,self.buffer))
+			self.buffer = ""
+		return False
+		
+	def readLine(self):
+		index = self.buffer.find("\r\n")
+		if index < 0:
+			if len(self.buffer) > self.maxHeaderSize:
+				raise ValueError("Linea demasiado larga")
+			return None
+		line = self.buffer[:index]
+		self.buffer = self.buffer[index + 2:]
+		return line
+		
+	def readHeaders(self,events):
+		self.buffer = self.buffer.lstrip("\r\n")   # Lineas vacias entre mensajes
+		index = self.buffer.find("\r\n\r\n")
+		if index < 0:
+			if len(self.buffer) > self.maxHeaderSize:
+				raise ValueError("Headers demasiado largos")
+			return False
+		lines = self.buffer[:index].split("\r\n")
+		self.buffer = self.buffer[index + 4:]
+		startLine = self.parseStartLine(lines[0])
 		headers = {}
-		for headerIndex in range(1,len(requestParsed) - 1):
-			k,v = requestParsed[headerIndex].split(": ")
-			headers[k] = v
-		HTTPrequestParsed.append(headers)
-		# inserto el body del request a la respuesta
-		HTTPrequestParsed.append(bodyRequest)
-		# Retorna request parseado
-		return HTTPrequestParsed
+		fields = {}   # headers con nombre en minusculas
+		for line in lines[1:]:
+			k,v = HTTPProtocol.parseHeaderLine(line)
+			if k in headers:   # Headers repetidos se combinan
+				headers[k] += ", " + v
+			else:
+				headers[k] = v
+			fields[k.lower()] = headers[k]
+		events.append((HTTPStreamParser.MESSAGE,startLine,headers))
+		version = startLine[2] if self.isRequest else startLine[0]
+		connection = fields.get("connection","").lower()
+		if version == "HTTP/1.0":
+			self.keepAlive = "keep-alive" in connection
+		else:
+			self.keepAlive = "close" not in connection
+		if not self.isRequest:
+			if startLine[1][:1] == "1":   # Respuesta intermedia (100 Continue): la respuesta final es al mismo request
+				self.endMessage(events)
+				return True
+			method = self.requestMethods.popleft() if self.requestMethods else None
+			if method == "HEAD" or startLine[1] in ("204","304"):   # Respuestas sin cuerpo
+				self.endMessage(events)
+				return True
+		if "chunked" in fields.get("transfer-encoding","").lower():
+			self.state = HTTPStreamParser.STATE_CHUNK_SIZE
+		elif "content-length" in fields:
+			try:
+				self.remaining = int(fields["content-length"])
+			except ValueError:
+				raise ValueError("Content-Length invalido: " + fields["content-length"])
+			if self.remaining < 0:
+				raise ValueError("Content-Length invalido: " + fields["content-length"])
+			if self.remaining:
+				self.state = HTTPStreamParser.STATE_BODY
+			else:
+				self.endMessage(events)
+		elif self.isRequest:   # Request sin cuerpo
+			self.endMessage(events)
+		else:   # Response sin longitud: el cuerpo termina al cerrarse la conexion
+			self.keepAlive = False
+			self.state = HTTPStreamParser.STATE_BODY_UNTIL_CLOSE
+		return True
+		
+	def parseStartLine(self,line):
+		parts = line.split(" ",2)
+		if self.isRequest:   # [requestType,resource,version]
+			if len(parts) != 3:
+				raise ValueError("Request-Line invalida: " + line)
+			return parts
+		if len(parts) < 2:   # [httpVersion,status-code,reason-phrase]
+			raise ValueError("Status-Line invalida: " + line)
+		return parts + [""] * (3 - len(parts))
+		
+	def endMessage(self,events):
+		events.append((HTTPStreamParser.END,self.keepAlive))
+		self.state = HTTPStreamParser.STATE_HEADERS
+		
+		
+# Decodificadores de tramas (framing) sobre un stream TCP.
+# Se alimentan con los datos que devuelve cada recv (feed) y retornan la lista de tramas completas recibidas hasta el momento.
+# Los datos de una trama incompleta se conservan hasta la siguiente llamada, por lo que funcionan con lecturas parciales
+# y con varias tramas en una misma lectura (clientes que envian pedidos sin esperar la respuesta).
+class FrameDecoder():
+	
+	maxFrameSize = 16 * 1024 * 1024   # Tramas mas grandes se consideran un error del cliente
+	
+	def __init__(self):
+		self.pending = []     # datos recibidos que todavia no forman una trama completa
+		self.pendingSize = 0
+		
+	# Metodo abstracto. Recibe los datos de un recv y retorna la lista de tramas completas
+	def feed(self,data):
+		raise NotImplementedError()
+		
+	# Datos recibidos que no llegaron a formar una trama
+	def remaining(self):
+		return ''.join(self.pending)
+		
+	# Metodo abstracto. Retorna la trama lista para enviar por el socket
+	def encode(self,frame):
+		raise NotImplementedError()
+		
+		
+# Tramas con prefijo de longitud: 4 bytes (entero sin signo, orden de red) seguidos del contenido
+class LengthPrefixFrameDecoder(FrameDecoder):
+	
+	HEADER = struct.Struct("!I")
+	
+	def __init__(self):
+		FrameDecoder.__init__(self)
+		self.frameSize = None   # Tamaño de la trama en curso (None si todavia no se leyo el prefijo)
+		
+	def feed(self,data):
+		self.pending.append(data)
+		self.pendingSize += len(data)
+		frames = []
+		needed = self.HEADER.size if self.frameSize is None else self.frameSize
+		if self.pendingSize < needed:
+			return frames
+		buffer = ''.join(self.pending)   # Solo se une cuando hay datos suficientes para la proxima parte
+		offset = 0   # Se avanza sobre el buffer y lo que sobra se corta una sola vez, al final
+		while len(buffer) - offset >= needed:
+			if self.frameSize is None:
+				self.frameSize = self.HEADER.unpack_from(buffer,offset)[0]
+				if self.frameSize > self.maxFrameSize:
+					raise ValueError("Trama demasiado grande: " + str(self.frameSize) + " bytes")
+			else:
+				frames.append(buffer[offset:offset + needed])
+				self.frameSize = None
+			offset += needed
+			needed = self.HEADER.size if self.frameSize is None else self.frameSize
+		rest = buffer[offset:]
+		self.pending = [rest] if rest else []
+		self.pendingSize = len(rest)
+		return frames
+		
+	def encode(self,frame):
+		return self.HEADER.pack(len(frame)) + frame
+		
+		
+# Tramas separadas por un delimitador (ej: "\0"). El delimitador no forma parte de la trama.
+# Solo se busca el delimitador en los datos nuevos (mas los ultimos bytes anteriores, por si llega partido entre dos lecturas)
+class DelimiterFrameDecoder(FrameDecoder):
+	
+	def __init__(self,delimiter = "\0"):
+		FrameDecoder.__init__(self)
+		self.delimiter = delimiter
+		self.tail = ""
+		
+	def feed(self,data):
+		self.pending.append(data)
+		self.pendingSize += len(data)
+		if self.delimiter not in self.tail + data:
+			if self.pendingSize > self.maxFrameSize:
+				raise ValueError("Trama demasiado grande: " + str(self.pendingSize) + " bytes")
+			self.tail = (self.tail + data)[-(len(self.delimiter) - 1):] if len(self.delimiter) > 1 else ""
+			return []
+		frames = ''.join(self.pending).split(self.delimiter)
+		rest = frames.pop()   # El ultimo elemento es el comienzo de la trama siguiente
+		self.pending = [rest] if rest else []
+		self.pendingSize = len(rest)
+		self.tail = rest[-(len(self.delimiter) - 1):] if len(self.delimiter) > 1 else ""
+		return frames
+		
+	def encode(self,frame):
+		return frame + self.delimiter
+		
+		
+# Sobre (envelope) con identificador de pedido para datagramas UDP. Permite tener muchos pedidos en vuelo sobre un mismo
+# socket y asociar cada respuesta con su pedido (las respuestas pueden llegar desordenadas, duplicadas o no llegar).
+# Formato: MAGIC (2 bytes) + id de pedido (entero sin signo de 4 bytes, orden de red) + datos originales.
+# Los servidores UDP con requestIds = True quitan el sobre antes de manageRequest y lo agregan a la respuesta, por lo que los
+# servicios no cambian. Es opcional por servidor: un datagrama sin sobre que empieza con MAGIC se confundiria con uno con sobre.
+class RequestIdEnvelope():
 	
+	MAGIC = "\xffR"
+	HEADER = struct.Struct("!2sI")
+	MAX_REQUEST_ID = 0xFFFFFFFF
+	
+	@staticmethod
+	def wrap(requestId,data):
+		if isinstance(data,memoryview):   # Respuestas zeroCopy de los servidores
+			data = data.tobytes()
+		return RequestIdEnvelope.HEADER.pack(RequestIdEnvelope.MAGIC,requestId) + data
+		
+	# Retorna (id_pedido,datos). Si el datagrama no tiene sobre retorna (None,datos). Acepta strings y memoryviews
+	@staticmethod
+	def unwrap(data):
+		if len(data) < RequestIdEnvelope.HEADER.size:
+			return None, data
+		magic, requestId = RequestIdEnvelope.HEADER.unpack_from(data)
+		if magic != RequestIdEnvelope.MAGIC:
+			return None, data
+		return requestId, data[RequestIdEnvelope.HEADER.size:]
+		
+		
+# Pool de bytearrays preasignados, para recibir datos con recv_into/recvfrom_into sin crear un string por cada lectura.
+# allocations cuenta los bytearrays creados (los del pool y los de ReceiveBuffer.grow)
+class BufferPool():
+	
+	def __init__(self,bufferSize = 65536,maxBuffers = 64):
+		self.bufferSize = bufferSize
+		self.maxBuffers = maxBuffers   # Cantidad maxima de buffers libres que se conservan
+		self.freeBuffers = []
+		self.allocations = 0
+		
+	def acquire(self):
+		try:
+			return self.freeBuffers.pop()
+		except IndexError:
+			return self.allocate(self.bufferSize)
+			
+	def allocate(self,size):
+		self.allocations += 1
+		return bytearray(size)
+			
+	def release(self,buffer):
+		if len(buffer) == self.bufferSize and len(self.freeBuffers) < self.maxBuffers:
+			self.freeBuffers.append(buffer)
+			
+			
+# Buffer de recepcion de una conexion. Recibe con recv_into sobre un bytearray del pool y entrega memoryviews de los datos.
+# Si los datos no entran en el buffer, se duplica su tamaño (costo lineal en la cantidad de bytes recibidos)
+class ReceiveBuffer():
+	
+	def __init__(self,pool):
+		self.pool = pool
+		self.buffer = pool.acquire()
+		self.view = memoryview(self.buffer)
+		self.size = 0   # bytes ocupados
+		
+	def clear(self):
+		self.size = 0
+		
+	def isFull(self):
+		return self.size == len(self.buffer)
+		
+	def grow(self):
+		newBuffer = self.pool.allocate(len(self.buffer) * 2)
+		newBuffer[:self.size] = self.view[:self.size]
+		self.pool.release(self.buffer)
+		self.buffer = newBuffer
+		self.view = memoryview(newBuffer)
+		
+	# Recibe del socket en el espacio libre del buffer. Retorna la cantidad de bytes recibidos (0 si se cerro la conexion)
+	def receive(self,sock,flags = 0):
+		if self.isFull():
+			self.grow()
+		received = sock.recv_into(self.view[self.size:],0,flags)
+		self.size += received
+		return received
+		
+	def getData(self):
+		return self.view[:self.size]
+		
+	# Devuelve el buffer al pool. No se debe usar mas el ReceiveBuffer ni los memoryviews que entrego
+	def release(self):
+		self.pool.release(self.buffer)
+		self.buffer = self.view = None
+		
+		
+# Envio no bloqueante con llamadas al sistema que la libreria socket de Python 2 no expone (sendmsg con varios buffers y sendfile),
+# a traves de ctypes. Si la libc no esta disponible (o no es Linux) se usan send y read + send.
+# ctypes y las estructuras de sendmsg se cargan en el primer envio (getLibc), no al importar el modulo.
+class TCPDataSender():
+	
+	MAX_IOV = 64   # Buffers por llamada a sendmsg (IOV_MAX es 1024)
+	libc = None
+	IOVec = None
+	MsgHdr = None
+	
+	@staticmethod
+	def getLibc():
+		if TCPDataSender.libc is None:
+			try:
+				import ctypes
+				import ctypes.util   # find_library importa subprocess, tempfile, re...: solo se carga en el primer envio
+				class IOVec(ctypes.Structure):
+					_fields_ = [("base",ctypes.c_void_p),("length",ctypes.c_size_t)]
+				class MsgHdr(ctypes.Structure):
+					_fields_ = [("name",ctypes.c_void_p),("nameLength",ctypes.c_uint32),("iov",ctypes.POINTER(IOVec)),("iovLength",ctypes.c_size_t),
+						("control",ctypes.c_void_p),("controlLength",ctypes.c_size_t),("flags",ctypes.c_int)]
+				libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno = True)
+				libc.sendmsg.argtypes = [ctypes.c_int,ctypes.POINTER(MsgHdr),ctypes.c_int]
+				libc.sendmsg.restype = ctypes.c_ssize_t
+				libc.sendfile.argtypes = [ctypes.c_int,ctypes.c_int,ctypes.POINTER(ctypes.c_int64),ctypes.c_size_t]
+				libc.sendfile.restype = ctypes.c_ssize_t
+				TCPDataSender.IOVec, TCPDataSender.MsgHdr = IOVec, MsgHdr
+			except (ImportError,OSError,AttributeError,TypeError):
+				libc = False
+			TCPDataSender.libc = libc
+		return TCPDataSender.libc
+		
+	# Envia sin bloquear (MSG_DONTWAIT) la lista de buffers (strings) en una sola llamada. offset: bytes ya enviados del primer buffer.
+	# Retorna la cantidad de bytes enviados (0 si el socket no admite mas datos)
+	@staticmethod
+	def sendParts(sock,parts,offset = 0):
+		libc = TCPDataSender.getLibc()
+		if not libc or len(parts) == 1:
+			data = parts[0] if len(parts) == 1 else ''.join(parts)
+			return TCPDataSender.sendNonBlocking(sock,buffer(data,offset) if offset else data)
+		import ctypes
+		parts = parts[:TCPDataSender.MAX_IOV]
+		iov = (TCPDataSender.IOVec * len(parts))()
+		for index,part in enumerate(parts):
+			start = offset if index == 0 else 0
+			iov[index].base = ctypes.cast(ctypes.c_char_p(part),ctypes.c_void_p).value + start   # Sin copiar el string
+			iov[index].length = len(part) - start
+		header = TCPDataSender.MsgHdr(None,0,iov,len(parts),None,0,0)
+		sent = libc.sendmsg(sock.fileno(),ctypes.byref(header),socket.MSG_DONTWAIT)   # Python ignora SIGPIPE: un cliente cerrado produce EPIPE
+		if sent < 0:
+			error = ctypes.get_errno()
+			if error in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+				return 0
+			raise socket.error(error,os.strerror(error))
+		return sent
+		
+	@staticmethod
+	def sendNonBlocking(sock,data):
+		try:
+			return sock.send(data,socket.MSG_DONTWAIT)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+				return 0
+			raise
+			
+	# Envia sin bloquear hasta count bytes del archivo desde offset, sin pasar los datos por Python (sendfile).
+	# Retorna la cantidad de bytes enviados (0 si el socket no admite mas datos)
+	# sendfile no tiene flags (MSG_DONTWAIT): solo se usa si el socket ya es no bloqueante, como los socks de los clientes de los
+	# handlers multiusuario. Con un socket bloqueante (SimpleTCPHandler) se lee el archivo y se envia con MSG_DONTWAIT.
+	@staticmethod
+	def sendFile(sock,fileObject,offset,count):
+		libc = TCPDataSender.getLibc()
+		if not libc or sock.gettimeout() != 0.0:
+			fileObject.seek(offset)
+			return TCPDataSender.sendNonBlocking(sock,fileObject.read(min(count,65536)))
+		import ctypes
+		fileOffset = ctypes.c_int64(offset)
+		sent = libc.sendfile(sock.fileno(),fileObject.fileno(),ctypes.byref(fileOffset),count)
+		error = ctypes.get_errno()
+		if sent < 0:
+			if error in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+				return 0
+			raise socket.error(error,os.strerror(error))
+		return sent
+		
+		
+# Buffer de salida de una conexion. Las respuestas se encolan (strings, memoryviews o partes de archivos) y se envian sin bloquear
+# a medida que el socket lo permite (write). Los strings consecutivos se envian con un unico sendmsg y los archivos con sendfile.
+class OutputBuffer():
+	
+	def __init__(self):
+		self.chunks = collections.deque()   # data (string/memoryview) o [archivo,offset,cantidad]
+		self.offset = 0     # Bytes ya enviados del primer chunk (string/memoryview)
+		self.size = 0       # Bytes pendientes de envio
+		self.closeWhenEmpty = False
+		self.paused = False   # La lectura de la conexion esta pausada hasta que el buffer se vacie (ver watermarks en AbstractTCPServer)
+		
+	def append(self,data):
+		if len(data):
+			self.chunks.append(data)
+			self.size += len(data)
+			
+	def appendFile(self,fileObject,offset,count):
+		if count:
+			self.chunks.append([fileObject,offset,count])
+			self.size += count
+			
+	# Los memoryviews pueden apuntar a buffers de recepcion que se reutilizan: se copian los que quedan pendientes
+	def detach(self):
+		if any(isinstance(chunk,memoryview) for chunk in self.chunks):
+			self.chunks = collections.deque(chunk.tobytes() if isinstance(chunk,memoryview) else chunk for chunk in self.chunks)
+			
+	# Envia todo lo que el socket admita sin bloquear. Retorna la cantidad de bytes enviados
+	def write(self,sock):
+		total = 0
+		while self.chunks:
+			chunk = self.chunks[0]
+			if isinstance(chunk,list):   # Parte de un archivo
+				fileObject, offset, count = chunk
+				sent = TCPDataSender.sendFile(sock,fileObject,offset,count)
+				if sent == 0 and count:
+					break
+				chunk[1] += sent
+				chunk[2] -= sent
+				if chunk[2] == 0:
+					self.chunks.popleft()
+			else:
+				if isinstance(chunk,memoryview):
+					parts = [chunk]
+					sent = TCPDataSender.sendNonBlocking(sock,chunk[self.offset:])
+				else:
+					parts = []
+					for part in self.chunks:   # Strings consecutivos: una sola llamada
+						if not isinstance(part,str) or len(parts) == TCPDataSender.MAX_IOV:
+							break
+						parts.append(part)
+					sent = TCPDataSender.sendParts(sock,parts,self.offset)
+				if sent == 0:
+					break
+				self.consume(sent)
+			total += sent
+			self.size -= sent
+		return total
+		
+	# Descarta sent bytes de los chunks de datos enviados
+	def consume(self,sent):
+		sent += self.offset
+		while sent and self.chunks and not isinstance(self.chunks[0],list):
+			length = len(self.chunks[0])
+			if sent < length:
+				break
+			self.chunks.popleft()
+			sent -= length
+		self.offset = sent
+		
+		
 # Clase TCPDataReceiver
 # Implementa los distintos metodos de recepcion de datos sobre un socket
 class TCPDataReceiver():
@@ -318,24 +1615,102 @@ class TCPDataReceiver():
 			total_data.append(data)
 		return ''.join(total_data)'''
 	
-	# receiveData. Recibe datos en un bucle, del cual se escapa cuando se reciben 0 bytes en el socket. (En TCP sucede cuando se cierra la conexion)
+	# receiveData. Recibe datos en un bucle mientras cada lectura llene el buffer.
+	# Solo la primera lectura bloquea: las siguientes leen sin bloquear (MSG_DONTWAIT) lo que ya llego, por lo que unos datos de
+	# justo bufferSize bytes (o un multiplo) no dejan la llamada esperando mas datos (igual que receiveDataInto).
+	# No delimita mensajes: retorna lo que llego hasta el momento, que puede ser parte de un mensaje. Para eso usar receiveFrames.
 	@staticmethod
-	def receiveData(socket,bufferSize):
-		data = socket.recv(bufferSize)
+	def receiveData(sock,bufferSize):
+		data = sock.recv(bufferSize)
+		total_data = [data]
 		while len(data) == bufferSize:
-			data += socket.recv(bufferSize)
-		return data
+			try:
+				data = sock.recv(bufferSize,socket.MSG_DONTWAIT)
+			except socket.timeout:
+				break
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+					break
+				raise
+			total_data.append(data)   # Si el cliente cerro, la siguiente llamada recibe ""
+		return ''.join(total_data)
+		
+	# receiveDataInto. Recibe con recv_into sobre el bytearray de un ReceiveBuffer (sin crear un string por lectura).
+	# Solo la primera lectura bloquea: si llena el buffer, se duplica y se lee sin bloquear (MSG_DONTWAIT) lo que ya llego, por lo
+	# que unos datos que llenan el buffer justo no dejan la llamada esperando mas datos. Lo que llegue despues queda para la siguiente
+	# llamada (el siguiente evento de lectura en los handlers multiusuario).
+	# Retorna un memoryview con los datos recibidos, valido hasta la proxima recepcion sobre el mismo ReceiveBuffer.
+	@staticmethod
+	def receiveDataInto(sock,receiveBuffer):
+		receiveBuffer.clear()
+		received = receiveBuffer.receive(sock)
+		while received and receiveBuffer.isFull():
+			try:
+				received = receiveBuffer.receive(sock,socket.MSG_DONTWAIT)
+			except socket.timeout:
+				break
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+					break
+				raise
+		return receiveBuffer.getData()
 	
 	# receiveEndData. Recibe datos en un bucle, el cual termina cuando se recibe un o un conjunto de bytes especificados.
+	# El delimitador puede llegar junto con los datos. Si se cierra la conexion antes, retorna lo recibido.
+	# Los datos recibidos luego del delimitador se descartan (para conexiones con varios mensajes usar receiveFrames).
+	# Con un socket no bloqueante se espera (select) el resto del mensaje, igual que con uno bloqueante.
 	@staticmethod
-	def receiveEndData(socket,endExpession,bufferSize):
-		total_data=[]
+	def receiveEndData(sock,endExpession,bufferSize):
+		decoder = DelimiterFrameDecoder(endExpession)
 		while True:
-			data = socket.recv(bufferSize)
-			if not data or data == endExpession:
-				break
-			total_data.append(data)
-		return ''.join(total_data)
+			try:
+				data = sock.recv(bufferSize)
+			except socket.error as e:
+				if e.args[0] not in (errno.EAGAIN,errno.EWOULDBLOCK) or not decoder.remaining():
+					raise
+				import select
+				select.select([sock],[],[])
+				continue
+			if not data:
+				return decoder.remaining()
+			frames = decoder.feed(data)
+			if frames:
+				return frames[0]
+	
+	# receiveFrames. Lee del socket hasta completar al menos una trama, y retorna todas las tramas completas recibidas.
+	# El decodificador (FrameDecoder) conserva los datos de la trama siguiente, por lo que se debe usar uno por conexion.
+	# Retorna una lista vacia si el cliente cerro la conexion. Bloquea hasta completar una trama: es para clientes
+	# (los servidores multiusuario usan receiveAvailableFrames).
+	@staticmethod
+	def receiveFrames(socket,decoder,bufferSize):
+		while True:
+			frames = TCPDataReceiver.receiveAvailableFrames(socket,decoder,bufferSize)
+			if frames is None:
+				return []
+			if frames:
+				return frames
+				
+	# Una sola lectura del socket (para un evento de lectura de epoll). Retorna las tramas completas recibidas (ReceivedFrames,
+	# vacia si todavia no se completo ninguna o el socket no bloqueante no tenia datos) o None si el cliente cerro la conexion
+	@staticmethod
+	def receiveAvailableFrames(sock,decoder,bufferSize):
+		try:
+			data = sock.recv(bufferSize)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+				return ReceivedFrames()
+			raise
+		if not data:
+			return None
+		return ReceivedFrames(decoder.feed(data))
+		
+		
+# Tramas completas de una lectura. Es verdadera aunque este vacia: los handlers de los servidores cierran la conexion cuando
+# receiveData retorna un valor falso, y una trama incompleta no es el fin de la conexion
+class ReceivedFrames(list):
+	
+	def __nonzero__(self):
+		return True
 
 
 
@@ -363,10 +1738,65 @@ class TCPDataReceiver():
 #				Code 01 =>  El nodo origen pasa el token a su vecino.
 #				Code 02 =>  El nodo origen desea enviar un mensaje al nodo destino. 
 #				Code 03 =>  El nodo destino, le avisa al nodo origen que su mensaje fue recibido.
+#				Code 04 =>  El nodo origen se postula para regenerar el token (eleccion luego de perder el token).
 # message: Mensaje (String) que envía el origen al destino (Tiene sentido cuando el código de mensaje = 2. En cualquier otro tipo de mensaje esta campo se ignora)
 #
+# Token con lote (ver TokenRingNode en ahmtokenring): en la PDU del token (code 01) message lleva las PDUs que viajan con el token
+# en esa vuelta (mensajes code 02 y acks code 03), cada una precedida por su largo y el id del mensaje (ENTRY_HEADER).
+# En el token nodeDest es la generacion del token modulo 100 (ver eleccion), por lo que un token sin PDUs de la generacion 0 es
+# igual al de getPassTokenPDU. En un ack, message es el id (4 bytes, orden de red) del ultimo mensaje del nodo destino recibido
+# por el nodo origen (ack acumulativo: los mensajes entre dos nodos llegan en orden).
+# Eleccion (code 04): message es la generacion (4 bytes, orden de red) del token que el nodo origen propone crear.
+#
 
 
+# PDU Token Ring parseada (parsePDU). Cada campo se corta de la PDU al accederlo; se usa como el diccionario que retornaba
+# parsePDU (ver KeyedMessage)
+class TokenRingPDU(KeyedMessage):
+	
+	__slots__ = ("pdu","messageCode")
+	FIELDS = ("nodeSource","nodeDest","messageCode","message")
+	
+	def __init__(self,pdu):
+		self.pdu = pdu
+		self.messageCode = pdu[4:6]
+		
+	@property
+	def nodeSource(self):
+		return self.pdu[0:2]
+		
+	@nodeSource.setter
+	def nodeSource(self,value):
+		self.pdu = TokenRingPDU.checkNode(value) + self.pdu[2:]
+		
+	@property
+	def nodeDest(self):
+		return self.pdu[2:4]
+		
+	@nodeDest.setter
+	def nodeDest(self,value):
+		self.pdu = self.pdu[:2] + TokenRingPDU.checkNode(value) + self.pdu[4:]
+		
+	@property
+	def message(self):
+		return self.pdu[6:]
+		
+	@message.setter
+	def message(self,value):
+		self.pdu = self.pdu[:6] + value
+		
+	# Los nodos se cortan de la PDU por posicion: se pueden reemplazar solo por valores del mismo tamaño
+	@staticmethod
+	def checkNode(value):
+		if len(value) != 2:
+			raise ValueError("Nodo invalido: " + repr(value))
+		return value
+		
+	def decode(self):
+		pdu = self.pdu
+		return (pdu[0:2],pdu[2:4],self.messageCode,pdu[6:])
+		
+		
 class MRTokenRingProtocol():
 	
 	# Campos de la PDU
@@ -375,6 +1805,8 @@ class MRTokenRingProtocol():
 	BYTES_NODE_DEST = (2,4,2)
 	BYTES_CODE = (4,6,2)
 	BYTES_MESSAGE = (6,-1,-1) # En este caso se ignoran los dos ultimos valores. Siempre se lee hasta el final
+	ENTRY_HEADER = struct.Struct("!II")   # Entradas del lote del token: largo de la PDU, id del mensaje
+	ACK_ID = struct.Struct("!I")   # Id del mensaje en los acks y generacion en las elecciones
 	
 	@staticmethod
 	def createPDU(source,dest,code,message = ""):
@@ -400,17 +1832,244 @@ class MRTokenRingProtocol():
 		return MRTokenRingProtocol.createPDU("00","00","01")
 	
 	@staticmethod	
-	# Retorna dicc. con los campos de la PDU parseados.
-	# claves => nodeSource,nodeDest,messageCode,message
+	# Retorna TokenRingPDU con los campos de la PDU (se decodifican al accederlos).
+	# campos => nodeSource,nodeDest,messageCode,message (tambien como claves: pdu["messageCode"])
 	def parsePDU(pdu):
-		result  = {}
-		result["nodeSource"] = pdu[MRTokenRingProtocol.BYTES_NODE_SOURCE[0]:MRTokenRingProtocol.BYTES_NODE_SOURCE[1]]
-		result["nodeDest"] = pdu[MRTokenRingProtocol.BYTES_NODE_DEST[0]:MRTokenRingProtocol.BYTES_NODE_DEST[1]]
-		result["messageCode"] = pdu[MRTokenRingProtocol.BYTES_CODE[0]:MRTokenRingProtocol.BYTES_CODE[1]]
-		result["message"] = pdu[MRTokenRingProtocol.BYTES_MESSAGE[0]:]
-		return result
+		return TokenRingPDU(pdu)
+	
+	# Crea la PDU del token con las PDUs del lote (lista de (id del mensaje,pdu))
+	@staticmethod
+	def createTokenPDU(source,entries,generation = 0):
+		header = MRTokenRingProtocol.ENTRY_HEADER.pack
+		parts = [MRTokenRingProtocol.createPDU(source,str(generation % 100),"01")]
+		for messageId,pdu in entries:
+			parts.append(header(len(pdu),messageId))
+			parts.append(pdu)
+		return "".join(parts)
+	
+	# Retorna la lista de (id del mensaje,pdu) que lleva el token
+	@staticmethod
+	def parseTokenEntries(pdu):
+		unpack = MRTokenRingProtocol.ENTRY_HEADER.unpack_from
+		headerSize = MRTokenRingProtocol.ENTRY_HEADER.size
+		offset = MRTokenRingProtocol.BYTES_MESSAGE[0]
+		end = len(pdu)
+		entries = []
+		while offset < end:
+			if offset + headerSize > end:
+				raise ValueError("Lote del token truncado")
+			length, messageId = unpack(pdu,offset)
+			offset += headerSize
+			entries.append((messageId,pdu[offset:offset + length]))
+			offset += length
+		if offset != end:
+			raise ValueError("Lote del token truncado")
+		return entries
+	
+	@staticmethod
+	def createAckPDU(source,dest,messageId):
+		return MRTokenRingProtocol.createPDU(source,dest,"03",MRTokenRingProtocol.ACK_ID.pack(messageId))
+	
+	@staticmethod
+	def parseAckId(pdu):
+		return MRTokenRingProtocol.ACK_ID.unpack_from(pdu,MRTokenRingProtocol.BYTES_MESSAGE[0])[0]
+	
+	@staticmethod
+	def createClaimPDU(source,generation):
+		return MRTokenRingProtocol.createPDU(source,"00","04",MRTokenRingProtocol.ACK_ID.pack(generation))
+	
+	@staticmethod
+	def parseClaimGeneration(pdu):
+		return MRTokenRingProtocol.ACK_ID.unpack_from(pdu,MRTokenRingProtocol.BYTES_MESSAGE[0])[0]
+		
 		
 		
+### CANAL CIFRADO ###
+
+# Canal cifrado sobre TCP (ver AbstractSecureTCPServer en ahmservers y SecureTCPClient en ahmclients).
+# RSA se usa solo en el handshake, para que el cliente envie al servidor una clave maestra aleatoria. Los mensajes se cifran con
+# SessionCipher (ChaCha20-Poly1305), sin base64: cada PDU es una trama con prefijo de longitud (LengthPrefixFrameDecoder) cuyo primer byte es el tipo.
+#
+#	Tipo 01 (CLIENT_HELLO)   cliente => servidor: client_random (16 bytes) + session_id (16 bytes, o nada en un handshake completo)
+#	Tipo 02 (SERVER_HELLO)   servidor => cliente: server_random (16 bytes) + session_id (16 bytes) + clave publica RSA del servidor
+#	                         (PKCS#1 DER). Sin clave publica si el servidor reanuda la sesion pedida
+#	Tipo 03 (KEY_EXCHANGE)   cliente => servidor: clave maestra (32 bytes) cifrada con la clave publica del servidor (PKCS#1 v1.5)
+#	Tipo 04 (DATA)           en ambos sentidos: mensaje cifrado + tag de autenticacion (ver SessionCipher)
+#
+# Reanudacion de sesiones: el servidor guarda la clave maestra de cada session_id por un tiempo. Si el CLIENT_HELLO trae un
+# session_id conocido, ambos derivan las claves de la conexion de la clave maestra guardada y de los randoms nuevos, sin RSA.
+# Si el servidor no lo conoce responde un SERVER_HELLO completo y el cliente hace el intercambio de clave.
+# El cliente puede enviar PDUs DATA a continuacion del KEY_EXCHANGE, sin esperar respuesta (un solo viaje de ida y vuelta).
+
+
+# Cifrado autenticado de los mensajes de una conexion: ChaCha20-Poly1305 (AEAD) de la libreria cryptography, que se carga recien
+# al crear el primer SessionCipher (igual que rsa). Cada sentido tiene su propia clave, derivada con HKDF-SHA256 de la clave maestra
+# y de los randoms del cliente y del servidor, y cada mensaje su numero de secuencia (implicito: TCP entrega en orden) como nonce,
+# por lo que no se autentica un mensaje modificado, repetido, reordenado o de otra conexion.
+class SessionCipher():
+	
+	TAG_SIZE = 16
+	KEY_SIZE = 32
+	NONCE = struct.Struct("!4xQ")   # 96 bits: 4 bytes en cero + secuencia
+	
+	def __init__(self,masterKey,clientRandom,serverRandom,isClient):
+		from cryptography.hazmat.backends import default_backend
+		from cryptography.hazmat.primitives import hashes
+		from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+		from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+		from cryptography.exceptions import InvalidTag
+		keys = HKDF(hashes.SHA256(),2 * SessionCipher.KEY_SIZE,clientRandom + serverRandom,"ahm secure channel",default_backend()).derive(masterKey)
+		clientKey, serverKey = keys[:SessionCipher.KEY_SIZE], keys[SessionCipher.KEY_SIZE:]
+		self.sendAead = ChaCha20Poly1305(clientKey if isClient else serverKey)
+		self.receiveAead = ChaCha20Poly1305(serverKey if isClient else clientKey)
+		self.invalidTag = InvalidTag
+		self.sendSequence = 0
+		self.receiveSequence = 0
+		
+	# Retorna el mensaje cifrado seguido del tag
+	def encrypt(self,message):
+		sequence = self.sendSequence
+		self.sendSequence += 1
+		return self.sendAead.encrypt(SessionCipher.NONCE.pack(sequence),message,None)
+		
+	# Descifra record[offset:] (mensaje cifrado + tag). ValueError si el tag no corresponde
+	def decrypt(self,record,offset = 0):
+		if len(record) - offset < SessionCipher.TAG_SIZE:
+			raise ValueError("Mensaje cifrado incompleto")
+		try:
+			message = self.receiveAead.decrypt(SessionCipher.NONCE.pack(self.receiveSequence),record[offset:],None)
+		except self.invalidTag:
+			raise ValueError("Mensaje cifrado no autenticado")
+		self.receiveSequence += 1
+		return message
+		
+		
+class SecureChannelProtocol():
+	
+	CLIENT_HELLO = "\x01"
+	SERVER_HELLO = "\x02"
+	KEY_EXCHANGE = "\x03"
+	DATA = "\x04"
+	RANDOM_SIZE = 16
+	SESSION_ID_SIZE = 16
+	MASTER_KEY_SIZE = 32
+	
+	# Retorna (clave publica,clave privada) RSA nuevas. Generar una clave de 2048 bits demora algunos segundos
+	@staticmethod
+	def createKeys(keySize = 2048):
+		import rsa   # rsa se carga recien con el primer uso del canal cifrado
+		return rsa.newkeys(keySize)
+		
+	@staticmethod
+	def getPublicKey(privateKey):
+		import rsa
+		return rsa.PublicKey(privateKey.n,privateKey.e)
+		
+	@staticmethod
+	def createRandom(size = RANDOM_SIZE):
+		return os.urandom(size)
+		
+	@staticmethod
+	def createClientHello(clientRandom,sessionId = ""):
+		return SecureChannelProtocol.CLIENT_HELLO + clientRandom + sessionId
+		
+	# Retorna (client_random,session_id). session_id es "" en un handshake completo
+	@staticmethod
+	def parseClientHello(pdu):
+		sessionId = pdu[1 + SecureChannelProtocol.RANDOM_SIZE:]
+		if len(pdu) < 1 + SecureChannelProtocol.RANDOM_SIZE or len(sessionId) not in (0,SecureChannelProtocol.SESSION_ID_SIZE):
+			raise ValueError("CLIENT_HELLO invalido")
+		return pdu[1:1 + SecureChannelProtocol.RANDOM_SIZE], sessionId
+		
+	@staticmethod
+	def createServerHello(serverRandom,sessionId,publicKey = None):
+		return SecureChannelProtocol.SERVER_HELLO + serverRandom + sessionId + (publicKey.save_pkcs1("DER") if publicKey else "")
+		
+	# Retorna (server_random,session_id,clave publica). La clave publica es None si el servidor reanuda la sesion
+	@staticmethod
+	def parseServerHello(pdu):
+		keyStart = 1 + SecureChannelProtocol.RANDOM_SIZE + SecureChannelProtocol.SESSION_ID_SIZE
+		if pdu[:1] != SecureChannelProtocol.SERVER_HELLO or len(pdu) < keyStart:
+			raise ValueError("SERVER_HELLO invalido")
+		publicKey = None
+		if len(pdu) > keyStart:
+			import rsa
+			try:
+				publicKey = rsa.PublicKey.load_pkcs1(pdu[keyStart:],"DER")
+			except Exception as e:   # pyasn1 tiene sus propias excepciones de decodificacion
+				raise ValueError("Clave publica invalida: " + str(e))
+		return pdu[1:1 + SecureChannelProtocol.RANDOM_SIZE], pdu[1 + SecureChannelProtocol.RANDOM_SIZE:keyStart], publicKey
+		
+	@staticmethod
+	def createKeyExchange(masterKey,publicKey):
+		import rsa
+		return SecureChannelProtocol.KEY_EXCHANGE + rsa.encrypt(masterKey,publicKey)
+		
+	# Retorna la clave maestra enviada por el cliente. Rechazo implicito: si el relleno PKCS#1 es invalido o la clave no tiene el
+	# tamaño esperado se retorna una clave aleatoria en lugar de un error. El handshake continua igual y la conexion falla recien
+	# al autenticar el primer mensaje, sin revelar al cliente por que (oraculo de relleno de Bleichenbacher)
+	@staticmethod
+	def parseKeyExchange(pdu,privateKey):
+		import rsa
+		randomKey = os.urandom(SecureChannelProtocol.MASTER_KEY_SIZE)
+		try:
+			masterKey = rsa.decrypt(pdu[1:],privateKey)
+		except rsa.pkcs1.CryptoError:
+			return randomKey
+		if len(masterKey) != SecureChannelProtocol.MASTER_KEY_SIZE:
+			return randomKey
+		return masterKey
+		
+	@staticmethod
+	def createDataPDU(cipher,message):
+		return SecureChannelProtocol.DATA + cipher.encrypt(message)
+		
+	# Retorna el mensaje descifrado. ValueError si la PDU no es DATA o no se autentica
+	@staticmethod
+	def parseDataPDU(cipher,pdu):
+		if pdu[:1] != SecureChannelProtocol.DATA:
+			raise ValueError("Se esperaba una PDU DATA")
+		return cipher.decrypt(pdu,1)
+		
+		
+# Canal con RSA en cada mensaje, el que reemplaza SecureChannelProtocol. Se conserva para comparar (ver secure-tcp en ahmbenchmark).
+# Al conectarse, cliente y servidor se envian su clave publica (PKCS#1 DER en base64). Luego cada mensaje se parte en bloques de
+# hasta (tamaño de la clave - 11) bytes, cada bloque se cifra con la clave publica del destinatario y el resultado viaja en base64.
+# Un mensaje (o clave) por linea (DelimiterFrameDecoder("\n")).
+class RSAMessageProtocol():
+	
+	@staticmethod
+	def createKeyLine(publicKey):
+		from base64 import b64encode
+		return b64encode(publicKey.save_pkcs1("DER"))
+		
+	@staticmethod
+	def parseKeyLine(line):
+		import rsa
+		from base64 import b64decode
+		try:
+			return rsa.PublicKey.load_pkcs1(b64decode(line),"DER")
+		except Exception as e:
+			raise ValueError("Clave publica invalida: " + str(e))
+			
+	@staticmethod
+	def encryptMessage(message,publicKey):
+		import rsa
+		from base64 import b64encode
+		chunkSize = rsa.common.byte_size(publicKey.n) - 11   # Relleno de PKCS#1 v1.5
+		return b64encode(''.join(rsa.encrypt(message[index:index + chunkSize],publicKey) for index in range(0,max(len(message),1),chunkSize)))
+		
+	@staticmethod
+	def decryptMessage(line,privateKey):
+		import rsa
+		from base64 import b64decode
+		blockSize = rsa.common.byte_size(privateKey.n)
+		try:
+			data = b64decode(line)
+			return ''.join(rsa.decrypt(data[index:index + blockSize],privateKey) for index in range(0,len(data),blockSize))
+		except (TypeError,rsa.pkcs1.CryptoError):   # b64decode lanza TypeError
+			raise ValueError("Mensaje RSA invalido")
+		
 		
 class Now:
     def __init__(self):
@@ -23,17 +23,19 @@
 #  
 import socket
 import select
-import ahmclients
-from ahmprotocols import HTTPProtocol,DayTimeProtocol,TCPDataReceiver,MRTokenRingProtocol,Now
-import json
-import datetime
-from urlparse import urlparse
+import errno
+import fcntl
+import collections
+from ahmmetrics import ServerMetrics,formatPrometheus
+from ahmprotocols import HTTPProtocol,DayTimeProtocol,TCPDataReceiver,MRTokenRingProtocol,Now,LengthPrefixFrameDecoder,BufferPool,ReceiveBuffer,ResponseCache,CompiledZoneDatabase,HTTPStreamParser,RequestIdEnvelope,OutputBuffer,DelimiterFrameDecoder,SecureChannelProtocol,SessionCipher,RSAMessageProtocol
+import struct
 import time
-import subprocess
 import os
-import rsa
 import threading
-from base64 import b64decode
+import Queue
+import signal
+
+SO_REUSEPORT = getattr(socket,"SO_REUSEPORT",15)   # Python 2 no define la constante (15 en Linux)
 
 
 
@@ -47,6 +49,8 @@ from base64 import b64decode
 	#               |						|																				|		
 	#				|						|																				|
 	#				|						|---------MultipleTCPHandler													|
+	#				|						|---------EpollTCPHandler														|
+	#				|						|---------ThreadPoolTCPHandler													|
 	#				|																										|
 	#				|																										|
 	#				|																										|
@@ -72,6 +76,10 @@ from base64 import b64decode
 class AbstractServer:   # Clase abstracta. Defino bases para implementar servidores TCP/UDP
 
 	bufferSize = 4096
+	metrics = None      # ServerMetrics si las metricas estan habilitadas (ver enableMetrics)
+	profiler = None     # ServerProfiler si el profiling esta habilitado (ver enableProfiling)
+	reusePort = False   # Si es True, varios procesos pueden hacer bind al mismo host:puerto (el kernel reparte conexiones/datagramas)
+	socketError = None  # Excepcion que impidio crear el socket (ver ServerWorkerPool). None si se creo
 	
 	
 	def __init__(self,host,port,sockFamily,sockType):
@@ -79,11 +87,13 @@ class AbstractServer:   # Clase abstracta. Defino bases para implementar servido
 		self.port = port
 		self.sockFamily = sockFamily
 		self.sockType = sockType
+		self.running = True
 		try:
 			self.createSocket()
 			self.initializeSocket()
 			print "Socket creado (" + self.host + ":" +  str(self.port) + ")"
 		except Exception as e:
+			self.socketError = e
 			print "No se ha podido crear el socket"
 			print e
 		
@@ -92,12 +102,70 @@ class AbstractServer:   # Clase abstracta. Defino bases para implementar servido
 	def createSocket(self):
 		self.socket = socket.socket(self.sockFamily,self.sockType)
 		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Permito reutilizar socket
+		if self.reusePort:
+			self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
 		self.socket.bind((self.host,self.port))
 		
 	#Las sub-clases que deben realizar acciones sobre el socket del servidor, deben sobreescribir este metodo
 	def initializeSocket(self):
 		pass
 		
+	# Invocado en cada worker de un ServerWorkerPool luego del fork, cuando el servidor fue creado en el proceso padre.
+	# Las sub-clases que tengan recursos que no se deben compartir entre procesos, deben sobreescribir este metodo
+	def initializeWorker(self):
+		pass
+		
+	# Finaliza el bucle principal del servidor (se puede invocar desde un manejador de señales)
+	def stop(self):
+		self.running = False
+		
+	# Habilita las metricas del servidor (ver ahmmetrics). Retorna el ServerMetrics, que se puede compartir entre servidores.
+	# Sin metricas habilitadas los servidores no miden nada: los metodos medidos se reemplazan solo en esta instancia
+	def enableMetrics(self,metrics = None):
+		if self.metrics:
+			self.disableMetrics()
+		self.metrics = metrics if metrics is not None else ServerMetrics()
+		self.metrics.instrument(self)
+		self.metrics.addGauge("activeConnections",self.countConnections)   # Se suman con los de otros servidores con las mismas metricas
+		self.metrics.addGauge("queueDepth",self.getQueueDepth)
+		return self.metrics
+		
+	def disableMetrics(self):
+		if self.metrics:
+			self.metrics.uninstrument(self)
+			self.metrics.removeGauge("activeConnections",self.countConnections)
+			self.metrics.removeGauge("queueDepth",self.getQueueDepth)
+			self.metrics = None
+			
+	# Habilita el profiling del servidor (ver ahmprofiler): muestreo de stacks sampleRate veces por segundo (0: sin muestreo) y
+	# log de los pedidos que tardan mas de slowThreshold segundos (None: sin log) en slowLog (por defecto stderr). Retorna el ServerProfiler
+	def enableProfiling(self,sampleRate = 100,slowThreshold = 0.1,slowLog = None):
+		from ahmprofiler import ServerProfiler   # ahmprofiler importa json: solo se carga si se habilita el profiling
+		self.disableProfiling()
+		self.profiler = ServerProfiler(self,sampleRate,slowThreshold,slowLog)
+		self.profiler.start()
+		return self.profiler
+		
+	def disableProfiling(self):
+		if self.profiler:
+			self.profiler.stop()
+			self.profiler = None
+			
+	# Campos del pedido para el log de requests lentos. Las sub-clases que conocen el protocolo deben sobreescribirlo
+	def describeRequest(self,data):
+		if isinstance(data,list):   # Tramas de AbstractFramedTCPServer
+			return {"frames":len(data),"size":sum(len(frame) for frame in data)}
+		if isinstance(data,memoryview):
+			data = data.tobytes()
+		return {"size":len(data),"data":repr(data[:64])}
+		
+	# Gauges. Cantidad de conexiones abiertas y de pedidos/respuestas encolados (las sub-clases que los tengan deben sobreescribirlos)
+	def countConnections(self):
+		return 0
+		
+	def getQueueDepth(self):
+		return 0
+		
 	
 	
 	# Método abstracto. Las sub-clases deben implementarlo. Se debe escribir el bucle principal del servidor
@@ -110,15 +178,27 @@ class AbstractTCPServer(AbstractServer):
 	
 	# Constantes de clase
 	connectionsNumber = 10
+	zeroCopy = False   # Si es True, receiveData retorna un memoryview sobre un buffer de la conexion (ver receiveDataInto)
+	receiveBufferPool = BufferPool()
 	MULTIPLE = "multiple"
 	SINGLE = "single"
+	EPOLL = "epoll"
+	THREADPOOL = "threadpool"
+	highWatermark = 1024 * 1024   # Con mas bytes pendientes de envio se deja de leer de la conexion (el cliente no esta leyendo)...
+	lowWatermark = 256 * 1024     # ...hasta que los pendientes bajan de este valor
 	
-	def __init__(self,host,port,handler = "single"):   # Tiene asociado un handler. SimpleTCPHandler acepta un cliente por vez. MultipleTCPHandler acepta múltiples clientes
+	def __init__(self,host,port,handler = "single"):   # Tiene asociado un handler. SimpleTCPHandler acepta un cliente por vez. MultipleTCPHandler acepta múltiples clientes. EpollTCPHandler acepta múltiples clientes usando epoll
+		self.receiveBuffers = {}   # sock del cliente => ReceiveBuffer (modo zeroCopy)
+		self.outputBuffers = {}    # sock del cliente => OutputBuffer (datos pendientes de envio)
 		AbstractServer.__init__(self,host,port,socket.AF_INET, socket.SOCK_STREAM)
 		if handler == AbstractTCPServer.SINGLE:
 			self.handler = SimpleTCPHandler(self)
 		elif handler == AbstractTCPServer.MULTIPLE:
 			self.handler = MultipleTCPHandler(self)
+		elif handler == AbstractTCPServer.EPOLL:
+			self.handler = EpollTCPHandler(self)
+		elif handler == AbstractTCPServer.THREADPOOL:
+			self.handler = ThreadPoolTCPHandler(self)
 			
 		
 	
@@ -132,20 +212,126 @@ class AbstractTCPServer(AbstractServer):
 		print "Conexion desde:", client_sock.getpeername()
 		return client_sock, client_addr	
 
+	# Acepta la conexion que el handler detecto en el socket del servidor. Retorna None si ya no hay conexiones pendientes: en los
+	# workers de un ServerWorkerPool en modo FORK el socket es compartido y no bloqueante (ver initializeWorker de los handlers),
+	# y otro worker puede haber aceptado la conexion
+	def acceptReadyConnection(self):
+		try:
+			return self.acceptConnection()
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+				return None
+			raise
+
 	
 	
 	# Metodo que recibe datos desde el sock del cliente pasado como parametro.
 	# El metodo estandar que utiliza es el metodo "receiveData" que se encuentra implementado en la clase TCPDataReceiver dentro del paquete ahmprotocols
 	# Si se desea utilizar otro metodo, se debe sobreescribir el mismo en las clases hijas.
 	def receiveData(self,client_sock):
+		if self.zeroCopy:
+			return self.receiveDataInto(client_sock)
 		return TCPDataReceiver.receiveData(client_sock,self.bufferSize)
 		
+	# Recibe con recv_into sobre un buffer propio de la conexion (tomado de receiveBufferPool) y retorna un memoryview de los datos.
+	# El memoryview es valido hasta la siguiente recepcion sobre el mismo sock; si manageRequest necesita conservarlo debe copiarlo (tobytes).
+	def receiveDataInto(self,client_sock):
+		receiveBuffer = self.receiveBuffers.get(client_sock)
+		if not receiveBuffer:
+			receiveBuffer = self.receiveBuffers[client_sock] = ReceiveBuffer(self.receiveBufferPool)
+		data = TCPDataReceiver.receiveDataInto(client_sock,receiveBuffer)
+		if not len(data):   # El cliente cerro la conexion
+			del self.receiveBuffers[client_sock]
+			receiveBuffer.release()
+		return data
+		
+	# Escritura de respuestas (semantica de sendall: siempre se envian todos los datos).
+	# Con SimpleTCPHandler se envia bloqueando. Con los handlers multiusuario las respuestas se encolan en el OutputBuffer de la
+	# conexion, se envia sin bloquear lo que el socket admita y el resto lo envia el handler cuando el socket esta disponible
+	# para escritura, por lo que un cliente que no lee no bloquea al resto. Si los datos pendientes superan highWatermark se deja
+	# de leer de la conexion hasta que bajen de lowWatermark.
 	def sendResponse(self,client_sock,data):
-		client_sock.send(data)
+		self.getOutputBuffer(client_sock).append(data)
+		self.flushOutput(client_sock)
+		
+	# Respuesta en varias partes (ej: headers y cuerpo), sin unirlas en un unico string: se envian con un unico sendmsg
+	def sendResponseParts(self,client_sock,parts):
+		output = self.getOutputBuffer(client_sock)
+		for part in parts:
+			output.append(part)
+		self.flushOutput(client_sock)
+		
+	# Envia count bytes del archivo desde offset (por defecto hasta el final) con sendfile, sin leerlo desde Python.
+	# El archivo no se debe cerrar hasta que se termine de enviar (ver hasPendingOutput)
+	def sendFile(self,client_sock,fileObject,offset = 0,count = None):
+		if count is None:
+			count = os.fstat(fileObject.fileno()).st_size - offset
+		self.getOutputBuffer(client_sock).appendFile(fileObject,offset,count)
+		self.flushOutput(client_sock)
+		
+	def getOutputBuffer(self,client_sock):
+		output = self.outputBuffers.get(client_sock)
+		if output is None:
+			output = self.outputBuffers[client_sock] = OutputBuffer()
+		return output
+		
+	def hasPendingOutput(self,client_sock):
+		return client_sock in self.outputBuffers and self.outputBuffers[client_sock].size > 0
+		
+	# Envia los datos pendientes de la conexion. Lo invocan sendResponse y el handler cuando el socket esta disponible para escritura
+	def flushOutput(self,client_sock):
+		output = self.outputBuffers.get(client_sock)
+		if output is None:
+			return
+		if not self.handler.bufferedWrites:
+			while output.size:
+				if not output.write(client_sock):
+					select.select([],[client_sock],[])
+		else:
+			output.write(client_sock)
+		if output.size:
+			output.detach()
+			if output.size > self.highWatermark:
+				output.paused = True
+		if output.paused and output.size <= self.lowWatermark:
+			output.paused = False
+		if not output.size and output.closeWhenEmpty:
+			self.handler.closeConnection(client_sock)
+			return
+		if not output.size and not output.paused:
+			del self.outputBuffers[client_sock]
+		if self.handler.bufferedWrites:
+			self.handler.updateConnection(client_sock,output)
+			
+	def discardOutput(self,client_sock):
+		self.outputBuffers.pop(client_sock,None)
+		
+	# Cierra la conexion luego de enviar los datos pendientes
+	def closeConnection(self,client_sock):
+		output = self.outputBuffers.get(client_sock)
+		if output and output.size:
+			output.closeWhenEmpty = True
+			self.handler.updateConnection(client_sock,output)   # Se deja de leer de la conexion
+		else:
+			self.handler.closeConnection(client_sock)
 			
 	def run(self):
-		while 1:
-			self.handler.handleRequests()
+		while self.running:
+			try:
+				self.handler.handleRequests()
+			except (socket.error,select.error) as e:
+				if e.args[0] != errno.EINTR:  # Una señal (ej: stop) interrumpe la espera
+					raise
+					
+	def initializeWorker(self):
+		if hasattr(self.handler,"initializeWorker"):
+			self.handler.initializeWorker()
+			
+	def countConnections(self):
+		return self.handler.countConnections()
+		
+	def getQueueDepth(self):
+		return self.handler.getQueueDepth() if hasattr(self.handler,"getQueueDepth") else 0
 	
 		
 
@@ -153,21 +339,377 @@ class AbstractTCPServer(AbstractServer):
 	def manageRequest(self,clientSock,data):
 		raise NotImplementedError()
 		
+
+# Servidor TCP con mensajes delimitados por tramas (por defecto con prefijo de longitud, ver FrameDecoder en ahmprotocols).
+# Mantiene un decodificador por conexion, por lo que soporta lecturas parciales, mensajes grandes y clientes que envian
+# varios pedidos sin esperar la respuesta. receiveData retorna la lista de tramas completas y manageRequest las procesa en orden.
+# Requiere un handler multiusuario: SimpleTCPHandler hace una sola lectura por conexion, por lo que no leeria las tramas que no
+# entran en una lectura ni las que el cliente envia despues.
+class AbstractFramedTCPServer(AbstractTCPServer):
+	
+	frameDecoderClass = LengthPrefixFrameDecoder
+	
+	def __init__(self,host,port,handler = "epoll"):
+		if handler == AbstractTCPServer.SINGLE:
+			raise ValueError("AbstractFramedTCPServer no admite el handler " + handler + " (usar multiple, epoll o threadpool)")
+		self.frameDecoders = {}   # sock del cliente => FrameDecoder
+		AbstractTCPServer.__init__(self,host,port,handler)
+		
+	def createFrameDecoder(self):
+		return self.frameDecoderClass()
+		
+	def receiveData(self,client_sock):
+		decoder = self.frameDecoders.get(client_sock)
+		if not decoder:
+			decoder = self.frameDecoders[client_sock] = self.createFrameDecoder()
+		try:
+			frames = TCPDataReceiver.receiveAvailableFrames(client_sock,decoder,self.bufferSize)
+		except (socket.error,ValueError):
+			frames = None
+		if frames is None:   # El cliente cerro la conexion (o envio una trama invalida)
+			del self.frameDecoders[client_sock]
+			return []
+		return frames   # Puede no tener tramas (trama incompleta): el resto llega en los siguientes eventos
+		
+	def manageRequest(self,clientSock,frames):
+		for frame in frames:
+			self.manageFrame(clientSock,frame)
+			
+	def sendFrame(self,clientSock,frame):
+		self.sendResponse(clientSock,self.frameDecoders[clientSock].encode(frame))
+		
+	# Metodo abstracto a implementar por los servidores concretos. Se invoca por cada trama recibida
+	def manageFrame(self,clientSock,frame):
+		raise NotImplementedError()
+		
+		
+# Servidor TCP con canal cifrado (ver SecureChannelProtocol en ahmprotocols). Atiende el handshake de cada conexion y entrega a
+# manageMessage los mensajes ya descifrados; las respuestas se envian cifradas con sendMessage.
+# La clave privada RSA solo se usa en los handshakes completos. Las claves maestras quedan en sessionCache (un ResponseCache,
+# que se puede compartir entre servidores) durante sessionTimeout segundos para reanudar sesiones sin RSA.
+# Un handshake invalido o un mensaje que no se autentica cierran la conexion. Un KEY_EXCHANGE que no se descifra no: el servidor
+# continua con una clave maestra aleatoria (ver parseKeyExchange) y cierra al no autenticarse el primer mensaje.
+class AbstractSecureTCPServer(AbstractFramedTCPServer):
+	
+	keySize = 2048
+	sessionTimeout = 3600.0
+	maxSessions = 4096
+	
+	def __init__(self,host,port,handler = "epoll",privateKey = None,sessionCache = None):
+		if privateKey is None:
+			privateKey = SecureChannelProtocol.createKeys(self.keySize)[1]
+		self.privateKey = privateKey
+		self.publicKey = SecureChannelProtocol.getPublicKey(privateKey)
+		self.sessionCache = sessionCache if sessionCache is not None else ResponseCache(self.maxSessions,self.sessionTimeout)
+		self.channels = {}   # sock del cliente => SessionCipher, o (client_random,server_random,session_id) hasta el KEY_EXCHANGE
+		self.fullHandshakes = 0
+		self.resumedHandshakes = 0
+		AbstractFramedTCPServer.__init__(self,host,port,handler)
+		
+	def receiveData(self,client_sock):
+		frames = AbstractFramedTCPServer.receiveData(self,client_sock)
+		if not frames:
+			self.channels.pop(client_sock,None)
+		return frames
+		
+	def manageRequest(self,clientSock,frames):
+		for frame in frames:
+			try:
+				message = self.processFrame(clientSock,frame)
+			except ValueError:   # Handshake invalido o mensaje no autenticado: se cierra la conexion
+				self.channels.pop(clientSock,None)
+				self.closeConnection(clientSock)
+				return
+			if message is not None:
+				self.manageMessage(clientSock,message)
+				
+	# Avanza el handshake de la conexion o descifra un mensaje. Retorna el mensaje descifrado (None si la PDU era del handshake)
+	def processFrame(self,clientSock,frame):
+		channel = self.channels.get(clientSock)
+		pduType = frame[:1]
+		if pduType == SecureChannelProtocol.DATA and isinstance(channel,SessionCipher):
+			return SecureChannelProtocol.parseDataPDU(channel,frame)
+		if pduType == SecureChannelProtocol.CLIENT_HELLO and channel is None:
+			clientRandom, sessionId = SecureChannelProtocol.parseClientHello(frame)
+			serverRandom = SecureChannelProtocol.createRandom()
+			masterKey = self.sessionCache.get(sessionId) if sessionId else None
+			if masterKey is not None:   # Reanudacion: sin RSA
+				self.resumedHandshakes += 1
+				self.channels[clientSock] = SessionCipher(masterKey,clientRandom,serverRandom,False)
+				self.sendFrame(clientSock,SecureChannelProtocol.createServerHello(serverRandom,sessionId))
+			else:
+				sessionId = SecureChannelProtocol.createRandom(SecureChannelProtocol.SESSION_ID_SIZE)
+				self.channels[clientSock] = (clientRandom,serverRandom,sessionId)
+				self.sendFrame(clientSock,SecureChannelProtocol.createServerHello(serverRandom,sessionId,self.publicKey))
+			return None
+		if pduType == SecureChannelProtocol.KEY_EXCHANGE and isinstance(channel,tuple):
+			clientRandom, serverRandom, sessionId = channel
+			masterKey = SecureChannelProtocol.parseKeyExchange(frame,self.privateKey)
+			self.fullHandshakes += 1
+			self.sessionCache.put(sessionId,masterKey)
+			self.channels[clientSock] = SessionCipher(masterKey,clientRandom,serverRandom,False)
+			return None
+		raise ValueError("PDU inesperada: " + repr(pduType))
+		
+	def sendMessage(self,clientSock,message):
+		self.sendFrame(clientSock,SecureChannelProtocol.createDataPDU(self.channels[clientSock],message))
+		
+	# Metodo abstracto a implementar por los servidores concretos. Se invoca por cada mensaje descifrado
+	def manageMessage(self,clientSock,message):
+		raise NotImplementedError()
+		
+		
+# Servidor TCP con RSA en cada mensaje (ver RSAMessageProtocol en ahmprotocols). Es el canal que reemplaza AbstractSecureTCPServer;
+# se conserva para comparar. La primera linea de cada conexion es la clave publica del cliente, y el servidor responde con la suya
+class AbstractRSATCPServer(AbstractFramedTCPServer):
+	
+	keySize = 2048
+	
+	def __init__(self,host,port,handler = "epoll",privateKey = None):
+		if privateKey is None:
+			privateKey = SecureChannelProtocol.createKeys(self.keySize)[1]
+		self.privateKey = privateKey
+		self.publicKey = SecureChannelProtocol.getPublicKey(privateKey)
+		self.clientKeys = {}   # sock del cliente => clave publica del cliente
+		AbstractFramedTCPServer.__init__(self,host,port,handler)
+		
+	def createFrameDecoder(self):
+		return DelimiterFrameDecoder("\n")
+		
+	def receiveData(self,client_sock):
+		frames = AbstractFramedTCPServer.receiveData(self,client_sock)
+		if not frames:
+			self.clientKeys.pop(client_sock,None)
+		return frames
+		
+	def manageRequest(self,clientSock,frames):
+		for frame in frames:
+			try:
+				self.manageFrame(clientSock,frame)
+			except ValueError:   # Clave o mensaje invalido: se cierra la conexion
+				self.clientKeys.pop(clientSock,None)
+				self.closeConnection(clientSock)
+				return
+				
+	def manageFrame(self,clientSock,frame):
+		if clientSock not in self.clientKeys:
+			self.clientKeys[clientSock] = RSAMessageProtocol.parseKeyLine(frame)
+			self.sendFrame(clientSock,RSAMessageProtocol.createKeyLine(self.publicKey))
+		else:
+			self.manageMessage(clientSock,RSAMessageProtocol.decryptMessage(frame,self.privateKey))
+			
+	def sendMessage(self,clientSock,message):
+		self.sendFrame(clientSock,RSAMessageProtocol.encryptMessage(message,self.clientKeys[clientSock]))
+		
+	# Metodo abstracto a implementar por los servidores concretos. Se invoca por cada mensaje descifrado
+	def manageMessage(self,clientSock,message):
+		raise NotImplementedError()
+		
+		
+# Servidor HTTP/1.1 con conexiones persistentes (keep-alive) y pipelining. Mantiene un HTTPStreamParser por conexion:
+# los datos se procesan a medida que llegan y el cuerpo de los requests se entrega por partes, sin acumularlo.
+# Las sub-clases implementan handleRequestStart/handleRequestBody/handleRequestEnd, y responden (en orden) con sendResponse.
+# Si el request indica que no se mantiene la conexion, se cierra luego de handleRequestEnd.
+# Requiere un handler multiusuario: SimpleTCPHandler hace una sola lectura por conexion, por lo que no leeria los requests
+# siguientes (keep-alive, pipelining) ni los cuerpos que no entran en una lectura.
+class AbstractHTTPServer(AbstractTCPServer):
+	
+	BAD_REQUEST = HTTPProtocol.createResponse("HTTP/1.1",400,"Bad Request",{"Connection":"close"})
+	
+	def __init__(self,host,port,handler = "epoll"):
+		if handler == AbstractTCPServer.SINGLE:
+			raise ValueError("AbstractHTTPServer no admite el handler " + handler + " (usar multiple, epoll o threadpool)")
+		self.httpParsers = {}   # sock del cliente => HTTPStreamParser
+		AbstractTCPServer.__init__(self,host,port,handler)
+		
+	# Una sola lectura por evento: el parser conserva los mensajes incompletos
+	def receiveData(self,client_sock):
+		data = TCPDataReceiver.receiveSingleData(client_sock,self.bufferSize)
+		if not data:
+			self.httpParsers.pop(client_sock,None)
+		return data
+		
+	def closeConnection(self,clientSock):
+		self.httpParsers.pop(clientSock,None)
+		AbstractTCPServer.closeConnection(self,clientSock)
+		
+	# Envia la respuesta sin copiar el cuerpo en un unico string con los headers (ver sendResponseParts)
+	def sendHTTPResponse(self,clientSock,statusCode,reasonPhrase,headers,body = ""):
+		self.sendResponseParts(clientSock,[HTTPProtocol.createResponseHead("HTTP/1.1",statusCode,reasonPhrase,headers,len(body)),body])
+		
+	# Respuesta con el contenido de un archivo como cuerpo, enviado con sendfile (ver sendFile)
+	def sendHTTPFile(self,clientSock,statusCode,reasonPhrase,headers,fileObject):
+		size = os.fstat(fileObject.fileno()).st_size
+		self.sendResponse(clientSock,HTTPProtocol.createResponseHead("HTTP/1.1",statusCode,reasonPhrase,headers,size))
+		self.sendFile(clientSock,fileObject,0,size)
+		
+	def manageRequest(self,clientSock,data):
+		parser = self.httpParsers.get(clientSock)
+		if not parser:
+			parser = self.httpParsers[clientSock] = HTTPStreamParser()
+		try:
+			events = parser.feed(data)
+		except ValueError:
+			self.sendResponse(clientSock,self.BAD_REQUEST)
+			self.closeConnection(clientSock)
+			return
+		for event in events:
+			if event[0] == HTTPStreamParser.MESSAGE:
+				self.handleRequestStart(clientSock,event[1],event[2])
+			elif event[0] == HTTPStreamParser.BODY:
+				self.handleRequestBody(clientSock,event[1])
+			else:
+				keepAlive = event[1]
+				self.handleRequestEnd(clientSock,keepAlive)
+				if not keepAlive:
+					self.closeConnection(clientSock)
+					return
+					
+	# Los datos de manageRequest son lo que llego en una lectura: se describe el primer request line que contengan
+	def describeRequest(self,data):
+		for line in data.split("\r\n"):
+			requestLine = line.split()
+			if len(requestLine) == 3 and requestLine[2].startswith("HTTP/"):
+				return {"method":requestLine[0],"resource":requestLine[1],"version":requestLine[2],"size":len(data)}
+		return {"size":len(data)}
+		
+	# Comienzo de un request. requestLine = [requestType,resource,version], headers = {header:valor}
+	def handleRequestStart(self,clientSock,requestLine,headers):
+		raise NotImplementedError()
+		
+	# Parte del cuerpo del request en curso. Por defecto se descarta
+	def handleRequestBody(self,clientSock,data):
+		pass
+		
+	# Fin del request en curso. Se debe enviar la respuesta
+	def handleRequestEnd(self,clientSock,keepAlive):
+		raise NotImplementedError()
+		
 		
 class AbstractUDPServer(AbstractServer):
 	
 	
+	zeroCopy = False   # Si es True, manageRequest recibe un memoryview sobre un unico buffer del servidor, valido hasta el siguiente datagrama
+	batchSize = 1      # Si es mayor a 1, el servidor atiende los datagramas por lotes (ver runBatched)
+	requestIds = False   # Si es True, los datagramas llegan con RequestIdEnvelope (clientes ReliableUDPClient) y las respuestas lo llevan
+	
 	def __init__(self,host,port):
+		self.batching = False
+		self.pendingResponses = collections.deque()   # (data,address) de las respuestas del lote en curso
+		self.packetsReceived = 0
+		self.packetsSent = 0
+		self.batchesProcessed = 0
+		self.sendErrors = 0   # Respuestas descartadas porque sendto fallo (ej: EMSGSIZE)
+		self.requestId = None   # Id del pedido en curso si el datagrama llego con RequestIdEnvelope
 		AbstractServer.__init__(self,host,port,socket.AF_INET, socket.SOCK_DGRAM)
 	
 	
 	def run(self):
-		while True:                    # Bucle principal del servidor
-			data, address = self.socket.recvfrom(self.bufferSize) # espera conexiones
+		if self.batchSize > 1:
+			return self.runBatched()
+		if self.zeroCopy:
+			receiveBuffer = bytearray(self.bufferSize)
+			receiveView = memoryview(receiveBuffer)
+		while self.running:                    # Bucle principal del servidor
+			try:
+				if self.zeroCopy:
+					received, address = self.socket.recvfrom_into(receiveBuffer)
+					data = receiveView[:received]
+				else:
+					data, address = self.socket.recvfrom(self.bufferSize) # espera conexiones
+			except socket.error as e:
+				if e.args[0] == errno.EINTR:  # Una señal (ej: stop) interrumpe la espera
+					continue
+				raise
+			self.dispatchRequest(address,data)
+			
+	# Con requestIds, quita el sobre con id de pedido (si lo tiene) y pasa el pedido a manageRequest. Las respuestas que envie
+	# manageRequest (sendResponse) llevan el mismo id, para que el cliente las asocie con el pedido
+	def dispatchRequest(self,address,data):
+		if self.requestIds:
+			self.requestId, data = RequestIdEnvelope.unwrap(data)
+		try:
 			self.manageRequest(address,data)
+		finally:
+			self.requestId = None
+			
+	# Bucle principal por lotes: en cada despertar del epoll se leen todos los datagramas disponibles (hasta batchSize)
+	# con recvfrom_into sobre buffers preasignados, se pasan a manageRequest y luego se envian juntas todas las respuestas.
+	# Para repartir la carga entre nucleos, usar ServerWorkerPool en modo REUSEPORT (un socket por worker).
+	def runBatched(self):
+		views = [memoryview(bytearray(self.bufferSize)) for index in range(self.batchSize)]
+		self.socket.setblocking(0)
+		poller = select.epoll()
+		poller.register(self.socket.fileno(),select.EPOLLIN)
+		self.batching = True
+		fullBatch = False
+		try:
+			while self.running:
+				if not fullBatch:   # Si el lote anterior se lleno, seguramente hay mas datagramas: no se espera
+					try:
+						poller.poll()
+					except IOError as e:
+						if e.errno == errno.EINTR:  # Una señal (ej: stop) interrumpe la espera
+							continue
+						raise
+				fullBatch = False
+				if self.flushResponses():   # Respuestas de lotes anteriores que no se pudieron enviar
+					datagrams = self.receiveBatch(views)
+					for data,address in datagrams:
+						self.dispatchRequest(address,data)
+					self.batchesProcessed += 1
+					fullBatch = self.flushResponses() and len(datagrams) == len(views)
+				poller.modify(self.socket.fileno(),select.EPOLLOUT if self.pendingResponses else select.EPOLLIN)
+		finally:
+			self.batching = False
+			poller.close()
+			
+	# Lee los datagramas disponibles. Retorna lista de (data,address)
+	def receiveBatch(self,views):
+		datagrams = []
+		for view in views:
+			try:
+				received, address = self.socket.recvfrom_into(view)
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+					break
+				raise
+			datagrams.append((view[:received] if self.zeroCopy else view[:received].tobytes(),address))
+		self.packetsReceived += len(datagrams)
+		return datagrams
+		
+	# Envia las respuestas pendientes. Retorna False si el socket no admite mas datos (quedan respuestas pendientes).
+	# Una respuesta que falla por otro motivo (ej: EMSGSIZE, destino inalcanzable) se descarta y se sigue con el resto del lote
+	def flushResponses(self):
+		while self.pendingResponses:
+			data, address = self.pendingResponses[0]
+			try:
+				self.socket.sendto(data,address)
+				self.packetsSent += 1
+			except socket.error as e:
+				if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):
+					# Los memoryviews apuntan a buffers que se reutilizan en el proximo lote
+					self.pendingResponses = collections.deque((data.tobytes() if isinstance(data,memoryview) else data,address) for data,address in self.pendingResponses)
+					return False
+				self.sendErrors += 1
+				print "No se pudo enviar la respuesta a " + str(address) + ": " + str(e)
+			self.pendingResponses.popleft()
+		return True
 	
+	def getQueueDepth(self):
+		return len(self.pendingResponses)
+		
 	def sendResponse(self,address,data):
-		self.socket.sendto(data,address)
+		if self.requestId is not None:
+			data = RequestIdEnvelope.wrap(self.requestId,data)
+		if self.batching:
+			self.pendingResponses.append((data,address))
+		else:
+			try:
+				self.socket.sendto(data,address)
+			except socket.error as e:   # La respuesta se descarta: un error de envio no debe terminar el bucle del servidor
+				self.sendErrors += 1
+				print "No se pudo enviar la respuesta a " + str(address) + ": " + str(e)
 	
 	# Metodo abstract a implementar por las sub-clases. Definir la lógica a realizar cuando llega un peticion de un cliente
 	def manageRequest(self,address,data):
@@ -186,29 +728,454 @@ class SimpleTCPHandler:
 		data = self.server.receiveData(client_sock)  # recibo datos desde el sock del cliente que inicio la conexion
 		self.server.manageRequest(client_sock,data)
 		
+	bufferedWrites = False   # Las respuestas se envian bloqueando (ver AbstractTCPServer.sendResponse)
+	
+	def closeConnection(self,client_sock):
+		self.server.discardOutput(client_sock)
+		client_sock.close()
+		
+	def countConnections(self):
+		return 0
+		
 		
 class MultipleTCPHandler:
 	
 	
 	connectionLists = []
+	bufferedWrites = True
 	
 	def __init__(self,server):
 		self.server = server
 		self.connectionLists.append(self.server.socket) # Agrego socket del servidor a la lista de conexiones
+		self.writeSockets = set()    # Conexiones con datos pendientes de envio
+		self.pausedSockets = set()   # Conexiones de las que no se lee (ver watermarks en AbstractTCPServer)
+		
+	# Los workers comparten el socket del servidor: una conexion despierta a todos y solo uno la acepta. Sin bloquear en accept,
+	# los demas siguen atendiendo a sus clientes (ver acceptReadyConnection)
+	def initializeWorker(self):
+		self.server.socket.setblocking(0)
 
 
 	# Metodo que maneja las conexiones de los clientes (En este caso acepta multiples conexiones)
 	def handleRequests(self):
-		readSockets,writeSockets,errorSockets = select.select(self.connectionLists,[],[])
+		readable = [sock for sock in self.connectionLists if sock not in self.pausedSockets]
+		readSockets,writeSockets,errorSockets = select.select(readable,list(self.writeSockets),[])
+		for sock in writeSockets:
+			self.server.flushOutput(sock)
 		for sock in readSockets:
 				if sock == self.server.socket:  # Recibo una nueva conexion
-					client_sock, client_addr = self.server.acceptConnection()
-					#print "Conexión nueva desde (%s, %s) " % client_addr
-					self.connectionLists.append(client_sock)
-				else:  # Recibo datos desde un cliente
-					data = self.server.receiveData(sock)
+					accepted = self.server.acceptReadyConnection()
+					if accepted:
+						#print "Conexión nueva desde (%s, %s) " % accepted[1]
+						accepted[0].setblocking(0)   # Las escrituras pasan por el OutputBuffer (sendfile requiere un socket no bloqueante)
+						self.connectionLists.append(accepted[0])
+				elif sock in self.connectionLists and sock not in self.pausedSockets:  # Recibo datos desde un cliente
+					try:
+						data = self.server.receiveData(sock)
+					except socket.error as e:
+						if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):   # Aviso de lectura sin datos disponibles
+							continue
+						data = None
 					if data:
 						self.server.manageRequest(sock,data)
+					else:   # EOF o error: el cliente cerro la conexion
+						self.closeConnection(sock)
+						
+	# Actualiza los conjuntos de sockets a esperar segun los datos pendientes de envio
+	def updateConnection(self,sock,output):
+		if output.size:
+			self.writeSockets.add(sock)
+		else:
+			self.writeSockets.discard(sock)
+		if output.paused or output.closeWhenEmpty:
+			self.pausedSockets.add(sock)
+		else:
+			self.pausedSockets.discard(sock)
+			
+	def closeConnection(self,sock):
+		if sock in self.connectionLists:
+			self.connectionLists.remove(sock)
+		self.writeSockets.discard(sock)
+		self.pausedSockets.discard(sock)
+		self.server.discardOutput(sock)
+		sock.close()
+						
+	def countConnections(self):
+		return len(self.connectionLists) - 1
+
+
+# Handler multiusuario basado en epoll (solo Linux). A diferencia de MultipleTCPHandler, el costo de cada
+# espera no depende de la cantidad de conexiones abiertas, no tiene el limite de FD_SETSIZE (1024) de select
+# y los clientes que cierran la conexion (o fallan) se dan de baja del epoll y se cierran.
+# Trabaja en modo level-triggered: los metodos de recepcion de datos de los servidores no leen hasta EAGAIN,
+# por lo que un socket con datos pendientes vuelve a ser reportado en la siguiente espera.
+class EpollTCPHandler:
+	
+	READ_EVENTS = select.EPOLLIN | select.EPOLLPRI
+	ERROR_EVENTS = select.EPOLLERR | select.EPOLLHUP
+	CLIENT_EVENTS = READ_EVENTS   # Eventos con los que se registran los socks de los clientes
+	bufferedWrites = True
+	
+	def __init__(self,server):
+		self.server = server
+		self.connections = {}   # fileno => sock del cliente
+		self.registeredEvents = {}   # fileno => eventos registrados en el epoll
+		self.epoll = select.epoll()
+		self.epoll.register(self.server.socket.fileno(),self.READ_EVENTS)
+		
+	# El epoll no se debe compartir entre procesos. Cada worker crea el suyo.
+	# El socket del servidor queda no bloqueante por la misma razon que en MultipleTCPHandler.initializeWorker
+	def initializeWorker(self):
+		self.server.socket.setblocking(0)
+		self.epoll.close()
+		self.epoll = select.epoll()
+		self.epoll.register(self.server.socket.fileno(),self.READ_EVENTS)
+		
+	def countConnections(self):
+		return len(self.connections)
+		
+	# Los socks de los clientes quedan no bloqueantes: las escrituras pasan por el OutputBuffer, que envia los archivos con sendfile
+	def registerConnection(self,client_sock):
+		client_sock.setblocking(0)
+		self.connections[client_sock.fileno()] = client_sock
+		self.registeredEvents[client_sock.fileno()] = self.CLIENT_EVENTS
+		self.epoll.register(client_sock.fileno(),self.CLIENT_EVENTS)
+		
+	# Da de baja la conexion del epoll y cierra el sock del cliente
+	def unregisterConnection(self,fileno):
+		client_sock = self.connections.pop(fileno,None)
+		self.registeredEvents.pop(fileno,None)
+		try:
+			self.epoll.unregister(fileno)
+		except (IOError,ValueError):   # El fd ya no estaba registrado
+			pass
+		if client_sock:
+			self.server.discardOutput(client_sock)
+			client_sock.close()
+			
+	def closeConnection(self,client_sock):
+		self.unregisterConnection(client_sock.fileno())
+		
+	def isOpen(self,fileno):
+		return fileno in self.connections
+		
+	# Eventos a esperar de la conexion segun sus datos pendientes de envio: EPOLLOUT si hay datos pendientes, y sin eventos de
+	# lectura si la conexion esta pausada (ver watermarks en AbstractTCPServer) o se cierra luego de enviar lo pendiente
+	def connectionEvents(self,client_sock):
+		events = self.CLIENT_EVENTS
+		output = self.server.outputBuffers.get(client_sock)
+		if output:
+			if output.paused or output.closeWhenEmpty:
+				events &= ~self.READ_EVENTS
+			if output.size:
+				events |= select.EPOLLOUT
+		return events
+		
+	def updateConnection(self,client_sock,output):
+		fileno = client_sock.fileno()
+		events = self.connectionEvents(client_sock)
+		if fileno in self.connections and self.registeredEvents.get(fileno) != events:
+			self.registeredEvents[fileno] = events
+			self.epoll.modify(fileno,events)
+	
+	# Recibe datos desde el sock del cliente y los pasa al servidor. Retorna False si el cliente cerro la conexion (y ya fue dada de baja)
+	def processConnection(self,fileno):
+		sock = self.connections[fileno]
+		try:
+			data = self.server.receiveData(sock)
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK):   # Aviso de lectura sin datos disponibles
+				return True
+			data = None
+		if data:
+			self.server.manageRequest(sock,data)
+			return True
+		self.unregisterConnection(fileno)   # EOF o error: el cliente cerro la conexion
+		return False
+		
+	def handleClientEvent(self,fileno,event):
+		if event & select.EPOLLOUT and self.isOpen(fileno):   # Hay lugar para enviar datos pendientes
+			try:
+				self.server.flushOutput(self.connections[fileno])
+			except socket.error:
+				self.unregisterConnection(fileno)
+		if not self.isOpen(fileno):   # La conexion se cerro al enviar
+			return
+		if event & self.READ_EVENTS:  # Recibo datos desde un cliente
+			self.processConnection(fileno)
+		elif event & self.ERROR_EVENTS:
+			self.unregisterConnection(fileno)
+	
+	# Metodo que maneja las conexiones de los clientes (En este caso acepta multiples conexiones)
+	def handleRequests(self):
+		try:
+			events = self.epoll.poll()
+		except IOError as e:
+			if e.errno == errno.EINTR:  # La espera fue interrumpida por una señal
+				return
+			raise
+		for fileno,event in events:
+			if fileno == self.server.socket.fileno():  # Recibo una nueva conexion
+				accepted = self.server.acceptReadyConnection()
+				if accepted:
+					self.registerConnection(accepted[0])
+			else:
+				self.handleClientEvent(fileno,event)
+
+
+# Handler multiusuario que atiende los pedidos en un pool de threads de tamaño fijo, para que un manageRequest lento
+# no bloquee al resto de las conexiones. El thread principal solo acepta conexiones y espera eventos (epoll).
+#	- Orden por conexion: los socks se registran con EPOLLONESHOT, por lo que una conexion queda asignada a un unico
+#	  thread hasta que este termina de atenderla y la vuelve a habilitar. Las respuestas salen en el orden de los pedidos.
+#	- Contrapresion: la cola de conexiones listas tiene un limite (queueDepth). Si se llena, el thread principal se bloquea
+#	  y deja de aceptar conexiones hasta que los threads se liberen.
+#	- Cierres: solo el thread principal modifica connections y da de baja los fds del epoll. Los threads encolan las
+#	  conexiones a cerrar (closingConnections) y lo despiertan escribiendo en un pipe registrado en el epoll. Asi un fd no
+#	  se cierra (y el sistema no lo reutiliza para otro cliente) mientras el thread principal todavia lo tiene registrado.
+class ThreadPoolTCPHandler(EpollTCPHandler):
+	
+	CLIENT_EVENTS = EpollTCPHandler.READ_EVENTS | select.EPOLLONESHOT
+	
+	workersNumber = 8
+	queueDepth = 64
+	
+	def __init__(self,server):
+		EpollTCPHandler.__init__(self,server)
+		self.threads = []
+		self.readyConnections = Queue.Queue(self.queueDepth)
+		self.createWakeupPipe()
+		
+	# Pipe con el que los threads despiertan al thread principal para que cierre las conexiones encoladas
+	def createWakeupPipe(self):
+		self.closingConnections = Queue.Queue()
+		self.closingSockets = set()   # Socks encolados para cerrar: los threads ya no los atienden ni los vuelven a habilitar
+		self.wakeupRead, self.wakeupWrite = os.pipe()
+		for fd in (self.wakeupRead,self.wakeupWrite):
+			fcntl.fcntl(fd,fcntl.F_SETFL,fcntl.fcntl(fd,fcntl.F_GETFL) | os.O_NONBLOCK)
+		self.epoll.register(self.wakeupRead,self.READ_EVENTS)
+		
+	# Los threads no sobreviven a un fork. Se inician en la primera llamada a handleRequests
+	def startThreads(self):
+		for index in range(self.workersNumber):
+			thread = threading.Thread(target = self.workerLoop)
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+			
+	# Cada worker tiene su propio epoll y su propio pipe (el heredado lo comparten todos los procesos)
+	def initializeWorker(self):
+		EpollTCPHandler.initializeWorker(self)
+		os.close(self.wakeupRead)
+		os.close(self.wakeupWrite)
+		self.createWakeupPipe()
+		self.threads = []
+		self.readyConnections = Queue.Queue(self.queueDepth)
+		
+	def workerLoop(self):
+		while True:
+			fileno, event = self.readyConnections.get()
+			try:
+				EpollTCPHandler.handleClientEvent(self,fileno,event)
+				if self.isOpen(fileno):
+					events = self.connectionEvents(self.connections[fileno])
+					self.registeredEvents[fileno] = events
+					self.epoll.modify(fileno,events)   # Vuelvo a habilitar la conexion en el epoll
+			except Exception as e:
+				print "Error atendiendo conexion: " + str(e)
+				self.unregisterConnection(fileno)
+				
+	# Los threads no cierran la conexion: la encolan para el thread principal. La conexion queda deshabilitada en el
+	# epoll (EPOLLONESHOT), por lo que no se vuelve a reportar hasta que se cierra
+	def unregisterConnection(self,fileno):
+		client_sock = self.connections.get(fileno)
+		if client_sock and client_sock not in self.closingSockets:
+			self.closingSockets.add(client_sock)
+			self.closingConnections.put(client_sock)
+			try:
+				os.write(self.wakeupWrite,"x")
+			except OSError as e:
+				if e.errno != errno.EAGAIN:   # Pipe lleno: el thread principal ya tiene avisos pendientes
+					raise
+					
+	def isOpen(self,fileno):
+		client_sock = self.connections.get(fileno)
+		return client_sock is not None and client_sock not in self.closingSockets
+		
+	# Cierra (en el thread principal) las conexiones encoladas por los threads
+	def closePendingConnections(self):
+		try:
+			while os.read(self.wakeupRead,4096):
+				pass
+		except OSError as e:
+			if e.errno != errno.EAGAIN:
+				raise
+		while True:
+			try:
+				client_sock = self.closingConnections.get_nowait()
+			except Queue.Empty:
+				return
+			fileno = client_sock.fileno()
+			if self.connections.get(fileno) is client_sock:
+				EpollTCPHandler.unregisterConnection(self,fileno)
+			self.closingSockets.discard(client_sock)
+			
+	# Los socks quedan deshabilitados en el epoll (EPOLLONESHOT) mientras un thread los atiende: el thread los vuelve a
+	# habilitar al terminar (workerLoop), con los eventos que correspondan a sus datos pendientes de envio
+	def updateConnection(self,client_sock,output):
+		pass
+		
+	def handleClientEvent(self,fileno,event):
+		if fileno == self.wakeupRead:
+			self.closePendingConnections()
+		else:
+			self.readyConnections.put((fileno,event))   # Se bloquea si la cola esta llena
+		
+	def getQueueDepth(self):
+		return self.readyConnections.qsize()
+		
+	def handleRequests(self):
+		if not self.threads:
+			self.startThreads()
+		EpollTCPHandler.handleRequests(self)
+
+
+##############################   POOL DE WORKERS  - pre-fork / SO_REUSEPORT  ###################################
+
+# Ejecuta un servidor en N procesos worker para aprovechar todos los nucleos.
+#	Modo FORK: el proceso padre crea el servidor (y su socket) y los workers lo heredan luego del fork. Con los handlers multiusuario
+#	el socket compartido queda no bloqueante: cada conexion despierta a todos los workers y el que no la obtiene no se bloquea en accept.
+#	Modo REUSEPORT: cada worker crea su propio servidor con SO_REUSEPORT, y el kernel reparte las conexiones/datagramas entre ellos.
+# El proceso padre supervisa los workers: si uno finaliza, lo reinicia. Al recibir SIGTERM o SIGINT envia SIGTERM a los workers,
+# que terminan su bucle principal (stop), y si no finalizan en shutdownTimeout segundos se les envia SIGKILL.
+# Si no se puede crear el socket del servidor (ej: el puerto esta en uso) run lanza socket.error, sin reiniciar workers: en modo
+# FORK antes de crearlos, y en modo REUSEPORT cuando un worker finaliza por ese motivo (luego de detener al resto).
+#
+#	pool = ServerWorkerPool(EchoUDPServer,("0.0.0.0",7),workers = 8,pinCPU = True)
+#	pool.run()
+class ServerWorkerPool:
+	
+	FORK = "fork"
+	REUSEPORT = "reuseport"
+	SOCKET_ERROR_STATUS = 3   # Estado de salida de un worker que no pudo crear el socket del servidor
+	
+	restartDelay = 1.0
+	shutdownTimeout = 5.0
+	
+	def __init__(self,serverClass,serverArgs = (),workers = None,mode = "reuseport",pinCPU = False):
+		self.serverClass = serverClass
+		self.serverArgs = serverArgs
+		import multiprocessing   # Solo por cpu_count: se carga con el pool de workers
+		self.cpuCount = multiprocessing.cpu_count()
+		self.workers = workers if workers else self.cpuCount
+		self.mode = mode
+		self.pinCPU = pinCPU
+		self.server = None
+		self.workerPids = {}   # pid => indice del worker
+		self.running = False
+		
+	def run(self):
+		self.running = True
+		signal.signal(signal.SIGTERM,self.handleSignal)
+		signal.signal(signal.SIGINT,self.handleSignal)
+		if self.mode == ServerWorkerPool.FORK:
+			self.server = self.serverClass(*self.serverArgs)
+			if self.server.socketError is not None:
+				raise self.server.socketError
+		socketErrorWorker = None
+		for index in range(self.workers):
+			self.startWorker(index)
+		while self.running:   # Supervision de los workers
+			try:
+				pid, status = os.wait()
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				raise
+			index = self.workerPids.pop(pid,None)
+			if index is not None and os.WIFEXITED(status) and os.WEXITSTATUS(status) == ServerWorkerPool.SOCKET_ERROR_STATUS:
+				socketErrorWorker = index   # Reiniciarlo volveria a fallar
+				self.running = False
+			elif index is not None and self.running:
+				print "Worker " + str(index) + " (pid " + str(pid) + ") finalizo. Reiniciando..."
+				time.sleep(self.restartDelay)
+				if self.running:
+					self.startWorker(index)
+		self.stopWorkers()
+		if socketErrorWorker is not None:
+			raise socket.error("El worker " + str(socketErrorWorker) + " no pudo crear el socket del servidor")
+		
+	def handleSignal(self,signum,frame):
+		self.running = False
+		
+	def startWorker(self,index):
+		pid = os.fork()
+		if pid:
+			self.workerPids[pid] = index
+			return pid
+		# Proceso worker
+		status = 0
+		try:
+			signal.signal(signal.SIGINT,signal.SIG_IGN)   # Solo el padre atiende Ctrl+C
+			if self.pinCPU:
+				ServerWorkerPool.pinToCPU(index % self.cpuCount)
+			if self.mode == ServerWorkerPool.REUSEPORT:
+				self.serverClass.reusePort = True   # Solo afecta a la copia de la clase de este proceso
+				server = self.serverClass(*self.serverArgs)
+				if server.socketError is not None:   # El padre detiene el pool (ver run)
+					os._exit(ServerWorkerPool.SOCKET_ERROR_STATUS)
+			else:
+				server = self.server
+				server.initializeWorker()
+			signal.signal(signal.SIGTERM,lambda signum,frame: server.stop())
+			server.run()
+		except Exception as e:
+			print "Error en worker " + str(index) + ": " + str(e)
+			status = 1
+		finally:
+			os._exit(status)
+			
+	# Termina los workers con SIGTERM y, si no terminan en shutdownTimeout segundos, con SIGKILL. Un worker puede terminar
+	# (y ser recolectado) en cualquier momento: ESRCH y ECHILD indican que ya no existe
+	def stopWorkers(self):
+		for pid in self.workerPids:
+			try:
+				os.kill(pid,signal.SIGTERM)
+			except OSError as e:
+				if e.errno != errno.ESRCH:
+					raise
+		deadline = time.time() + self.shutdownTimeout
+		while self.workerPids:
+			for pid in list(self.workerPids):
+				try:
+					finished, status = os.waitpid(pid,os.WNOHANG)
+				except OSError as e:
+					if e.errno != errno.ECHILD:
+						raise
+					finished = pid
+				if finished:
+					del self.workerPids[pid]
+			if time.time() > deadline:
+				for pid in self.workerPids:
+					try:
+						os.kill(pid,signal.SIGKILL)
+						os.waitpid(pid,0)
+					except OSError as e:
+						if e.errno not in (errno.ESRCH,errno.ECHILD):
+							raise
+				self.workerPids = {}
+			time.sleep(0.05)
+			
+	# Fija el proceso actual a un nucleo (sched_setaffinity de libc; Python 2 no la expone)
+	@staticmethod
+	def pinToCPU(cpu):
+		import ctypes
+		import ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno = True)
+		bitsPerWord = ctypes.sizeof(ctypes.c_ulong) * 8
+		mask = (ctypes.c_ulong * (1024 / bitsPerWord))()   # cpu_set_t (1024 CPUs)
+		mask[cpu / bitsPerWord] = 1 << (cpu % bitsPerWord)
+		if libc.sched_setaffinity(0,ctypes.sizeof(mask),ctypes.byref(mask)) != 0:
+			raise OSError(ctypes.get_errno(),"No se pudo fijar el CPU " + str(cpu))
 
 
 ###########              TERMINA SECCION SERVIDORES ABSTRACTOS			      ##########################
@@ -232,14 +1199,148 @@ class EchoTCPServer(AbstractTCPServer):
 	
 	def manageRequest(self,clientSock,data):
 		self.sendResponse(clientSock,data)
-		print "Respondiendo a " + client_sock.getpeername()
+		print "Respondiendo a", clientSock.getpeername()
     
 		
 		
+# Echo de datos binarios: responde cada lectura tal cual la recibio, sin copiarla a un string
+class BulkEchoTCPServer(AbstractTCPServer):
+	
+	zeroCopy = True
+	
+	def manageRequest(self,clientSock,data):
+		self.sendResponse(clientSock,data)
+		
+		
+# Echo sobre el canal cifrado: responde cada mensaje descifrado, cifrado con las claves de la conexion
+class SecureEchoTCPServer(AbstractSecureTCPServer):
+	
+	def manageMessage(self,clientSock,message):
+		self.sendMessage(clientSock,message)
+		
+		
+class RSAEchoTCPServer(AbstractRSATCPServer):
+	
+	def manageMessage(self,clientSock,message):
+		self.sendMessage(clientSock,message)
+		
+		
 class EchoUDPServer(AbstractUDPServer):
 	
+	zeroCopy = True
+	
 	def manageRequest(self,clientSock,data):
 		self.sendResponse(clientSock,data)
 		
+		
+# Echo para ReliableUDPClient: los datagramas llegan con RequestIdEnvelope
+class ReliableEchoUDPServer(EchoUDPServer):
+	
+	requestIds = True
 
 
+### DAYTIME SERVERS ##################################
+
+# Logica comun de los servidores DayTime: carga de zonas horarias y construccion de respuestas (texto o binario, ver DayTimeProtocol).
+# Las zonas se leen del indice compilado del archivo de zonas (ver CompiledZoneDatabase), compartido entre todos los workers.
+# Las respuestas se guardan en un ResponseCache: los queries iguales dentro del mismo segundo reciben la PDU ya construida.
+# Con warmUpZones se resuelven todas las zonas al iniciar (antes del fork de los workers), para que el primer pedido de cada
+# zona no pague la carga de pytz. Por defecto se resuelven en el primer pedido de cada una.
+class DayTimeService:
+	
+	cacheEntries = 4096
+	warmUpZones = False
+	
+	def __init__(self,zonesFileName,defaultZone = "UTC"):
+		self.timeZones = CompiledZoneDatabase.open(zonesFileName,self.warmUpZones)
+		self.defaultZone = defaultZone
+		self.responseCache = ResponseCache(self.cacheEntries)
+		
+	# Retorna la PDU de respuesta, o None si el query es invalido
+	def answer(self,pdu):
+		try:
+			return DayTimeProtocol.answerRequest(pdu,self.timeZones,self.defaultZone,self.responseCache)
+		except (ValueError,IndexError,struct.error):
+			return None
+			
+	def describe(self,pdu):
+		if isinstance(pdu,memoryview):
+			pdu = pdu.tobytes()
+		return DayTimeProtocol.describeRequest(pdu)
+			
+			
+class DayTimeTCPServer(AbstractTCPServer):
+	
+	def __init__(self,host,port,zonesFileName,defaultZone = "UTC",handler = "single"):
+		self.service = DayTimeService(zonesFileName,defaultZone)
+		AbstractTCPServer.__init__(self,host,port,handler)
+		
+	def describeRequest(self,data):
+		return self.service.describe(data)
+		
+	def manageRequest(self,clientSock,data):
+		response = self.service.answer(data)
+		if response:
+			self.sendResponse(clientSock,response)
+			
+			
+class DayTimeUDPServer(AbstractUDPServer):
+	
+	def __init__(self,host,port,zonesFileName,defaultZone = "UTC"):
+		self.service = DayTimeService(zonesFileName,defaultZone)
+		AbstractUDPServer.__init__(self,host,port)
+		
+	def describeRequest(self,data):
+		return self.service.describe(data)
+		
+	def manageRequest(self,address,data):
+		response = self.service.answer(data)
+		if response:
+			self.sendResponse(address,response)
+			
+			
+# DayTime para ReliableDayTimeUDPClient: los datagramas llegan con RequestIdEnvelope
+class ReliableDayTimeUDPServer(DayTimeUDPServer):
+	
+	requestIds = True
+
+
+### METRICAS ##################################
+
+# Exportador de metricas para Prometheus: atiende GET /metrics con el formato de texto de Prometheus (ver ahmmetrics).
+# Se ejecuta en un thread propio, con su propio epoll, por lo que no interfiere con el bucle del servidor medido.
+#
+#	metrics = server.enableMetrics()
+#	PrometheusExporter(metrics,"0.0.0.0",9100,labels = {"server":"daytime"}).start()
+class PrometheusExporter(AbstractHTTPServer):
+	
+	CONTENT_TYPE = "text/plain; version=0.0.4"
+	
+	def __init__(self,metrics,host = "0.0.0.0",port = 9100,prefix = "ahm",labels = None):
+		self.metrics = None   # El exportador no se mide a si mismo
+		self.exportedMetrics = metrics
+		self.prefix = prefix
+		self.labels = labels
+		self.resources = {}   # sock del cliente => recurso del request en curso
+		self.thread = None
+		AbstractHTTPServer.__init__(self,host,port,AbstractTCPServer.EPOLL)
+		
+	def acceptConnection(self):
+		return self.socket.accept()
+		
+	def start(self):
+		self.thread = threading.Thread(target = self.run)
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def handleRequestStart(self,clientSock,requestLine,headers):
+		self.resources[clientSock] = requestLine[1]
+		
+	def handleRequestEnd(self,clientSock,keepAlive):
+		connection = {"Connection":"keep-alive" if keepAlive else "close"}
+		if self.resources.pop(clientSock,None) == "/metrics":
+			connection["Content-Type"] = self.CONTENT_TYPE
+			response = HTTPProtocol.createResponse("HTTP/1.1",200,"OK",connection,formatPrometheus(self.exportedMetrics,self.prefix,self.labels))
+		else:
+			response = HTTPProtocol.createResponse("HTTP/1.1",404,"Not Found",connection)
+		self.sendResponse(clientSock,response)
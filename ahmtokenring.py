@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  ahmtokenring.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import select
+import signal
+import random
+import argparse
+import platform
+import datetime
+import itertools
+import collections
+import multiprocessing
+from ahmprotocols import MRTokenRingProtocol,LengthPrefixFrameDecoder
+from ahmmetrics import Histogram
+
+
+####################################################################################################
+####################################################################################################
+###########          NODO DE UN ANILLO CON EL PROTOCOLO MARRONE RICCI TOKEN RING          ######
+####################################################################################################
+####################################################################################################
+
+# Cada nodo tiene una conexion TCP persistente con su sucesor y recibe la de su predecesor. Por las conexiones solo circula el
+# token (una trama con prefijo de longitud por cada pase), que lleva en un lote todas las PDUs de la vuelta (ver createTokenPDU):
+# al recibirlo, el nodo entrega los mensajes dirigidos a el, procesa sus acks, reenvia el resto del lote y agrega los acks de
+# lo recibido y todos los mensajes de su cola de salida que entren en el presupuesto del pase (holdMessages / holdBytes).
+# Cada pase es un unico send, sin importar la cantidad de mensajes.
+#
+#	node = TokenRingNode("01","0.0.0.0",5001)
+#	node.setRing([("01","10.0.0.1",5001),("02","10.0.0.2",5001),("03","10.0.0.3",5001)])
+#	node.send("03","hola")
+#	node.run(initialToken = True)    # El nodo que crea el token. El resto usa initialToken = False
+#
+# El token circula aunque no haya mensajes, por lo que un anillo ocioso usa CPU. Para terminar, stop() hace que el nodo
+# envie la PDU de finalizacion (code 00) en lugar del token: cada nodo la reenvia y termina.
+#
+# Fallas (requiere la lista de nodos del anillo, setRing):
+#	- Empalme: el sucesor nunca envia datos, por lo que si su conexion se vuelve legible el sucesor cerro (o murio el proceso).
+#	  El nodo se conecta con el siguiente nodo vivo de la lista y, como el token pudo perderse con el nodo caido, inicia una
+#	  eleccion. Si falla un envio al sucesor se empalma y se reenvia la trama (el token no se perdio).
+#	- Perdida del token: si no llega el token durante tokenTimeout (o timeoutFactor veces el tiempo de rotacion, si es mayor)
+#	  el nodo inicia una eleccion.
+#	- Eleccion: el nodo envia una PDU code 04 con la generacion siguiente. Cada nodo reenvia la postulacion si es la mejor que
+#	  vio (mayor generacion, y a igual generacion mayor id de nodo) y descarta las demas. Si la postulacion de un nodo vuelve a
+#	  el, todos los nodos vivos la vieron: crea el token de la nueva generacion. Los nodos descartan los tokens de generaciones
+#	  anteriores a la ultima postulacion que vieron, por lo que nunca circulan dos tokens.
+#	- Al tomar un token de una nueva generacion, cada nodo reencola sus mensajes sin ack (los del token perdido). El destino
+#	  descarta los repetidos (id menor o igual al ultimo entregado de ese origen), pero los vuelve a confirmar.
+#
+# Los ids de nodo son de 2 digitos (01 a 99; 00 es el origen de las PDUs de control).
+
+MAX_NODES = 99
+
+CODE_FINALIZE = "00"
+CODE_TOKEN = "01"
+CODE_MESSAGE = "02"
+CODE_ACK = "03"
+CODE_CLAIM = "04"
+
+SOURCE = slice(*MRTokenRingProtocol.BYTES_NODE_SOURCE[:2])
+DEST = slice(*MRTokenRingProtocol.BYTES_NODE_DEST[:2])
+CODE = slice(*MRTokenRingProtocol.BYTES_CODE[:2])
+MESSAGE = MRTokenRingProtocol.BYTES_MESSAGE[0]
+
+
+class TokenRingNode():
+
+	bufferSize = 65536
+	connectTimeout = 30.0   # Segundos que se reintenta la conexion inicial con el sucesor (puede no haber iniciado todavia)
+	spliceTimeout = 1.0     # Segundos de espera de cada conexion al empalmar
+	tokenTimeout = 1.0      # Minimo de segundos sin token (ni elecciones) para considerarlo perdido
+	timeoutFactor = 4       # ... o esta cantidad de veces el tiempo de rotacion estimado, si es mayor
+
+	def __init__(self,nodeId,host,port,holdMessages = 256,holdBytes = 256 * 1024):
+		nodeId = str(nodeId).zfill(MRTokenRingProtocol.BYTES_NODE_SOURCE[2])
+		if not nodeId.isdigit() or not 0 < int(nodeId) <= MAX_NODES:
+			raise ValueError("Id de nodo invalido: " + nodeId)
+		self.nodeId = nodeId
+		self.holdMessages = holdMessages   # Presupuesto de cada pase: mensajes propios que se agregan al token
+		self.holdBytes = holdBytes
+		self.listenSock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.listenSock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+		self.listenSock.bind((host,port))
+		self.listenSock.listen(5)
+		self.address = self.listenSock.getsockname()
+		self.ring = []               # (id,host,puerto) de los nodos, en el orden del anillo
+		self.successorIndex = None   # Posicion del sucesor en ring
+		self.successor = None
+		self.predecessor = None
+		self.decoder = None
+		self.outbound = collections.deque()      # (id,destino,mensaje) pendientes de enviar
+		self.unacked = {}                        # destino => deque de (id,hora de envio,mensaje) sin ack
+		self.unackedCount = 0
+		self.lastDelivered = {}                  # origen => id del ultimo mensaje entregado
+		self.messageIds = itertools.count(1)
+		self.generation = 0                      # Generacion del token vigente
+		self.bestClaim = (0,"")                  # Mejor postulacion vista (generacion,id de nodo)
+		self.stopRequested = False
+		self.finalizing = False                  # Se envio la finalizacion y se espera que vuelva
+		self.running = False
+		self.lastToken = None
+		self.lastActivity = None                 # Ultimo token o postulacion recibida (deteccion de perdida del token)
+		self.rotationEstimate = 0.0
+		self.inbox = collections.deque()
+		self.resetStats()
+
+	def resetStats(self):
+		self.holds = 0
+		self.sent = 0
+		self.delivered = 0
+		self.duplicates = 0
+		self.acknowledged = 0
+		self.undeliverable = 0
+		self.tokenBytes = 0
+		self.elections = 0
+		self.regenerations = 0
+		self.splices = 0
+		self.discardedTokens = 0
+		self.rotationTimes = Histogram()   # Microsegundos entre dos llegadas del token (tiempo de rotacion)
+		self.ackTimes = Histogram()        # Microsegundos entre que el mensaje sale con el token y llega su ack
+		self.recoveryTimes = Histogram()   # Microsegundos sin token al cambiar de generacion (ultimo token viejo - primero nuevo)
+
+	# members: lista de (id,host,puerto) de todos los nodos (incluido este) en el orden del anillo
+	def setRing(self,members):
+		self.ring = [(str(nodeId).zfill(MRTokenRingProtocol.BYTES_NODE_SOURCE[2]),host,port) for nodeId,host,port in members]
+		ownIndex = [member[0] for member in self.ring].index(self.nodeId)
+		self.successorIndex = (ownIndex + 1) % len(self.ring)
+
+	# Encola un mensaje para el nodo dest. Se envia en el proximo pase del token. Retorna el id del mensaje
+	def send(self,dest,message):
+		messageId = next(self.messageIds)
+		self.outbound.append((messageId,str(dest).zfill(MRTokenRingProtocol.BYTES_NODE_DEST[2]),message))
+		return messageId
+
+	def stop(self):
+		self.stopRequested = True
+
+	# Conecta con el sucesor (por defecto el siguiente de ring) y atiende el token hasta recibir la finalizacion
+	def run(self,successorHost = None,successorPort = None,initialToken = False):
+		if successorHost is None:
+			successorHost, successorPort = self.ring[self.successorIndex][1:]
+		self.successor = self.connectSuccessor(successorHost,successorPort,self.connectTimeout)
+		self.running = True
+		self.lastActivity = time.time()
+		if initialToken:
+			self.lastToken = self.lastActivity
+			self.passFrame(MRTokenRingProtocol.createTokenPDU(self.nodeId,[],self.generation))
+		try:
+			while self.running:
+				sockets = [self.listenSock]
+				if not self.finalizing:   # Al finalizar los nodos siguientes ya cerraron sus conexiones
+					sockets.append(self.successor)
+				if self.predecessor is not None:
+					sockets.append(self.predecessor)
+				timeout = self.lastActivity + self.getTokenTimeout() - time.time()
+				readable = select.select(sockets,[],[],max(timeout,0))[0]
+				if self.listenSock in readable:
+					self.acceptPredecessor()
+				if self.predecessor is not None and self.predecessor in readable:
+					self.receiveFrames()
+				if self.running and self.successor in readable:
+					self.successorFailed()
+				if self.running and time.time() - self.lastActivity >= self.getTokenTimeout():
+					if self.finalizing:   # La finalizacion se perdio (fallo un nodo): los demas ya terminaron o detectaran la falla
+						break
+					self.startElection()
+		finally:
+			self.running = False
+			self.close()
+
+	def connectSuccessor(self,host,port,retryTime):
+		deadline = time.time() + retryTime
+		while True:
+			sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+			sock.settimeout(self.spliceTimeout)
+			try:
+				sock.connect((host,port))
+				break
+			except socket.error as e:
+				sock.close()
+				if e.errno != errno.ECONNREFUSED or time.time() >= deadline:
+					raise
+				time.sleep(0.1)
+		sock.settimeout(None)
+		sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		return sock
+
+	# Nueva conexion del predecesor (al iniciar o porque el anterior fallo y su predecesor empalmo el anillo)
+	def acceptPredecessor(self):
+		sock, address = self.listenSock.accept()
+		sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+		if self.predecessor is not None:
+			self.predecessor.close()
+		self.predecessor = sock
+		self.decoder = LengthPrefixFrameDecoder()
+
+	def receiveFrames(self):
+		try:
+			data = self.predecessor.recv(self.bufferSize)
+		except socket.error:
+			data = ""
+		if not data:   # Se cayo el predecesor: su predecesor se conectara con este nodo
+			self.predecessor.close()
+			self.predecessor = None
+			return
+		for frame in self.decoder.feed(data):
+			code = frame[CODE]
+			if code == CODE_TOKEN:
+				self.holdToken(frame)
+			elif code == CODE_CLAIM:
+				self.handleClaim(frame)
+			elif code == CODE_FINALIZE:
+				self.finalize(frame)
+			if not self.running:
+				break
+
+	def getTokenTimeout(self):
+		return max(self.tokenTimeout,self.timeoutFactor * self.rotationEstimate)
+
+	# Pase del token: procesa el lote recibido y envia al sucesor el nuevo lote en un unico send
+	def holdToken(self,token):
+		now = time.time()
+		generation = int(token[DEST])
+		if self.bestClaim[0] > self.generation:   # Hubo una eleccion: solo vale el token de la generacion postulada
+			if generation != self.bestClaim[0] % 100:
+				self.discardedTokens += 1
+				return
+			self.adoptGeneration(self.bestClaim[0],now)
+		elif generation != self.generation % 100:
+			self.discardedTokens += 1
+			return
+		if self.lastToken is not None:
+			rotation = now - self.lastToken
+			self.rotationTimes.record(rotation * 1000000)
+			self.rotationEstimate += (rotation - self.rotationEstimate) / 8.0
+		self.lastToken = self.lastActivity = now
+		self.holds += 1
+		nodeId = self.nodeId
+		outgoing = []
+		acks = {}   # origen => id del ultimo mensaje recibido
+		for messageId,pdu in MRTokenRingProtocol.parseTokenEntries(token):
+			if pdu[DEST] == nodeId:
+				source = pdu[SOURCE]
+				if pdu[CODE] == CODE_MESSAGE:
+					if messageId > self.lastDelivered.get(source,0):
+						self.lastDelivered[source] = messageId
+						self.delivered += 1
+						self.deliverMessage(source,messageId,pdu[MESSAGE:])
+					else:
+						self.duplicates += 1
+					acks[source] = self.lastDelivered[source]
+				else:
+					self.processAck(source,MRTokenRingProtocol.parseAckId(pdu),now)
+			elif pdu[SOURCE] == nodeId:   # Dio la vuelta completa: el destino no esta en el anillo
+				if pdu[CODE] == CODE_MESSAGE:
+					self.processUndeliverable(pdu[DEST],messageId)
+			else:
+				outgoing.append((messageId,pdu))
+		for source,messageId in acks.iteritems():
+			outgoing.append((0,MRTokenRingProtocol.createAckPDU(nodeId,source,messageId)))
+		if self.stopRequested:   # Se sigue atendiendo hasta que vuelva la finalizacion (ver finalize)
+			self.finalizing = True
+			self.passFrame(MRTokenRingProtocol.createPDU(nodeId,"00",CODE_FINALIZE))
+			return
+		self.prepareHold(now)
+		self.takeOutbound(outgoing,now)
+		self.passFrame(MRTokenRingProtocol.createTokenPDU(nodeId,outgoing,self.generation))
+
+	# Agrega al lote los mensajes de la cola de salida que entran en el presupuesto del pase (al menos uno)
+	def takeOutbound(self,outgoing,now):
+		outbound = self.outbound
+		createPDU = MRTokenRingProtocol.createPDU
+		nodeId = self.nodeId
+		count = size = 0
+		while outbound and count < self.holdMessages and size < self.holdBytes:
+			messageId, dest, message = outbound.popleft()
+			outgoing.append((messageId,createPDU(nodeId,dest,CODE_MESSAGE,message)))
+			pending = self.unacked.get(dest)
+			if pending is None:
+				pending = self.unacked[dest] = collections.deque()
+			pending.append((messageId,now,message))
+			count += 1
+			size += len(message)
+		self.sent += count
+		self.unackedCount += count
+
+	# Ack acumulativo del nodo source: confirma todos sus mensajes pendientes con id hasta messageId
+	def processAck(self,source,messageId,now):
+		pending = self.unacked.get(source)
+		while pending and pending[0][0] <= messageId:
+			ackedId, sentTime, message = pending.popleft()
+			self.unackedCount -= 1
+			self.acknowledged += 1
+			self.ackTimes.record((now - sentTime) * 1000000)
+			self.messageAcknowledged(source,ackedId)
+
+	# Volvio un mensaje sin entregar. Los anteriores al mismo destino tambien volvieron o tuvieron ack (llegan en orden)
+	def processUndeliverable(self,dest,messageId):
+		pending = self.unacked.get(dest)
+		while pending and pending[0][0] <= messageId:
+			undeliveredId = pending.popleft()[0]
+			self.unackedCount -= 1
+			self.undeliverable += 1
+			self.messageUndeliverable(dest,undeliveredId)
+
+	# Token de una nueva generacion: los mensajes sin ack pudieron perderse con el token anterior y se reenvian primero
+	def adoptGeneration(self,generation,now):
+		if self.lastToken is not None:
+			self.recoveryTimes.record((now - self.lastToken) * 1000000)
+			self.lastToken = None   # La espera no es una rotacion
+		self.generation = generation
+		pending = sorted((messageId,dest,message) for dest,entries in self.unacked.iteritems() for messageId,sentTime,message in entries)
+		self.outbound.extendleft(reversed(pending))
+		self.unacked = {}
+		self.unackedCount = 0
+
+	def startElection(self):
+		self.elections += 1
+		generation = max(self.generation,self.bestClaim[0]) + 1
+		self.bestClaim = (generation,self.nodeId)
+		self.lastActivity = time.time()
+		self.passFrame(MRTokenRingProtocol.createClaimPDU(self.nodeId,generation))
+
+	def handleClaim(self,pdu):
+		claim = (MRTokenRingProtocol.parseClaimGeneration(pdu),pdu[SOURCE])
+		if claim < self.bestClaim:
+			return   # Hay una postulacion mejor: esta se descarta
+		self.lastActivity = time.time()
+		if claim[1] == self.nodeId:   # Dio la vuelta: la vieron todos los nodos vivos
+			self.regenerations += 1
+			self.holdToken(MRTokenRingProtocol.createTokenPDU(self.nodeId,[],claim[0]))
+			return
+		self.bestClaim = claim
+		self.passFrame(pdu)
+
+	def passFrame(self,frame):
+		self.tokenBytes += len(frame)
+		data = LengthPrefixFrameDecoder.HEADER.pack(len(frame)) + frame
+		while self.successor is not None:
+			try:
+				self.successor.sendall(data)
+				return
+			except socket.error:
+				self.spliceSuccessor()
+
+	# La conexion con el sucesor se volvio legible: el sucesor cerro. El token pudo perderse con el
+	def successorFailed(self):
+		if self.spliceSuccessor():
+			self.startElection()
+
+	# Conecta con el siguiente nodo vivo luego del sucesor. Si no queda ninguno, el nodo termina. Retorna si pudo empalmar
+	def spliceSuccessor(self):
+		self.successor.close()
+		self.successor = None
+		self.splices += 1
+		if self.ring:
+			index = (self.successorIndex + 1) % len(self.ring)
+			while self.ring[index][0] != self.nodeId:
+				try:
+					self.successor = self.connectSuccessor(self.ring[index][1],self.ring[index][2],0)
+					self.successorIndex = index
+					return True
+				except socket.error:
+					index = (index + 1) % len(self.ring)
+		self.running = False
+		return False
+
+	# Si la finalizacion la origino este nodo ya dio la vuelta. Sino se reenvia
+	def finalize(self,pdu):
+		if pdu[SOURCE] != self.nodeId:
+			self.passFrame(pdu)
+		self.running = False
+
+	def close(self):
+		for sock in (self.successor,self.predecessor,self.listenSock):
+			if sock is not None:
+				sock.close()
+
+	# Mensaje recibido. Por defecto se guarda en inbox (source,id,mensaje). Las sub-clases lo pueden redefinir
+	def deliverMessage(self,source,messageId,message):
+		self.inbox.append((source,messageId,message))
+
+	# Llego el ack de un mensaje enviado por este nodo
+	def messageAcknowledged(self,dest,messageId):
+		pass
+
+	# Un mensaje enviado por este nodo volvio sin entregar (el destino no esta en el anillo)
+	def messageUndeliverable(self,dest,messageId):
+		pass
+
+	# Se invoca en cada pase del token, antes de tomar los mensajes de la cola de salida
+	def prepareHold(self,now):
+		pass
+
+	def getStats(self):
+		return {
+			"nodeId":self.nodeId,
+			"holds":self.holds,
+			"sent":self.sent,
+			"delivered":self.delivered,
+			"duplicates":self.duplicates,
+			"acknowledged":self.acknowledged,
+			"undeliverable":self.undeliverable,
+			"tokenBytes":self.tokenBytes,
+			"unacked":self.unackedCount,
+			"elections":self.elections,
+			"regenerations":self.regenerations,
+			"splices":self.splices,
+			"discardedTokens":self.discardedTokens,
+			"rotationTimes":self.rotationTimes,
+			"ackTimes":self.ackTimes,
+			"recoveryTimes":self.recoveryTimes,
+		}
+
+
+####################################################################################################
+###########          BANCO DE PRUEBAS: ANILLO DE N NODOS LOCALES                           ######
+####################################################################################################
+
+# Levanta anillos de N nodos en localhost (un proceso por nodo) y reporta mensajes entregados por segundo y el tiempo de
+# rotacion del token. Cada nodo mantiene window mensajes sin ack hacia destinos al azar (carga de lazo cerrado).
+# Con --kill se matan (SIGKILL) nodos al azar a mitad de la medicion, y se reporta el tiempo sin token de los sobrevivientes
+# (recuperacion) y el throughput antes y despues de la falla.
+#
+#	python ahmtokenring.py --nodes 2,8,32,64 --duration 5 --window 16 --payload-size 64 --output anillo.json
+#	python ahmtokenring.py --nodes 16 --kill 2
+
+
+# Nodo que genera carga
+class LoadTokenRingNode(TokenRingNode):
+
+	def __init__(self,nodeId,host,nodeIds,options,measureTime,endTime,killTime):
+		TokenRingNode.__init__(self,nodeId,host,0,options.holdMessages,options.holdBytes)
+		self.destinations = [destId for destId in nodeIds if destId != self.nodeId]
+		self.window = options.window
+		self.payload = "m" * options.payloadSize
+		self.measureTime = measureTime
+		self.endTime = endTime
+		self.killTime = killTime
+		self.measuring = False
+		self.deliveredAfterKill = 0
+
+	def resetStats(self):
+		TokenRingNode.resetStats(self)
+		self.deliveredAfterKill = 0
+
+	def deliverMessage(self,source,messageId,message):
+		if self.killTime is not None and self.lastToken >= self.killTime:   # lastToken: hora del pase en curso
+			self.deliveredAfterKill += 1
+
+	# El destino ya no esta en el anillo: no se le envian mas mensajes
+	def messageUndeliverable(self,dest,messageId):
+		if dest in self.destinations:
+			self.destinations.remove(dest)
+
+	def prepareHold(self,now):
+		if not self.measuring and now >= self.measureTime:
+			self.measuring = True
+			self.resetStats()
+		if now >= self.endTime:
+			self.stop()   # El primer nodo que recibe el token luego de endTime envia la finalizacion
+		if not self.destinations:
+			return
+		choice = random.choice
+		for index in xrange(self.window - self.unackedCount - len(self.outbound)):
+			self.send(choice(self.destinations),self.payload)
+
+	def getStats(self):
+		stats = TokenRingNode.getStats(self)
+		stats["deliveredAfterKill"] = self.deliveredAfterKill
+		return stats
+
+
+# Proceso de un nodo. Envia por results sus estadisticas
+def runNode(node,nodes,initialToken,results):
+	for other in nodes:   # Los sockets de escucha de los demas nodos se heredaron: si quedan abiertos, un nodo muerto acepta conexiones
+		if other is not node:
+			other.listenSock.close()
+	try:
+		node.run(initialToken = initialToken)
+	finally:
+		results.put(node.getStats())
+
+def toMilliseconds(value):
+	return round(value / 1000.0,3)
+
+def summarize(histogram):
+	return {
+		"mean":toMilliseconds(histogram.mean()),
+		"p50":toMilliseconds(histogram.percentile(0.5)),
+		"p99":toMilliseconds(histogram.percentile(0.99)),
+		"max":toMilliseconds(histogram.maxValue),
+	}
+
+# Ejecuta un anillo de nodeCount nodos. Retorna el diccionario de resultados
+def runRing(nodeCount,options):
+	nodeIds = [str(index + 1).zfill(2) for index in range(nodeCount)]
+	measureTime = time.time() + 0.5 + options.warmup   # 0.5s para que todos los procesos arranquen
+	endTime = measureTime + options.duration
+	killTime = measureTime + (options.killAt if options.killAt is not None else options.duration / 2.0) if options.kill else None
+	# Los sockets de escucha se crean antes de los procesos, por lo que cada nodo ya conoce la direccion de su sucesor
+	nodes = [LoadTokenRingNode(nodeId,options.host,nodeIds,options,measureTime,endTime,killTime) for nodeId in nodeIds]
+	ring = [(node.nodeId,node.address[0],node.address[1]) for node in nodes]
+	for node in nodes:
+		node.setRing(ring)
+		node.tokenTimeout = options.tokenTimeout
+	results = multiprocessing.Queue()
+	processes = []
+	for index,node in enumerate(nodes):
+		process = multiprocessing.Process(target = runNode,args = (node,nodes,index == 0,results))
+		process.daemon = True
+		process.start()
+		processes.append(process)
+	for node in nodes:
+		node.listenSock.close()
+	killed = sorted(random.sample(range(nodeCount),options.kill))
+	try:
+		if killed:
+			time.sleep(max(killTime - time.time(),0))
+			for index in killed:
+				os.kill(processes[index].pid,signal.SIGKILL)
+		stats = [results.get(timeout = endTime - time.time() + 30) for index in range(nodeCount - len(killed))]
+	finally:
+		for process in processes:
+			process.terminate()
+			process.join()
+	rotationTimes = Histogram()
+	ackTimes = Histogram()
+	recoveryTimes = Histogram()
+	for nodeStats in stats:
+		rotationTimes.merge(nodeStats["rotationTimes"])
+		ackTimes.merge(nodeStats["ackTimes"])
+		recoveryTimes.merge(nodeStats["recoveryTimes"])
+	delivered = sum(nodeStats["delivered"] for nodeStats in stats)
+	holds = sum(nodeStats["holds"] for nodeStats in stats)
+	result = {
+		"nodes":nodeCount,
+		"window":options.window,
+		"payloadSize":options.payloadSize,
+		"holdMessages":options.holdMessages,
+		"holdBytes":options.holdBytes,
+		"duration":options.duration,
+		"delivered":delivered,
+		"duplicates":sum(nodeStats["duplicates"] for nodeStats in stats),
+		"undeliverable":sum(nodeStats["undeliverable"] for nodeStats in stats),
+		"messagesPerSecond":round(delivered / float(options.duration),1),
+		"rotationsPerSecond":round(holds / float(len(stats)) / options.duration,1),
+		"meanTokenBytes":round(sum(nodeStats["tokenBytes"] for nodeStats in stats) / float(holds),1) if holds else None,
+		"rotationLatency":summarize(rotationTimes),
+		"ackLatency":summarize(ackTimes),
+	}
+	if killed:
+		deliveredAfterKill = sum(nodeStats["deliveredAfterKill"] for nodeStats in stats)
+		result["failure"] = {
+			"killed":[nodeIds[index] for index in killed],
+			"elections":sum(nodeStats["elections"] for nodeStats in stats),
+			"regenerations":sum(nodeStats["regenerations"] for nodeStats in stats),
+			"splices":sum(nodeStats["splices"] for nodeStats in stats),
+			"discardedTokens":sum(nodeStats["discardedTokens"] for nodeStats in stats),
+			"recovery":summarize(recoveryTimes),   # Tiempo sin token de cada sobreviviente
+			"messagesPerSecondBefore":round((delivered - deliveredAfterKill) / (killTime - measureTime),1),
+			"messagesPerSecondAfter":round(deliveredAfterKill / (endTime - killTime),1),
+		}
+	return result
+
+def printResult(result):
+	latency = result["rotationLatency"]
+	print "nodos=%-3d %10.1f msg/s %8.1f rotaciones/s  rotacion p50=%.3fms p99=%.3fms  token=%.0fB" % (result["nodes"],
+		result["messagesPerSecond"],result["rotationsPerSecond"],latency["p50"],latency["p99"],result["meanTokenBytes"] or 0)
+	failure = result.get("failure")
+	if failure:
+		print "    caidos=%s recuperacion max=%.3fms  %.1f msg/s antes, %.1f msg/s despues  (elecciones=%d empalmes=%d)" % (",".join(failure["killed"]),
+			failure["recovery"]["max"],failure["messagesPerSecondBefore"],failure["messagesPerSecondAfter"],failure["elections"],failure["splices"])
+
+def parseArguments(arguments):
+	parser = argparse.ArgumentParser(description = "Banco de pruebas de anillos Token Ring locales")
+	parser.add_argument("--nodes",default = "2,4,8,16,32,64",help = "Tamaños de anillo separados por coma (hasta " + str(MAX_NODES) + ")")
+	parser.add_argument("--host",default = "127.0.0.1")
+	parser.add_argument("--duration",type = float,default = 3.0,help = "Segundos medidos por anillo")
+	parser.add_argument("--warmup",type = float,default = 1.0,help = "Segundos de calentamiento (no medidos)")
+	parser.add_argument("--window",type = int,default = 16,help = "Mensajes sin ack que mantiene cada nodo")
+	parser.add_argument("--payload-size",dest = "payloadSize",type = int,default = 64,help = "Bytes de cada mensaje")
+	parser.add_argument("--hold-messages",dest = "holdMessages",type = int,default = 256,help = "Mensajes propios por pase del token")
+	parser.add_argument("--hold-bytes",dest = "holdBytes",type = int,default = 256 * 1024,help = "Bytes de mensajes propios por pase del token")
+	parser.add_argument("--token-timeout",dest = "tokenTimeout",type = float,default = TokenRingNode.tokenTimeout,help = "Segundos minimos sin token para considerarlo perdido")
+	parser.add_argument("--kill",type = int,default = 0,help = "Nodos que se matan durante la medicion")
+	parser.add_argument("--kill-at",dest = "killAt",type = float,default = None,help = "Segundos de medicion antes de matar los nodos (por defecto la mitad)")
+	parser.add_argument("--output",default = None,help = "Archivo JSON de resultados")
+	options = parser.parse_args(arguments)
+	options.nodes = [int(nodeCount) for nodeCount in options.nodes.split(",")]
+	for nodeCount in options.nodes:
+		if not 2 <= nodeCount <= MAX_NODES:
+			parser.error("El anillo debe tener entre 2 y " + str(MAX_NODES) + " nodos")
+		if options.kill > nodeCount - 2:
+			parser.error("Deben sobrevivir al menos 2 nodos")
+	return options
+
+def main(arguments):
+	options = parseArguments(arguments)
+	results = []
+	for nodeCount in options.nodes:
+		result = runRing(nodeCount,options)
+		printResult(result)
+		results.append(result)
+	report = {
+		"timestamp":datetime.datetime.utcnow().isoformat() + "Z",
+		"python":platform.python_version(),
+		"platform":platform.platform(),
+		"cpus":multiprocessing.cpu_count(),
+		"results":results,
+	}
+	if options.output:
+		with open(options.output,"w") as f:
+			json.dump(report,f,indent = 2,sort_keys = True,separators = (",",": "))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
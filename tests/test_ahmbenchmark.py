@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmbenchmark.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import sys
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+import StringIO
+import ahmbenchmark
+
+
+# Los benchmarks imprimen cada caso y la comparacion por salida estandar
+class BenchmarkTestCase(unittest.TestCase):
+	
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix = "ahmbenchmark")
+		self.stdout = sys.stdout
+		sys.stdout = StringIO.StringIO()
+		
+	def tearDown(self):
+		sys.stdout = self.stdout
+		shutil.rmtree(self.directory)
+		
+	def writeRun(self,name,run):
+		fileName = os.path.join(self.directory,name)
+		with open(fileName,"w") as f:
+			json.dump(run,f)
+		return fileName
+		
+		
+### CORRIDA CORTA ##################################
+
+class SmokeTest(BenchmarkTestCase):
+	
+	def testEchoTCPEpoll(self):
+		output = os.path.join(self.directory,"resultados.json")
+		arguments = ["--services","echo-tcp","--modes","epoll","--concurrency","2","--processes","1","--duration","0.3",
+			"--warmup","0","--output",output]
+		self.assertEqual(ahmbenchmark.main(arguments),0)
+		with open(output) as f:
+			run = json.load(f)
+		self.assertEqual(sorted(run),["cpus","platform","python","results","timestamp"])
+		self.assertEqual(len(run["results"]),1)
+		result = run["results"][0]
+		self.assertEqual(sorted(result),["concurrency","duration","errors","latency","mode","payloadSize","processes","requests",
+			"service","throughput"])
+		self.assertEqual((result["service"],result["mode"],result["concurrency"],result["payloadSize"]),("echo-tcp","epoll",2,64))
+		self.assertEqual(result["errors"],0)
+		self.assertTrue(result["requests"] > 0)
+		self.assertTrue(result["throughput"] > 0)
+		self.assertEqual(sorted(result["latency"]),["max","mean","p50","p99","p999"])
+		self.assertTrue(0 < result["latency"]["p50"] <= result["latency"]["p99"] <= result["latency"]["max"])
+		
+		
+### COMPARACION DE CORRIDAS ##################################
+
+class CompareTest(BenchmarkTestCase):
+	
+	baseline = {"results":[{"service":"echo-tcp","mode":"epoll","concurrency":2,"payloadSize":64,"throughput":1000.0,
+		"latency":{"p99":1.0}}]}
+		
+	def compare(self,current,tolerance = "0.10"):
+		return ahmbenchmark.main(["--input",self.writeRun("actual.json",current),"--compare",self.writeRun("base.json",self.baseline),
+			"--tolerance",tolerance])
+			
+	def changed(self,throughput,p99):
+		current = copy.deepcopy(self.baseline)
+		current["results"][0]["throughput"] = throughput
+		current["results"][0]["latency"]["p99"] = p99
+		return current
+		
+	def testNoRegression(self):
+		self.assertEqual(self.compare(self.changed(950.0,1.05)),0)
+		
+	def testThroughputRegression(self):
+		self.assertEqual(self.compare(self.changed(800.0,1.0)),1)
+		self.assertTrue("REGRESION echo-tcp/epoll c=2 payload=64: throughput" in sys.stdout.getvalue())
+		
+	def testLatencyRegression(self):
+		self.assertEqual(self.compare(self.changed(1000.0,1.5)),1)
+		self.assertEqual(self.compare(self.changed(1000.0,1.5),"0.60"),0)
+		
+	# Los casos que no estan en ambas corridas no se comparan
+	def testMissingCase(self):
+		current = self.changed(10.0,10.0)
+		current["results"][0]["mode"] = "threadpool"
+		self.assertEqual(self.compare(current),0)
+		
+		
+if __name__ == "__main__":
+	unittest.main()
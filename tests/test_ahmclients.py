@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmclients.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import socket
+import threading
+import time
+import unittest
+from ahmprotocols import LengthPrefixFrameDecoder,SecureChannelProtocol,RequestIdEnvelope
+from ahmclients import SecureTCPClient,ReliableUDPClient,PooledHTTPClient
+try:   # Dependencias opcionales del canal cifrado
+	import rsa
+	import cryptography
+	secureChannel = True
+except ImportError:
+	secureChannel = False
+
+
+### CANAL CIFRADO ##################################
+
+# Servidor minimo que responde el CLIENT_HELLO con un SERVER_HELLO completo (con la clave publica publicKey)
+class ServerHelloResponder(threading.Thread):
+	
+	def __init__(self,publicKey):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.publicKey = publicKey
+		self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.socket.bind(("127.0.0.1",0))
+		self.socket.listen(1)
+		self.port = self.socket.getsockname()[1]
+		self.keyExchange = None
+		
+	def run(self):
+		connection = self.socket.accept()[0]
+		decoder = LengthPrefixFrameDecoder()
+		frames = []
+		while not frames:
+			frames = decoder.feed(connection.recv(4096))
+		sessionId = SecureChannelProtocol.createRandom(SecureChannelProtocol.SESSION_ID_SIZE)
+		connection.sendall(decoder.encode(SecureChannelProtocol.createServerHello(SecureChannelProtocol.createRandom(),sessionId,self.publicKey)))
+		data = connection.recv(4096)   # KEY_EXCHANGE, o el cierre si el cliente rechazo el servidor
+		self.keyExchange = decoder.feed(data) if data else None
+		connection.close()
+		self.socket.close()
+		
+		
+@unittest.skipUnless(secureChannel,"Requiere rsa y cryptography")
+class SecureTCPClientTest(unittest.TestCase):
+	
+	@classmethod
+	def setUpClass(cls):
+		cls.publicKey = SecureChannelProtocol.createKeys(512)[0]
+		cls.otherKey = SecureChannelProtocol.createKeys(512)[0]
+		
+	def handshake(self,serverKey):
+		server = ServerHelloResponder(self.publicKey)
+		server.start()
+		try:
+			SecureTCPClient("127.0.0.1",server.port,timeout = 2.0,serverKey = serverKey).close()
+		finally:
+			server.join(2.0)
+		return server.keyExchange
+		
+	def testPinnedKey(self):
+		self.assertEqual(len(self.handshake(self.publicKey)),1)
+		
+	# Sin la clave publica del servidor, o con otra, no se envia la clave maestra
+	def testUnauthenticatedServerIsRejected(self):
+		for serverKey in (None,self.otherKey):
+			with self.assertRaises(ValueError):
+				self.handshake(serverKey)
+				
+				
+### UDP CONFIABLE #########################################
+
+# El servidor es un socket UDP del test: recibe los pedidos y responde a mano
+class ReliableUDPClientTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.server = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.server.bind(("127.0.0.1",0))
+		self.server.settimeout(2.0)
+		self.client = ReliableUDPClient("127.0.0.1",self.server.getsockname()[1])
+		
+	def tearDown(self):
+		self.client.close()
+		self.server.close()
+		
+	# Una respuesta con el id de un pedido en vuelo que no viene del servidor no finaliza el pedido
+	def testResponseFromOtherAddressIsIgnored(self):
+		requestId = self.client.submit("hora")
+		data, address = self.server.recvfrom(65535)
+		other = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		other.sendto(RequestIdEnvelope.wrap(requestId,"falsa"),address)
+		other.close()
+		self.assertEqual(self.client.poll(0.1),0)
+		self.assertEqual(self.client.inFlight(),1)
+		self.server.sendto(RequestIdEnvelope.wrap(requestId,"verdadera"),address)
+		while self.client.inFlight():
+			self.client.poll()
+		self.assertEqual(self.client.responses.pop(requestId),"verdadera")
+		
+		
+### HTTP CON CONEXIONES PERSISTENTES #####################
+
+# Servidor HTTP/1.1 minimo (un thread por conexion). Responde con el recurso pedido y cuenta las conexiones y los pedidos
+# atendidos en paralelo. La primera conexion se cierra sin responder el pedido numero staleAfter + 1, como un servidor que
+# cierra una conexion persistente mientras el cliente le envia un pedido
+class KeepAliveHTTPServer(threading.Thread):
+	
+	def __init__(self,staleAfter = None,delay = 0,interim = False):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.staleAfter = staleAfter
+		self.delay = delay
+		self.interim = interim   # Enviar "100 Continue" antes de cada respuesta
+		self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+		self.socket.bind(("127.0.0.1",0))
+		self.socket.listen(16)
+		self.port = self.socket.getsockname()[1]
+		self.connections = 0
+		self.requests = []   # (metodo,recurso) de los pedidos recibidos, incluido el que no se responde
+		self.active = 0
+		self.maxActive = 0
+		self.lock = threading.Lock()
+		
+	def run(self):
+		while True:
+			try:
+				connection = self.socket.accept()[0]
+			except socket.error:   # Se cerro el socket del servidor
+				return
+			with self.lock:
+				self.connections += 1
+				staleAfter = self.staleAfter if self.connections == 1 else None
+			handler = threading.Thread(target = self.serve,args = (connection,staleAfter))
+			handler.daemon = True
+			handler.start()
+			
+	def serve(self,connection,staleAfter):
+		data = ""
+		served = 0
+		while True:
+			while "\r\n\r\n" not in data:
+				chunk = connection.recv(4096)
+				if not chunk:
+					connection.close()
+					return
+				data += chunk
+			request, data = data.split("\r\n\r\n",1)
+			method, resource = request.split(" ")[:2]
+			with self.lock:
+				self.requests.append((method,resource))
+				self.active += 1
+				self.maxActive = max(self.maxActive,self.active)
+			time.sleep(self.delay)
+			with self.lock:
+				self.active -= 1
+			if served == staleAfter:
+				connection.close()
+				return
+			response = "HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(resource)
+			if self.interim:
+				response = "HTTP/1.1 100 Continue\r\n\r\n" + response
+			connection.sendall(response if method == "HEAD" else response + resource)
+			served += 1
+			
+	def close(self):
+		self.socket.close()
+		
+		
+class PooledHTTPClientTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.client = PooledHTTPClient(maxConnectionsPerHost = 2,timeout = 2.0)
+		
+	def tearDown(self):
+		self.client.close()
+		self.server.close()
+		
+	def startServer(self,**options):
+		self.server = KeepAliveHTTPServer(**options)
+		self.server.start()
+		
+	def request(self,method,resource):
+		return self.client.request("127.0.0.1",self.server.port,method,resource)
+		
+	def testConnectionIsReused(self):
+		self.startServer()
+		for resource in ("/a","/b","/c"):
+			response = self.request("GET",resource)
+			self.assertEqual((response.statusCode,response.body),("200",resource))
+		self.assertEqual(self.server.connections,1)
+		
+	# El servidor cierra la conexion persistente al recibir el segundo pedido: un GET se reintenta con una conexion nueva
+	def testStaleConnectionRetry(self):
+		self.startServer(staleAfter = 1)
+		self.request("GET","/a")
+		self.assertEqual(self.request("GET","/b").body,"/b")
+		self.assertEqual(self.server.requests,[("GET","/a"),("GET","/b"),("GET","/b")])
+		self.assertEqual(self.server.connections,2)
+		
+	# La respuesta 100 Continue se descarta y la final a HEAD no tiene cuerpo, aunque indique Content-Length
+	def testInterimResponse(self):
+		self.startServer(interim = True)
+		response = self.request("HEAD","/a")
+		self.assertEqual((response.statusCode,response.body),("200",""))
+		self.assertEqual(self.request("GET","/b").body,"/b")
+		self.assertEqual(self.server.connections,1)
+		
+	# Un POST no se reintenta: el servidor pudo haberlo procesado
+	def testNonIdempotentIsNotRetried(self):
+		self.startServer(staleAfter = 1)
+		self.request("GET","/a")
+		self.assertRaises(socket.error,self.request,"POST","/b")
+		self.assertEqual(self.server.requests,[("GET","/a"),("POST","/b")])
+		self.assertEqual(self.request("POST","/c").body,"/c")   # El pool descarto la conexion cerrada
+		
+	# requestMany usa a lo sumo maxConnectionsPerHost conexiones (y pedidos en paralelo) por host
+	def testRequestManyIsBounded(self):
+		self.startServer(delay = 0.02)
+		resources = ["/%d" % index for index in range(10)]
+		responses = self.client.requestMany([("127.0.0.1",self.server.port,"GET",resource) for resource in resources])
+		self.assertEqual([response.body for response in responses],resources)
+		self.assertEqual(self.server.connections,2)
+		self.assertEqual(self.server.maxActive,2)
+		
+		
+if __name__ == "__main__":
+	unittest.main()
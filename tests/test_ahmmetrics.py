@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmmetrics.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import socket
+import tempfile
+import unittest
+from ahmmetrics import replaceMethods,restoreMethods,ServerMetrics,StatsDExporter,formatPrometheus
+from ahmservers import AbstractHTTPServer
+
+
+### REEMPLAZO DE METODOS ##################################
+
+class Server:
+	
+	def manageRequest(self,client,data):
+		return [data]
+		
+	def sendResponse(self,client,data):
+		return data
+		
+		
+# Capa que agrega name al resultado de manageRequest
+def createLayer(name):
+	def wrapManageRequest(manageRequest):
+		return lambda client,data: manageRequest(client,data) + [name]
+	return {"manageRequest":wrapManageRequest}
+	
+	
+class ReplaceMethodsTest(unittest.TestCase):
+	
+	def testLayersInOrder(self):
+		server = Server()
+		replaceMethods(server,createLayer("metricas"))
+		replaceMethods(server,createLayer("profiling"))
+		self.assertEqual(server.manageRequest(None,"x"),["x","metricas","profiling"])
+		
+	# Quitar una capa que no es la ultima conserva las demas
+	def testOutOfOrderRestore(self):
+		server = Server()
+		metrics = replaceMethods(server,createLayer("metricas"))
+		profiling = replaceMethods(server,createLayer("profiling"))
+		restoreMethods(server,metrics)
+		self.assertEqual(server.manageRequest(None,"x"),["x","profiling"])
+		restoreMethods(server,profiling)
+		self.assertEqual(server.manageRequest(None,"x"),["x"])
+		self.assertFalse("manageRequest" in server.__dict__)
+		
+	def testRestoreTwiceIsIgnored(self):
+		server = Server()
+		layer = replaceMethods(server,createLayer("metricas"))
+		restoreMethods(server,layer)
+		restoreMethods(server,layer)
+		restoreMethods(server,None)
+		self.assertEqual(server.manageRequest(None,"x"),["x"])
+		
+	# Un metodo propio de la instancia (no de la clase) se restaura
+	def testInstanceMethodIsRestored(self):
+		server = Server()
+		server.sendResponse = lambda client,data: "propio"
+		layer = replaceMethods(server,{"sendResponse":lambda sendResponse: lambda client,data: sendResponse(client,data) + "!"})
+		self.assertEqual(server.sendResponse(None,"x"),"propio!")
+		restoreMethods(server,layer)
+		self.assertEqual(server.sendResponse(None,"x"),"propio")
+		
+		
+### METRICAS DE UN SERVIDOR HTTP ##########################
+
+# Las respuestas se envian por un socketpair, sin el bucle del servidor
+class HTTPMetricsTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.server = AbstractHTTPServer("127.0.0.1",0)
+		self.metrics = self.server.enableMetrics()
+		self.serverSock, self.client = socket.socketpair()
+		self.client.settimeout(2.0)
+		
+	def tearDown(self):
+		self.server.disableMetrics()
+		self.server.socket.close()
+		self.serverSock.close()
+		self.client.close()
+		
+	def receive(self,size):
+		data = ""
+		while len(data) < size:
+			data += self.client.recv(size - len(data))
+		return data
+		
+	def testSendHTTPResponseCountsBytesOut(self):
+		self.server.sendHTTPResponse(self.serverSock,200,"OK",{},"hola")
+		sent = self.metrics.counters["bytesOut"]
+		self.assertTrue(self.receive(sent).endswith("\r\n\r\nhola"))
+		self.assertEqual(self.metrics.histograms["sendResponse"].count,1)
+		
+	def testSendHTTPFileCountsBytesOut(self):
+		body = tempfile.TemporaryFile()
+		body.write("x" * 10000)
+		body.flush()
+		self.server.sendHTTPFile(self.serverSock,200,"OK",{},body)
+		sent = self.metrics.counters["bytesOut"]
+		self.assertTrue(self.receive(sent).endswith("\r\n\r\n" + "x" * 10000))
+		self.assertEqual(self.metrics.histograms["sendResponse"].count,2)   # Headers y archivo
+		body.close()
+		
+		
+### METRICAS COMPARTIDAS ##################################
+
+# Varios servidores con las mismas metricas (ej: DayTime TCP y UDP): los gauges de cada uno se suman
+class SharedMetricsTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.servers = [AbstractHTTPServer("127.0.0.1",0) for index in range(2)]
+		
+	def tearDown(self):
+		for server in self.servers:
+			server.disableMetrics()
+			server.socket.close()
+			server.handler.epoll.close()
+			
+	def testGaugesAreSummed(self):
+		first, second = self.servers
+		first.handler.connections.update({1001:None})   # Conexiones simuladas: solo se cuentan
+		second.handler.connections.update({1002:None,1003:None})
+		metrics = first.enableMetrics()
+		second.enableMetrics(metrics)
+		self.assertEqual(metrics.readGauges(),{"activeConnections":3,"queueDepth":0})
+		first.enableMetrics(metrics)   # Volver a habilitar no duplica las funciones del servidor
+		self.assertEqual(metrics.readGauges()["activeConnections"],3)
+		second.disableMetrics()
+		self.assertEqual(metrics.readGauges()["activeConnections"],1)
+		first.disableMetrics()
+		self.assertEqual(metrics.readGauges(),{})
+		
+		
+### EXPORTADORES ##########################################
+
+# Metricas con valores conocidos: 3 pedidos, un gauge y manageRequest con 50us, 2ms y 20s
+def createMetrics():
+	metrics = ServerMetrics()
+	metrics.setGauge("connections",lambda: 2)
+	for value in (50,2000,20000000):
+		metrics.histograms["manageRequest"].record(value)
+	return metrics
+	
+	
+class PrometheusFormatTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.metrics = createMetrics()
+		self.metrics.counters["requests"] = 3
+		
+	def testTypesAndSamples(self):
+		lines = formatPrometheus(self.metrics).splitlines()
+		self.assertTrue("# TYPE ahm_requests_total counter" in lines)
+		self.assertTrue("ahm_requests_total 3" in lines)
+		self.assertTrue("# TYPE ahm_bytes_in_total counter" in lines)
+		self.assertTrue("# TYPE ahm_connections gauge" in lines)
+		self.assertTrue("ahm_connections 2" in lines)
+		self.assertTrue("# TYPE ahm_manage_request_seconds histogram" in lines)
+		
+	# Buckets acumulados (le en segundos), el ultimo +Inf con todos los valores, y _sum/_count
+	def testHistogram(self):
+		lines = formatPrometheus(self.metrics).splitlines()
+		buckets = [line for line in lines if line.startswith("ahm_manage_request_seconds_bucket")]
+		self.assertTrue('ahm_manage_request_seconds_bucket{le="0.0001"} 1' in buckets)
+		self.assertTrue('ahm_manage_request_seconds_bucket{le="0.001"} 1' in buckets)
+		self.assertTrue('ahm_manage_request_seconds_bucket{le="0.0025"} 2' in buckets)
+		self.assertTrue('ahm_manage_request_seconds_bucket{le="10.0"} 2' in buckets)
+		self.assertEqual(buckets[-1],'ahm_manage_request_seconds_bucket{le="+Inf"} 3')
+		counts = [int(line.split(" ")[1]) for line in buckets]
+		self.assertEqual(counts,sorted(counts))
+		self.assertTrue("ahm_manage_request_seconds_sum 20.00205" in lines)
+		self.assertTrue("ahm_manage_request_seconds_count 3" in lines)
+		
+	def testLabelEscaping(self):
+		lines = formatPrometheus(self.metrics,"srv",{"worker":1,"server":'a"b\\c\nd'}).splitlines()
+		self.assertTrue('srv_requests_total{server="a\\"b\\\\c\\nd",worker="1"} 3' in lines)
+		self.assertTrue('srv_manage_request_seconds_bucket{server="a\\"b\\\\c\\nd",worker="1",le="+Inf"} 3' in lines)
+		self.assertTrue('srv_manage_request_seconds_count{server="a\\"b\\\\c\\nd",worker="1"} 3' in lines)
+		self.assertRaises(ValueError,formatPrometheus,self.metrics,"srv",{"no valida":"x"})
+		
+		
+class StatsDExporterTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.agent = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.agent.bind(("127.0.0.1",0))
+		self.agent.settimeout(2.0)
+		self.metrics = createMetrics()
+		self.exporter = StatsDExporter(self.metrics,"127.0.0.1",self.agent.getsockname()[1])
+		
+	def tearDown(self):
+		self.exporter.socket.close()
+		self.agent.close()
+		
+	# Contadores como diferencia desde el envio anterior (|c); gauges y percentiles en milisegundos (|g)
+	def testLines(self):
+		self.metrics.counters["requests"] += 3
+		lines = self.exporter.getLines()
+		self.assertTrue("ahm.requests:3|c" in lines)
+		self.assertTrue("ahm.errors:0|c" in lines)
+		self.assertTrue("ahm.connections:2|g" in lines)
+		self.assertTrue("ahm.manageRequest.p50:2.007|g" in lines)   # Precision de los buckets (ver Histogram)
+		self.assertTrue("ahm.manageRequest.p999:20000.0|g" in lines)
+		self.metrics.counters["requests"] += 1
+		self.assertTrue("ahm.requests:1|c" in self.exporter.getLines())
+		
+	# Las lineas se agrupan en datagramas de hasta maxDatagramSize bytes, separadas por saltos de linea
+	def testDatagrams(self):
+		self.exporter.maxDatagramSize = 64
+		expected = self.exporter.getLines()
+		self.exporter.lastCounters = {}
+		self.exporter.flush()
+		received = []
+		while len(received) < len(expected):
+			datagram = self.agent.recv(65535)
+			self.assertTrue(len(datagram) <= 64)
+			received.extend(datagram.split("\n"))
+		self.assertEqual(received,expected)
+		
+		
+if __name__ == "__main__":
+	unittest.main()
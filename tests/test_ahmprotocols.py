@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmprotocols.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import socket
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+try:   # Dependencias opcionales del canal cifrado
+	import rsa
+	import cryptography
+	secureChannel = True
+except ImportError:
+	secureChannel = False
+try:   # Zonas horarias de DayTime (respuestas, indice de zonas)
+	import pytz
+	pytzInstalled = True
+except ImportError:
+	pytzInstalled = False
+from ahmprotocols import DayTimeProtocol,HTTPProtocol,MRTokenRingProtocol,LengthPrefixFrameDecoder,DelimiterFrameDecoder,TCPDataReceiver,ResponseCache,CompiledZoneDatabase,HTTPStreamParser,RequestIdEnvelope,SessionCipher,SecureChannelProtocol,BufferPool,ReceiveBuffer,OutputBuffer
+
+
+# Ejecutar desde la raiz del repositorio:
+#
+#	python -m unittest discover
+
+
+### TRAMAS ##################################
+
+class LengthPrefixFrameDecoderTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.decoder = LengthPrefixFrameDecoder()
+		self.frames = ["uno","","x" * 70000,"cuatro"]
+		self.stream = ''.join(self.decoder.encode(frame) for frame in self.frames)
+		
+	def testCoalesced(self):
+		self.assertEqual(self.decoder.feed(self.stream),self.frames)
+		self.assertEqual(self.decoder.pendingSize,0)
+		
+	def testSplit(self):
+		frames = []
+		for start in range(0,len(self.stream),1000):
+			frames.extend(self.decoder.feed(self.stream[start:start + 1000]))
+		self.assertEqual(frames,self.frames)
+		
+	def testByteByByte(self):
+		stream = ''.join(self.decoder.encode(frame) for frame in ["ab","","cde"])
+		frames = []
+		for byte in stream:
+			frames.extend(self.decoder.feed(byte))
+		self.assertEqual(frames,["ab","","cde"])
+		
+	def testPartialFrameIsKept(self):
+		encoded = self.decoder.encode("hola")
+		self.assertEqual(self.decoder.feed(encoded + encoded[:3]),["hola"])
+		self.assertEqual(self.decoder.feed(encoded[3:]),["hola"])
+		
+	def testFrameTooLarge(self):
+		self.decoder.maxFrameSize = 10
+		self.assertRaises(ValueError,self.decoder.feed,LengthPrefixFrameDecoder.HEADER.pack(11))
+		
+		
+class DelimiterFrameDecoderTest(unittest.TestCase):
+	
+	def testCoalesced(self):
+		decoder = DelimiterFrameDecoder("\n")
+		self.assertEqual(decoder.feed("a\nbc\n\nd"),["a","bc",""])
+		self.assertEqual(decoder.feed("e\n"),["de"])
+		
+	def testDelimiterSplitAcrossReads(self):
+		decoder = DelimiterFrameDecoder("\r\n")
+		self.assertEqual(decoder.feed("uno\r"),[])
+		self.assertEqual(decoder.feed("\ndos\r"),["uno"])
+		self.assertEqual(decoder.feed("\n"),["dos"])
+		
+	def testFrameTooLarge(self):
+		decoder = DelimiterFrameDecoder()
+		decoder.maxFrameSize = 10
+		decoder.feed("x" * 10)
+		self.assertRaises(ValueError,decoder.feed,"x")
+		
+		
+# Una lectura por evento: tramas completas, ninguna (pero verdadero: la conexion sigue) o None al cerrarse la conexion
+class ReceiveAvailableFramesTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+		self.decoder = LengthPrefixFrameDecoder()
+		
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+		
+	def testThreeWayResult(self):
+		encoded = self.decoder.encode("hola")
+		self.sender.sendall(encoded[:5])
+		frames = TCPDataReceiver.receiveAvailableFrames(self.receiver,self.decoder,4096)
+		self.assertEqual(frames,[])
+		self.assertTrue(frames)
+		self.sender.sendall(encoded[5:] + encoded)
+		self.assertEqual(TCPDataReceiver.receiveAvailableFrames(self.receiver,self.decoder,4096),["hola","hola"])
+		self.sender.close()
+		self.assertEqual(TCPDataReceiver.receiveAvailableFrames(self.receiver,self.decoder,4096),None)
+		
+		
+### RECEPCION SIN COPIAS ##################################
+
+class BufferPoolTest(unittest.TestCase):
+	
+	def testReuse(self):
+		pool = BufferPool(8,1)
+		first = pool.acquire()
+		pool.release(first)
+		self.assertTrue(pool.acquire() is first)
+		second = pool.acquire()
+		pool.release(first)
+		pool.release(second)   # Ya hay maxBuffers libres
+		pool.release(bytearray(16))   # Otro tamaño (un buffer que crecio)
+		self.assertEqual(pool.freeBuffers,[first])
+		self.assertEqual(pool.allocations,2)
+		
+	# Al crecer, el buffer anterior vuelve al pool
+	def testReceiveBufferReleasesToPool(self):
+		pool = BufferPool(8)
+		receiveBuffer = ReceiveBuffer(pool)
+		original = receiveBuffer.buffer
+		receiveBuffer.grow()
+		self.assertEqual(len(receiveBuffer.buffer),16)
+		self.assertEqual(pool.freeBuffers,[original])
+		receiveBuffer.release()
+		self.assertEqual(pool.freeBuffers,[original])   # El de 16 bytes no es del tamaño del pool
+		
+		
+# Los sockets son bloqueantes, como los que atiende SimpleTCPHandler. Cada recepcion corre en un thread para que el test falle
+# (en lugar de colgarse) si receiveDataInto espera datos que no van a llegar
+class ReceiveDataIntoTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+		self.pool = BufferPool(8)
+		self.receiveBuffer = ReceiveBuffer(self.pool)
+		
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+		
+	def receive(self):
+		result = []
+		thread = threading.Thread(target = lambda: result.append(TCPDataReceiver.receiveDataInto(self.receiver,self.receiveBuffer).tobytes()))
+		thread.daemon = True
+		thread.start()
+		thread.join(2.0)
+		self.assertFalse(thread.is_alive(),"receiveDataInto se bloqueo")
+		return result[0]
+		
+	def testExactFill(self):
+		self.sender.sendall("12345678")
+		self.assertEqual(self.receive(),"12345678")
+		self.sender.sendall("abcdefghijkl")   # El buffer crecio: entra en una lectura
+		self.assertEqual(self.receive(),"abcdefghijkl")
+		
+	def testAvailableDataIsReadAtOnce(self):
+		self.sender.sendall("x" * 100)
+		self.assertEqual(self.receive(),"x" * 100)
+		self.sender.close()
+		self.assertEqual(self.receive(),"")
+		
+	# El delimitador partido entre dos lecturas (la primera llena el buffer)
+	def testSplitDelimiter(self):
+		decoder = DelimiterFrameDecoder("\r\n")
+		self.sender.sendall("1234567\r")
+		self.assertEqual(decoder.feed(self.receive()),[])
+		self.sender.sendall("\nfin\r\n")
+		self.assertEqual(decoder.feed(self.receive()),["1234567","fin"])
+		
+	# Un MB en lecturas de 4 KB: los buffers creados no dependen de la cantidad de lecturas
+	def testAllocationsPerMegabyte(self):
+		pool = BufferPool(4096)
+		receiveBuffer = ReceiveBuffer(pool)
+		chunk = "x" * 4096
+		received = 0
+		for index in range(256):
+			self.sender.sendall(chunk)
+			received += len(TCPDataReceiver.receiveDataInto(self.receiver,receiveBuffer))
+		self.assertEqual(received,1024 * 1024)
+		self.assertTrue(pool.allocations <= 4,pool.allocations)
+		
+		
+# receiveData (la recepcion por defecto de AbstractTCPServer) con la misma estrategia que receiveDataInto
+class ReceiveDataTest(unittest.TestCase):
+	
+	bufferSize = 4096
+	
+	def setUp(self):
+		self.sender, self.receiver = socket.socketpair()
+		
+	def tearDown(self):
+		self.sender.close()
+		self.receiver.close()
+		
+	def receive(self):
+		result = []
+		thread = threading.Thread(target = lambda: result.append(TCPDataReceiver.receiveData(self.receiver,self.bufferSize)))
+		thread.daemon = True
+		thread.start()
+		thread.join(2.0)
+		self.assertFalse(thread.is_alive(),"receiveData se bloqueo")
+		return result[0]
+		
+	def testExactBufferSize(self):
+		self.sender.sendall("x" * self.bufferSize)
+		self.assertEqual(self.receive(),"x" * self.bufferSize)
+		self.sender.sendall("y" * (self.bufferSize * 3))
+		self.assertEqual(self.receive(),"y" * (self.bufferSize * 3))
+		
+	def testClosedAfterFullRead(self):
+		self.sender.sendall("x" * self.bufferSize)
+		self.sender.close()
+		self.assertEqual(self.receive(),"x" * self.bufferSize)
+		self.assertEqual(self.receive(),"")
+		
+		
+# Los archivos se envian sin cambiar el modo del socket: sendfile si es no bloqueante, read + send si es bloqueante
+class OutputBufferFileTest(unittest.TestCase):
+	
+	def testSocketModeIsKept(self):
+		sender, receiver = socket.socketpair()
+		fileObject = tempfile.TemporaryFile()
+		try:
+			fileObject.write("0123456789")
+			fileObject.flush()
+			for timeout in (None,2.0,0.0):
+				sender.settimeout(timeout)
+				output = OutputBuffer()
+				output.appendFile(fileObject,2,5)
+				self.assertEqual(output.write(sender),5)
+				self.assertEqual(sender.gettimeout(),timeout)
+				self.assertEqual(receiver.recv(10),"23456")
+		finally:
+			fileObject.close()
+			sender.close()
+			receiver.close()
+			
+			
+class RequestIdEnvelopeTest(unittest.TestCase):
+	
+	def testRoundTrip(self):
+		for requestId in (0,1,RequestIdEnvelope.MAX_REQUEST_ID):
+			self.assertEqual(RequestIdEnvelope.unwrap(RequestIdEnvelope.wrap(requestId,"datos")),(requestId,"datos"))
+		self.assertEqual(RequestIdEnvelope.unwrap(RequestIdEnvelope.wrap(7,"")),(7,""))
+		
+	def testMemoryviews(self):
+		wrapped = RequestIdEnvelope.wrap(7,memoryview("datos"))
+		self.assertEqual(wrapped,RequestIdEnvelope.wrap(7,"datos"))
+		requestId, data = RequestIdEnvelope.unwrap(memoryview(wrapped))
+		self.assertEqual((requestId,data.tobytes()),(7,"datos"))
+		
+	def testWithoutEnvelope(self):
+		for data in ("","\xffR","datagrama sin sobre"):
+			self.assertEqual(RequestIdEnvelope.unwrap(data),(None,data))
+			
+			
+### DAYTIME BINARIO ##################################
+
+class BinaryDayTimeTest(unittest.TestCase):
+	
+	utcDate = datetime(2013,6,1,12,0,0)
+	
+	def testRequestRoundTrip(self):
+		request = DayTimeProtocol.parseBinaryRequest(DayTimeProtocol.getBinaryRequestPDU("AR"))
+		self.assertEqual(request.decode(),(1,1,"AR",0))
+		request = DayTimeProtocol.parseBinaryRequest(DayTimeProtocol.getBinaryRequestPDU())
+		self.assertEqual((request.messageCode,request.countryCode),(0,"00"))
+		
+	@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+	def testResponseRoundTrip(self):
+		answers = [DayTimeProtocol.makeBinaryAnswerField(zoneName,self.utcDate) for zoneName in ("America/Argentina/Buenos_Aires","UTC")]
+		self.assertEqual(answers[0][1],-3 * 3600)
+		response = DayTimeProtocol.parseBinaryResponse(DayTimeProtocol.getBinaryResponsePDU(1,answers,"AR"))
+		self.assertEqual((response.isQuery,response.messageCode,response.countryCode,response.answerCount),(0,1,"AR",2))
+		self.assertEqual(response.rawAnswers,answers)
+		self.assertEqual(response.answers,[["America/Argentina/Buenos_Aires","01/06/13 09:00:00"],["UTC","01/06/13 12:00:00"]])
+		
+	def testUnknownZone(self):
+		answer = (0,0,DayTimeProtocol.UNKNOWN_ZONE_ID)
+		self.assertEqual(DayTimeProtocol.formatBinaryAnswer(answer)[0],"")
+		
+	# Los ids son posiciones de la tabla fija (ahmzones), no de la version de pytz instalada
+	def testFixedZoneTable(self):
+		zoneNames, zoneIds = DayTimeProtocol.getZoneTable()
+		self.assertEqual(zoneNames[0],"Africa/Abidjan")
+		self.assertEqual(zoneIds["UTC"],zoneNames.index("UTC"))
+		
+	def testOtherVersionIsRejected(self):
+		pdu = DayTimeProtocol.getBinaryRequestPDU("AR")
+		oldPDU = chr(1) + pdu[1:]
+		self.assertTrue(DayTimeProtocol.isBinaryPDU(oldPDU))
+		self.assertRaises(ValueError,DayTimeProtocol.parseBinaryRequest,oldPDU)
+		self.assertRaises(ValueError,DayTimeProtocol.parseBinaryResponse,oldPDU)
+		self.assertRaises(ValueError,DayTimeProtocol.answerRequest,oldPDU,{"AR":["UTC"]},"UTC")
+		
+	# El servidor responde en el formato del query
+	@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+	def testFormatNegotiation(self):
+		timeZones = {"AR":["America/Argentina/Buenos_Aires"]}
+		binaryResponse = DayTimeProtocol.answerRequest(DayTimeProtocol.getBinaryRequestPDU("AR"),timeZones,"UTC")
+		textResponse = DayTimeProtocol.answerRequest(DayTimeProtocol.getRequestPDU("AR"),timeZones,"UTC")
+		self.assertTrue(DayTimeProtocol.isBinaryPDU(binaryResponse))
+		self.assertFalse(DayTimeProtocol.isBinaryPDU(textResponse))
+		self.assertEqual(DayTimeProtocol.parseAnyResponse(binaryResponse).answers[0][0],"America/Argentina/Buenos_Aires")
+		self.assertEqual(DayTimeProtocol.parseAnyResponse(textResponse).answers[0][0].strip(),"America/Argentina/Buenos_Aires")
+		
+		
+### INDICE DE ZONAS ##################################
+
+@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+class CompiledZoneDatabaseTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.zonesFileName = os.path.join(self.directory,"zonas.txt")
+		self.indexFileName = self.zonesFileName + ".idx"
+		self.writeZones("AR\tAmerica/Argentina/Buenos_Aires\nAR\tAmerica/Argentina/Cordoba\nUY\tAmerica/Montevideo\n")
+		
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+		
+	def writeZones(self,text):
+		with open(self.zonesFileName,"w") as zonesFile:
+			zonesFile.write(text)
+			
+	def testLookups(self):
+		database = CompiledZoneDatabase.open(self.zonesFileName)
+		self.assertTrue("AR" in database)
+		self.assertFalse("BR" in database)
+		self.assertEqual(database["AR"],["America/Argentina/Buenos_Aires","America/Argentina/Cordoba"])
+		self.assertEqual(database.get("UY"),["America/Montevideo"])
+		self.assertEqual(database.get("BR"),None)
+		self.assertRaises(KeyError,lambda: database["BR"])
+		database.close()
+		
+	def testExistingIndexIsReused(self):
+		CompiledZoneDatabase.open(self.zonesFileName).close()
+		inode = os.stat(self.indexFileName).st_ino
+		CompiledZoneDatabase.open(self.zonesFileName).close()
+		self.assertEqual(os.stat(self.indexFileName).st_ino,inode)
+		
+	def testRebuildWhenZonesFileChanges(self):
+		CompiledZoneDatabase.open(self.zonesFileName).close()
+		self.writeZones("BR\tAmerica/Sao_Paulo\n")
+		database = CompiledZoneDatabase.open(self.zonesFileName)
+		self.assertFalse("AR" in database)
+		self.assertEqual(database["BR"],["America/Sao_Paulo"])
+		database.close()
+		
+	def testRebuildWhenIndexIsCorrupt(self):
+		with open(self.indexFileName,"wb") as indexFile:
+			indexFile.write("basura")
+		database = CompiledZoneDatabase.open(self.zonesFileName)
+		self.assertEqual(database["UY"],["America/Montevideo"])
+		database.close()
+		
+	# Con un indice vigente, open solo lo mapea: las zonas se resuelven al pedirlas o con warmUp
+	def testWarmUpWithExistingIndex(self):
+		CompiledZoneDatabase.open(self.zonesFileName).close()
+		DayTimeProtocol.zoneCache.zones.pop("America/Montevideo",None)
+		database = CompiledZoneDatabase.open(self.zonesFileName)
+		self.assertFalse("America/Montevideo" in DayTimeProtocol.zoneCache.zones)
+		self.assertEqual(database["UY"],["America/Montevideo"])
+		database.close()
+		CompiledZoneDatabase.open(self.zonesFileName,warmUp = True).close()
+		self.assertTrue("America/Montevideo" in DayTimeProtocol.zoneCache.zones)
+		
+		
+# Query de varios paises (message_code = 2)
+class BinaryBatchDayTimeTest(unittest.TestCase):
+	
+	timeZones = {"AR":["America/Argentina/Buenos_Aires","America/Argentina/Cordoba"],"UY":["America/Montevideo"]}
+	
+	def testRequestRoundTrip(self):
+		pdu = DayTimeProtocol.getBinaryBatchRequestPDU(["AR","UY","XX"])
+		self.assertEqual(DayTimeProtocol.parseBinaryRequest(pdu).messageCode,DayTimeProtocol.FIND_COUNTRIES)
+		self.assertEqual(DayTimeProtocol.parseBinaryBatchRequest(pdu),["AR","UY","XX"])
+		
+	def testIncompleteRequest(self):
+		pdu = DayTimeProtocol.getBinaryBatchRequestPDU(["AR","UY"])
+		self.assertRaises(ValueError,DayTimeProtocol.parseBinaryBatchRequest,pdu[:-1])
+		
+	@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+	def testResponseRoundTrip(self):
+		response = DayTimeProtocol.constructBinaryBatchResponse(["UY","XX","AR"],self.timeZones,datetime(2013,6,1,12,0,0))
+		self.assertEqual(DayTimeProtocol.parseBinaryBatchResponse(response),{
+			"UY":[["America/Montevideo","01/06/13 09:00:00"]],
+			"XX":None,
+			"AR":[["America/Argentina/Buenos_Aires","01/06/13 09:00:00"],["America/Argentina/Cordoba","01/06/13 09:00:00"]],
+		})
+		
+	# Los queries que superan los limites se responden con query incorrecto (sin resolver zonas)
+	def testLimits(self):
+		countryCodes = ["AR"] * (DayTimeProtocol.MAX_BATCH_COUNTRIES + 1)
+		for response in (DayTimeProtocol.answerRequest(DayTimeProtocol.getBinaryBatchRequestPDU(countryCodes),self.timeZones,"UTC",ResponseCache()),
+				DayTimeProtocol.constructBinaryBatchResponse(countryCodes,self.timeZones),
+				DayTimeProtocol.constructBinaryBatchResponse(["XX","ZZ"],{"ZZ":["UTC"] * (DayTimeProtocol.MAX_BATCH_ANSWERS + 1)})):
+			parsed = DayTimeProtocol.parseAnyResponse(response)
+			self.assertEqual((parsed.messageCode,parsed.answerCount),(0,0))
+			self.assertRaises(ValueError,DayTimeProtocol.parseBinaryBatchResponse,response)
+			
+	def testInvalidResponse(self):
+		response = DayTimeProtocol.constructBinaryBatchResponse(["XX","YY"],self.timeZones)
+		self.assertEqual(DayTimeProtocol.parseBinaryBatchResponse(response),{"XX":None,"YY":None})
+		for invalid in (response[:3],response[:-1],chr(1) + response[1:]):
+			self.assertRaises(ValueError,DayTimeProtocol.parseBinaryBatchResponse,invalid)
+			
+	@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+	def testAnswerRequest(self):
+		cache = ResponseCache()
+		pdu = DayTimeProtocol.getBinaryBatchRequestPDU(["AR","UY"])
+		response = DayTimeProtocol.answerRequest(pdu,self.timeZones,"UTC",cache)
+		self.assertEqual(sorted(DayTimeProtocol.parseAnyResponse(response)),["AR","UY"])
+		self.assertEqual(DayTimeProtocol.describeRequest(pdu)["countryCodes"],["AR","UY"])
+		
+		
+### CACHE DE RESPUESTAS ##################################
+
+class ResponseCacheTest(unittest.TestCase):
+	
+	def testTTL(self):
+		cache = ResponseCache(4,1.0)
+		cache.put("a","A",100.0)
+		self.assertEqual(cache.get("a",100.5),"A")
+		self.assertEqual(cache.get("a",101.0),None)   # Vence al cumplirse el ttl
+		self.assertEqual(cache.get("a",100.5),None)   # La entrada vencida se descarta
+		self.assertEqual(cache.getStats(),{"hits":1,"misses":2,"entries":0})
+		
+	def testPutRenewsTTL(self):
+		cache = ResponseCache(4,1.0)
+		cache.put("a","A",100.0)
+		cache.put("a","B",100.8)
+		self.assertEqual(cache.get("a",101.5),"B")
+		
+	def testLRU(self):
+		cache = ResponseCache(2,10.0)
+		cache.put("a","A",0.0)
+		cache.put("b","B",0.0)
+		self.assertEqual(cache.get("a",1.0),"A")   # "b" pasa a ser la menos usada
+		cache.put("c","C",1.0)
+		self.assertEqual(cache.get("b",1.0),None)
+		self.assertEqual(cache.get("a",1.0),"A")
+		self.assertEqual(cache.get("c",1.0),"C")
+		self.assertEqual(len(cache.entries),2)
+		
+		
+### HTTP INCREMENTAL ##################################
+
+class HTTPStreamParserTest(unittest.TestCase):
+	
+	# Retorna los mensajes como (startLine,headers,cuerpo,keepAlive), alimentando el parser de a chunkSize bytes
+	def parse(self,parser,data,chunkSize = None,close = False):
+		chunkSize = chunkSize or len(data) or 1
+		events = []
+		for start in range(0,len(data),chunkSize):
+			events.extend(parser.feed(data[start:start + chunkSize]))
+		if close:
+			events.extend(parser.close())
+		messages = []
+		for event in events:
+			if event[0] == HTTPStreamParser.MESSAGE:
+				messages.append([event[1],event[2],""])
+			elif event[0] == HTTPStreamParser.BODY:
+				messages[-1][2] += event[1]
+			else:
+				messages[-1].append(event[1])
+		return [tuple(message) for message in messages]
+		
+	def testPipelinedRequests(self):
+		data = "GET /a HTTP/1.1\r\nHost: x\r\n\r\nPOST /b HTTP/1.1\r\nContent-Length: 4\r\n\r\nholaGET /c HTTP/1.1\r\nConnection: close\r\n\r\n"
+		expected = [
+			(["GET","/a","HTTP/1.1"],{"Host":"x"},"",True),
+			(["POST","/b","HTTP/1.1"],{"Content-Length":"4"},"hola",True),
+			(["GET","/c","HTTP/1.1"],{"Connection":"close"},"",False),
+		]
+		self.assertEqual(self.parse(HTTPStreamParser(),data),expected)
+		self.assertEqual(self.parse(HTTPStreamParser(),data,1),expected)
+		
+	def testChunkedBody(self):
+		data = "POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5;ext=1\r\nhola \r\n5\r\nmundo\r\n0\r\nX-Trailer: 1\r\n\r\n"
+		for chunkSize in (None,1,7):
+			messages = self.parse(HTTPStreamParser(),data,chunkSize)
+			self.assertEqual([(message[2],message[3]) for message in messages],[("hola mundo",True)])
+			
+	def testInvalidChunkSize(self):
+		for size in ("zz","-1","+a","0x5",""):
+			data = "POST / HTTP/1.1\r\nHost: a\r\nTransfer-Encoding: chunked\r\n\r\n" + size + "\r\nabc"
+			self.assertRaises(ValueError,HTTPStreamParser().feed,data)
+		
+	def testCloseDelimitedResponse(self):
+		parser = HTTPStreamParser(False)
+		parser.expectResponseTo("GET")
+		messages = self.parse(parser,"HTTP/1.0 200 OK\r\nServer: x\r\n\r\ncuerpo sin longitud",5,close = True)
+		self.assertEqual(messages,[(["HTTP/1.0","200","OK"],{"Server":"x"},"cuerpo sin longitud",False)])
+		
+	def testResponsesWithoutBody(self):
+		parser = HTTPStreamParser(False)
+		parser.expectResponseTo("HEAD")
+		parser.expectResponseTo("GET")
+		data = "HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nHTTP/1.1 204 No Content\r\n\r\n"
+		self.assertEqual([(message[0][1],message[2]) for message in self.parse(parser,data)],[("200",""),("204","")])
+		
+	# Las respuestas 1xx no consumen el metodo del request: la respuesta final a HEAD sigue sin cuerpo
+	def testInterimResponse(self):
+		parser = HTTPStreamParser(False)
+		parser.expectResponseTo("HEAD")
+		parser.expectResponseTo("GET")
+		data = "HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\nhola"
+		self.assertEqual([(message[0][1],message[2]) for message in self.parse(parser,data)],[("100",""),("200",""),("200","hola")])
+		
+	def testHTTP10KeepAlive(self):
+		messages = self.parse(HTTPStreamParser(),"GET / HTTP/1.0\r\n\r\nGET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n")
+		self.assertEqual([message[3] for message in messages],[False,True])
+		
+	def testIncompleteMessageOnClose(self):
+		parser = HTTPStreamParser()
+		parser.feed("POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nhola")
+		self.assertRaises(ValueError,parser.close)
+		
+		
+### CANAL CIFRADO ##################################
+
+@unittest.skipUnless(secureChannel,"Requiere rsa y cryptography")
+class SessionCipherTest(unittest.TestCase):
+	
+	def setUp(self):
+		masterKey, self.clientRandom, self.serverRandom = os.urandom(32), os.urandom(16), os.urandom(16)
+		self.client = SessionCipher(masterKey,self.clientRandom,self.serverRandom,True)
+		self.server = SessionCipher(masterKey,self.clientRandom,self.serverRandom,False)
+		self.masterKey = masterKey
+		
+	def testRoundTrip(self):
+		for message in ("hola","","x" * 100000):
+			self.assertEqual(self.server.decrypt(self.client.encrypt(message)),message)
+			self.assertEqual(self.client.decrypt(self.server.encrypt(message)),message)
+		record = "\x04" + self.client.encrypt("con offset")
+		self.assertEqual(self.server.decrypt(record,1),"con offset")
+		
+	def testTamperedRecord(self):
+		record = self.client.encrypt("hola")
+		for index in (0,len(record) - 1):
+			tampered = record[:index] + chr(ord(record[index]) ^ 1) + record[index + 1:]
+			self.assertRaises(ValueError,self.server.decrypt,tampered)
+		self.assertRaises(ValueError,self.server.decrypt,record[:SessionCipher.TAG_SIZE - 1])
+		self.assertEqual(self.server.decrypt(record),"hola")   # Un mensaje rechazado no avanza la secuencia
+		
+	def testReplayedRecord(self):
+		record = self.client.encrypt("hola")
+		self.server.decrypt(record)
+		self.assertRaises(ValueError,self.server.decrypt,record)
+		
+	def testReorderedRecords(self):
+		first, second = self.client.encrypt("uno"), self.client.encrypt("dos")
+		self.assertRaises(ValueError,self.server.decrypt,second)
+		self.assertEqual(self.server.decrypt(first),"uno")
+		
+	# Un mensaje reflejado al mismo sentido, o de otra conexion con la misma clave maestra, no se autentica
+	def testRecordFromOtherDirectionOrConnection(self):
+		self.assertRaises(ValueError,self.client.decrypt,self.client.encrypt("hola"))
+		other = SessionCipher(self.masterKey,os.urandom(16),self.serverRandom,True)
+		self.assertRaises(ValueError,self.server.decrypt,other.encrypt("hola"))
+		
+	def testDataPDU(self):
+		pdu = SecureChannelProtocol.createDataPDU(self.client,"hola")
+		self.assertEqual(SecureChannelProtocol.parseDataPDU(self.server,pdu),"hola")
+		self.assertRaises(ValueError,SecureChannelProtocol.parseDataPDU,self.server,"\x03" + pdu[1:])
+		
+		
+@unittest.skipUnless(secureChannel,"Requiere rsa y cryptography")
+class KeyExchangeTest(unittest.TestCase):
+	
+	@classmethod
+	def setUpClass(cls):
+		cls.publicKey, cls.privateKey = SecureChannelProtocol.createKeys(512)
+		
+	def testValidKeyExchange(self):
+		masterKey = os.urandom(SecureChannelProtocol.MASTER_KEY_SIZE)
+		pdu = SecureChannelProtocol.createKeyExchange(masterKey,self.publicKey)
+		self.assertEqual(SecureChannelProtocol.parseKeyExchange(pdu,self.privateKey),masterKey)
+		
+	# Rechazo implicito: un relleno invalido o una clave de otro tamaño no se distinguen de una clave valida
+	def testInvalidKeyExchangeYieldsRandomKey(self):
+		invalid = [
+			SecureChannelProtocol.KEY_EXCHANGE + os.urandom(64),
+			SecureChannelProtocol.createKeyExchange(os.urandom(16),self.publicKey),
+		]
+		for pdu in invalid:
+			first = SecureChannelProtocol.parseKeyExchange(pdu,self.privateKey)
+			second = SecureChannelProtocol.parseKeyExchange(pdu,self.privateKey)
+			self.assertEqual(len(first),SecureChannelProtocol.MASTER_KEY_SIZE)
+			self.assertNotEqual(first,second)
+			
+	def testHelloRoundTrip(self):
+		clientRandom, sessionId = os.urandom(16), os.urandom(16)
+		self.assertEqual(SecureChannelProtocol.parseClientHello(SecureChannelProtocol.createClientHello(clientRandom,sessionId)),(clientRandom,sessionId))
+		self.assertRaises(ValueError,SecureChannelProtocol.parseClientHello,SecureChannelProtocol.CLIENT_HELLO + clientRandom + "x")
+		serverRandom = os.urandom(16)
+		serverHello = SecureChannelProtocol.createServerHello(serverRandom,sessionId,self.publicKey)
+		self.assertEqual(SecureChannelProtocol.parseServerHello(serverHello),(serverRandom,sessionId,self.publicKey))
+		self.assertEqual(SecureChannelProtocol.parseServerHello(SecureChannelProtocol.createServerHello(serverRandom,sessionId))[2],None)
+		
+		
+### MENSAJES PARSEADOS ##################################
+
+# Los mensajes parseados reemplazan a las listas (DayTime, HTTP) y al diccionario (Token Ring) que retornaban los parse*
+class ParsedMessageTest(unittest.TestCase):
+	
+	def testDayTimeRequestAsList(self):
+		request = DayTimeProtocol.parseRequest(DayTimeProtocol.getRequestPDU("AR"))
+		self.assertEqual(len(request),4)
+		self.assertEqual(request[1],request.messageCode)
+		self.assertEqual(request[2],"AR")
+		self.assertEqual(request[1:3],[request.messageCode,"AR"])
+		isQuery, messageCode, countryCode, answerCount = request
+		self.assertEqual((isQuery,countryCode),("1","AR"))
+		
+	# constructResponse acepta tanto el request parseado como la lista [is_query,message_code,country_code,answer_count]
+	@unittest.skipUnless(pytzInstalled,"Requiere pytz")
+	def testConstructResponseFromList(self):
+		timeZones = {"AR":["America/Argentina/Buenos_Aires"]}
+		utcDate = datetime(2013,6,1,12,0,0)
+		pdu = DayTimeProtocol.getRequestPDU("AR")
+		parsed = DayTimeProtocol.constructResponse(DayTimeProtocol.parseRequest(pdu),timeZones,"UTC",utcDate)
+		self.assertEqual(DayTimeProtocol.constructResponse(["1","1","AR","00"],timeZones,"UTC",utcDate),parsed)
+		self.assertEqual(DayTimeProtocol.parseResponse(parsed).answers[0][0].strip(),"America/Argentina/Buenos_Aires")
+		response = DayTimeProtocol.parseResponse(DayTimeProtocol.constructResponse(["1","0","00","00"],timeZones,"UTC",utcDate))
+		self.assertEqual(response.answers[0][0].strip(),"UTC")
+		binaryPDU = DayTimeProtocol.getBinaryRequestPDU("AR")
+		parsed = DayTimeProtocol.constructBinaryResponse(DayTimeProtocol.parseBinaryRequest(binaryPDU),timeZones,"UTC",utcDate)
+		self.assertEqual(DayTimeProtocol.constructBinaryResponse([1,1,"AR",0],timeZones,"UTC",utcDate),parsed)
+		
+	def testHTTPRequestAsList(self):
+		request = HTTPProtocol.parseHTTPRequest("GET /a HTTP/1.1\r\nHost: x\r\n\r\ncuerpo")
+		startLine, headers, body = request
+		self.assertEqual(startLine,["GET","/a","HTTP/1.1"])
+		self.assertEqual(request[1]["Host"],"x")
+		self.assertEqual(body,"cuerpo")
+		
+	def testTokenRingPDUAsDict(self):
+		pdu = MRTokenRingProtocol.parsePDU("0102" + "03" + "hola")
+		self.assertTrue("messageCode" in pdu)
+		self.assertFalse("otro" in pdu)
+		self.assertEqual(pdu.keys(),["nodeSource","nodeDest","messageCode","message"])
+		self.assertEqual(sorted(pdu),sorted(pdu.keys()))
+		self.assertEqual(dict(pdu.items()),{"nodeSource":"01","nodeDest":"02","messageCode":"03","message":"hola"})
+		self.assertEqual(pdu.values(),["01","02","03","hola"])
+		self.assertEqual(pdu["message"],"hola")
+		self.assertEqual(pdu.get("nodeDest"),"02")
+		self.assertEqual(pdu.get("otro","x"),"x")
+		self.assertRaises(KeyError,lambda: pdu["otro"])
+		
+	def testTokenRingPDUAssignment(self):
+		pdu = MRTokenRingProtocol.parsePDU("0102" + "03" + "hola")
+		pdu["nodeDest"] = "09"
+		pdu["message"] = "chau"
+		pdu["messageCode"] = "05"
+		self.assertEqual(dict(pdu.items()),{"nodeSource":"01","nodeDest":"09","messageCode":"05","message":"chau"})
+		self.assertEqual(pdu.nodeSource,"01")
+		with self.assertRaises(KeyError):
+			pdu["otro"] = "x"
+		with self.assertRaises(ValueError):
+			pdu["nodeSource"] = "123"
+			
+			
+if __name__ == "__main__":
+	unittest.main()
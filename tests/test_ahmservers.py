@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmservers.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import os
+import errno
+import signal
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+from ahmprotocols import RequestIdEnvelope,TCPDataSender
+from ahmservers import EchoUDPServer,ReliableEchoUDPServer,AbstractTCPServer,AbstractFramedTCPServer,AbstractHTTPServer,EchoTCPServer,ServerWorkerPool
+
+
+### UDP CON ID DE PEDIDO ##################################
+
+# El sobre con id de pedido es opcional por servidor (requestIds): los servidores sin el devuelven los datagramas sin cambios,
+# aunque empiecen con RequestIdEnvelope.MAGIC. Se atiende un datagrama por vez con dispatchRequest, sin el bucle del servidor
+class RequestIdsTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.client = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.client.settimeout(2.0)
+		self.servers = []
+		
+	def tearDown(self):
+		self.client.close()
+		for server in self.servers:
+			server.socket.close()
+			
+	def echo(self,serverClass,data):
+		server = serverClass("127.0.0.1",0)
+		self.servers.append(server)
+		self.client.sendto(data,server.socket.getsockname())
+		received, address = server.socket.recvfrom(server.bufferSize)
+		server.dispatchRequest(address,received)
+		return self.client.recvfrom(65536)[0]
+		
+	def testPlainServerKeepsDatagram(self):
+		data = RequestIdEnvelope.wrap(5,"hola")
+		self.assertEqual(self.echo(EchoUDPServer,data),data)
+		self.assertEqual(self.echo(EchoUDPServer,"\xffRxxxxzz"),"\xffRxxxxzz")
+		
+	# Una respuesta que no entra en un datagrama (EMSGSIZE) se descarta sin terminar el servidor
+	def testSendErrorIsNotFatal(self):
+		server = EchoUDPServer("127.0.0.1",0)
+		self.servers.append(server)
+		server.sendResponse(server.socket.getsockname(),"x" * 70000)
+		self.assertEqual(server.sendErrors,1)
+		
+	def testRequestIdsServerEchoesId(self):
+		self.assertEqual(RequestIdEnvelope.unwrap(self.echo(ReliableEchoUDPServer,RequestIdEnvelope.wrap(5,"hola"))),(5,"hola"))
+		self.assertEqual(self.echo(ReliableEchoUDPServer,"sin sobre"),"sin sobre")
+		
+		
+### SERVIDOR CON TRAMAS ###################################
+
+class FramedEchoServer(AbstractFramedTCPServer):
+	
+	def manageFrame(self,clientSock,frame):
+		self.sendFrame(clientSock,frame)
+		
+		
+# El servidor corre en un thread con el handler por defecto (epoll)
+class FramedServerTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.server = FramedEchoServer("127.0.0.1",0)
+		self.thread = threading.Thread(target = self.server.run)
+		self.thread.daemon = True
+		self.thread.start()
+		self.client = socket.create_connection(self.server.socket.getsockname(),2.0)
+		
+	def tearDown(self):
+		self.server.stop()
+		self.client.close()   # Despierta la espera del handler
+		self.thread.join(2.0)
+		self.server.socket.close()
+		
+	def receiveFrame(self):
+		size = struct.unpack("!I",self.receiveExactly(4))[0]
+		return self.receiveExactly(size)
+		
+	def receiveExactly(self,size):
+		data = ""
+		while len(data) < size:
+			chunk = self.client.recv(size - len(data))
+			self.assertTrue(chunk)
+			data += chunk
+		return data
+		
+	def testSingleHandlerIsRejected(self):
+		self.assertRaises(ValueError,FramedEchoServer,"127.0.0.1",0,AbstractTCPServer.SINGLE)
+		
+	# Una trama que no entra en una lectura y las tramas que llegan despues de la primera respuesta
+	def testLargeAndPipelinedFrames(self):
+		frame = "x" * 200000
+		self.client.sendall(struct.pack("!I",len(frame)) + frame)
+		self.assertEqual(self.receiveFrame(),frame)
+		self.client.sendall(struct.pack("!I",3) + "uno" + struct.pack("!I",3) + "dos")
+		self.assertEqual(self.receiveFrame(),"uno")
+		self.assertEqual(self.receiveFrame(),"dos")
+		
+		
+### ARCHIVOS POR HTTP #####################################
+
+# Archivo que cuenta las lecturas desde Python: con sendfile el contenido no pasa por read
+class CountingFile(file):
+	
+	reads = 0
+	
+	def read(self,*args):
+		self.reads += 1
+		return file.read(self,*args)
+		
+		
+class FileHTTPServer(AbstractHTTPServer):
+	
+	def handleRequestStart(self,clientSock,requestLine,headers):
+		pass
+		
+	def handleRequestEnd(self,clientSock,keepAlive):
+		self.sendHTTPFile(clientSock,200,"OK",{},self.fileObject)
+		
+		
+# Un archivo mas grande que el buffer del socket: el resto se envia en los eventos de escritura
+@unittest.skipUnless(TCPDataSender.getLibc(),"Requiere sendfile de la libc")
+class SendHTTPFileTest(unittest.TestCase):
+	
+	content = "".join(chr(index % 251) for index in range(1024 * 1024))
+	
+	def setUp(self):
+		fd, self.fileName = tempfile.mkstemp(prefix = "test_ahmservers")
+		with os.fdopen(fd,"wb") as f:
+			f.write(self.content)
+			
+	def tearDown(self):
+		os.remove(self.fileName)
+		
+	def request(self,handler):
+		server = FileHTTPServer("127.0.0.1",0,handler)
+		server.fileObject = CountingFile(self.fileName,"rb")
+		thread = threading.Thread(target = server.run)
+		thread.daemon = True
+		thread.start()
+		client = socket.create_connection(server.socket.getsockname(),5.0)
+		try:
+			client.sendall("GET /archivo HTTP/1.1\r\nHost: a\r\n\r\n")
+			data = ""
+			while "\r\n\r\n" not in data:
+				data += client.recv(4096)
+			head, body = data.split("\r\n\r\n",1)
+			size = int([line.split(":")[1] for line in head.split("\r\n") if line.lower().startswith("content-length:")][0])
+			while len(body) < size:
+				chunk = client.recv(65536)
+				self.assertTrue(chunk)
+				body += chunk
+			return body, server.fileObject.reads
+		finally:
+			server.stop()
+			client.close()   # Despierta la espera del handler
+			thread.join(2.0)
+			server.socket.close()
+			server.fileObject.close()
+			
+	def testSendfileIsUsed(self):
+		for handler in (AbstractTCPServer.MULTIPLE,AbstractTCPServer.EPOLL,AbstractTCPServer.THREADPOOL):
+			body, reads = self.request(handler)
+			self.assertEqual(len(body),len(self.content),handler)
+			self.assertTrue(body == self.content,handler)
+			self.assertEqual(reads,0,handler)
+			
+			
+### UDP POR LOTES #########################################
+
+# Echo por lotes de 4 datagramas. El pedido "grande" se responde con un datagrama que no se puede enviar (EMSGSIZE)
+class BatchedEchoUDPServer(EchoUDPServer):
+	
+	batchSize = 4
+	
+	def manageRequest(self,address,data):
+		self.sendResponse(address,"x" * 70000 if data == "grande" else data)
+		
+		
+class BatchedUDPServerTest(unittest.TestCase):
+	
+	def setUp(self):
+		self.server = BatchedEchoUDPServer("127.0.0.1",0)
+		self.thread = threading.Thread(target = self.server.run)
+		self.thread.daemon = True
+		self.thread.start()
+		self.client = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+		self.client.settimeout(2.0)
+		
+	def tearDown(self):
+		self.server.stop()
+		self.client.sendto("fin",self.server.socket.getsockname())   # Despierta la espera del servidor
+		self.thread.join(2.0)
+		self.server.socket.close()
+		self.client.close()
+		
+	def receiveAll(self,count):
+		return sorted(self.client.recvfrom(65535)[0] for index in range(count))
+		
+	# Mas datagramas que batchSize: se atienden en varios lotes y todos tienen respuesta
+	def testEveryDatagramIsAnswered(self):
+		messages = ["pedido %02d" % index for index in range(25)]
+		for message in messages:
+			self.client.sendto(message,self.server.socket.getsockname())
+		self.assertEqual(self.receiveAll(len(messages)),messages)
+		self.assertTrue(self.server.batchesProcessed >= len(messages) / BatchedEchoUDPServer.batchSize)
+		
+	# La respuesta que falla se descarta y el resto del lote se envia
+	def testSendFailureKeepsBatch(self):
+		for message in ("a","grande","b"):
+			self.client.sendto(message,self.server.socket.getsockname())
+		self.assertEqual(self.receiveAll(2),["a","b"])
+		self.assertEqual(self.server.sendErrors,1)
+		self.client.sendto("c",self.server.socket.getsockname())   # El servidor sigue atendiendo
+		self.assertEqual(self.receiveAll(1),["c"])
+		
+		
+### POOL DE THREADS #######################################
+
+# Varios clientes concurrentes sobre ThreadPoolTCPHandler. Los cierres los hace el thread principal (ver closePendingConnections)
+class ThreadPoolServerTest(unittest.TestCase):
+	
+	clientsNumber = 16
+	requestsNumber = 20
+	
+	def setUp(self):
+		self.server = EchoTCPServer("127.0.0.1",0,AbstractTCPServer.THREADPOOL)
+		self.thread = threading.Thread(target = self.server.run)
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def tearDown(self):
+		self.server.stop()
+		socket.create_connection(self.server.socket.getsockname(),2.0).close()   # Despierta la espera del handler
+		self.thread.join(2.0)
+		self.server.socket.close()
+		
+	def runClient(self,index,errors):
+		try:
+			client = socket.create_connection(self.server.socket.getsockname(),2.0)
+			for request in range(self.requestsNumber):
+				message = "cliente %02d pedido %02d" % (index,request)
+				client.sendall(message + "\0")   # El servidor responde sin el delimitador
+				response = ""
+				while len(response) < len(message):
+					chunk = client.recv(len(message) - len(response))
+					if not chunk:
+						break
+					response += chunk
+				if response != message:
+					errors.append((index,request,response))
+			client.close()
+		except Exception as e:
+			errors.append((index,e))
+			
+	def testConcurrentEcho(self):
+		errors = []
+		threads = [threading.Thread(target = self.runClient,args = (index,errors)) for index in range(self.clientsNumber)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join(10.0)
+		self.assertEqual(errors,[])
+		deadline = time.time() + 2.0
+		while self.server.countConnections() and time.time() < deadline:   # Los cierres se procesan en el thread principal
+			time.sleep(0.01)
+		self.assertEqual(self.server.countConnections(),0)
+		self.assertEqual(self.server.handler.closingSockets,set())
+		
+		
+### WORKERS CON EL SOCKET COMPARTIDO ######################
+
+# En modo FORK (ServerWorkerPool) cada worker invoca initializeWorker sobre el servidor heredado. Un worker que pierde la
+# conexion contra otro no debe bloquearse en accept
+class SharedListenSocketTest(unittest.TestCase):
+	
+	def check(self,handler):
+		server = EchoTCPServer("127.0.0.1",0,handler)
+		try:
+			server.initializeWorker()
+			self.assertEqual(server.acceptReadyConnection(),None)
+			client = socket.create_connection(server.socket.getsockname(),2.0)
+			client_sock, client_addr = server.acceptReadyConnection()
+			self.assertEqual(client_sock.gettimeout(),None)   # Las conexiones aceptadas siguen siendo bloqueantes
+			client_sock.close()
+			client.close()
+		finally:
+			server.socket.close()
+			
+	def testEpollWorker(self):
+		self.check(AbstractTCPServer.EPOLL)
+		
+	def testMultipleWorker(self):
+		self.check(AbstractTCPServer.MULTIPLE)
+		
+	def testThreadPoolWorker(self):
+		self.check(AbstractTCPServer.THREADPOOL)
+		
+		
+### POOL DE WORKERS #######################################
+
+# Responde cada pedido con el pid del worker que lo atendio
+class PidEchoTCPServer(EchoTCPServer):
+	
+	def manageRequest(self,clientSock,data):
+		self.sendResponse(clientSock,str(os.getpid()))
+		
+		
+def processExists(pid):
+	try:
+		os.kill(pid,0)
+	except OSError as e:
+		return e.errno != errno.ESRCH
+	return True
+	
+	
+# El pool instala manejadores de señales, por lo que corre en un proceso hijo del test. SIGTERM lo detiene
+class ServerWorkerPoolTest(unittest.TestCase):
+	
+	def setUp(self):
+		probe = socket.socket(socket.AF_INET,socket.SOCK_STREAM)   # Puerto libre para el pool
+		probe.bind(("127.0.0.1",0))
+		self.port = probe.getsockname()[1]
+		probe.close()
+		self.poolPid = None
+		
+	def tearDown(self):
+		if self.poolPid is not None and self.waitPool(0) is None:
+			os.kill(self.poolPid,signal.SIGKILL)
+			os.waitpid(self.poolPid,0)
+			
+	def startPool(self,mode):
+		pool = ServerWorkerPool(PidEchoTCPServer,("127.0.0.1",self.port,AbstractTCPServer.EPOLL),2,mode)
+		pool.restartDelay = 0
+		self.poolPid = os.fork()
+		if not self.poolPid:
+			status = 1
+			try:
+				pool.run()
+				status = 0
+			finally:
+				os._exit(status)
+				
+	# Retorna el estado de salida del pool, o None si no termino en timeout segundos
+	def waitPool(self,timeout):
+		deadline = time.time() + timeout
+		while True:
+			pid, status = os.waitpid(self.poolPid,os.WNOHANG)
+			if pid:
+				self.poolPid = None
+				return status
+			if time.time() >= deadline:
+				return None
+			time.sleep(0.01)
+			
+	def request(self):
+		deadline = time.time() + 5.0
+		while True:
+			try:
+				client = socket.create_connection(("127.0.0.1",self.port),2.0)
+				break
+			except socket.error as e:
+				if e.errno != errno.ECONNREFUSED or time.time() >= deadline:   # El pool puede no haber iniciado todavia
+					raise
+				time.sleep(0.02)
+		try:
+			client.sendall("pid\0")
+			return int(client.recv(64))
+		finally:
+			client.close()
+			
+	# Los pedidos los atienden los workers (no el pool) y al detener el pool no queda ningun worker
+	def check(self,mode):
+		self.startPool(mode)
+		workerPids = set(self.request() for index in range(20))
+		self.assertTrue(1 <= len(workerPids) <= 2)
+		self.assertFalse(self.poolPid in workerPids)
+		os.kill(self.poolPid,signal.SIGTERM)
+		self.assertEqual(self.waitPool(5.0),0)
+		self.assertEqual([pid for pid in workerPids if processExists(pid)],[])
+		
+	def testFork(self):
+		self.check(ServerWorkerPool.FORK)
+		
+	def testReusePort(self):
+		self.check(ServerWorkerPool.REUSEPORT)
+		
+	# Un worker que ignora SIGTERM se termina con SIGKILL, y uno que ya fue recolectado no produce errores
+	def testStopWorkers(self):
+		pool = ServerWorkerPool(PidEchoTCPServer,(),1)
+		pool.shutdownTimeout = 0.1
+		ready, readyWrite = os.pipe()
+		stubborn = os.fork()
+		if not stubborn:
+			signal.signal(signal.SIGTERM,signal.SIG_IGN)
+			os.write(readyWrite,"x")
+			time.sleep(10)
+			os._exit(0)
+		os.read(ready,1)
+		os.close(ready)
+		os.close(readyWrite)
+		finished = os.fork()
+		if not finished:
+			os._exit(0)
+		os.waitpid(finished,0)
+		pool.workerPids = {stubborn:0,finished:1}
+		pool.stopWorkers()
+		self.assertEqual(pool.workerPids,{})
+		self.assertFalse(processExists(stubborn))
+		
+		
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  test_ahmtokenring.py
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+import collections
+import threading
+import time
+import unittest
+from ahmprotocols import MRTokenRingProtocol
+from ahmtokenring import TokenRingNode,runRing,parseArguments
+
+
+### PDU DEL TOKEN ##########################################
+
+class TokenPDUTest(unittest.TestCase):
+
+	def testRoundTrip(self):
+		entries = [(1,MRTokenRingProtocol.createPDU("01","02","02","hola")),
+			(2,MRTokenRingProtocol.createPDU("01","03","02","\x00\x00\x00\x04" * 10)),   # Datos que parecen un encabezado de entrada
+			(0,MRTokenRingProtocol.createAckPDU("03","01",7)),
+			(3,MRTokenRingProtocol.createPDU("01","02","02",""))]
+		token = MRTokenRingProtocol.createTokenPDU("01",entries,103)
+		self.assertEqual(token[:6],"010301")   # La generacion viaja modulo 100
+		self.assertEqual(MRTokenRingProtocol.parseTokenEntries(token),entries)
+		self.assertEqual(MRTokenRingProtocol.parseTokenEntries(MRTokenRingProtocol.createTokenPDU("01",[])),[])
+		self.assertEqual(MRTokenRingProtocol.parseAckId(entries[2][1]),7)
+		self.assertEqual(MRTokenRingProtocol.parseClaimGeneration(MRTokenRingProtocol.createClaimPDU("02",5)),5)
+
+	def testTruncatedToken(self):
+		token = MRTokenRingProtocol.createTokenPDU("01",[(1,MRTokenRingProtocol.createPDU("01","02","02","hola"))])
+		for invalid in (token[:-1],token[:9],token + "x"):
+			self.assertRaises(ValueError,MRTokenRingProtocol.parseTokenEntries,invalid)
+
+
+### PASES DEL TOKEN ########################################
+
+# Nodo sin conexiones: las tramas que pasa al sucesor quedan en frames
+class OfflineNode(TokenRingNode):
+
+	def __init__(self,nodeId):
+		TokenRingNode.__init__(self,nodeId,"127.0.0.1",0)
+		self.frames = []
+
+	def passFrame(self,frame):
+		self.frames.append(frame)
+
+	def lastEntries(self):
+		return MRTokenRingProtocol.parseTokenEntries(self.frames[-1])
+
+
+class TokenHoldTest(unittest.TestCase):
+
+	def setUp(self):
+		self.node = OfflineNode("01")
+
+	def tearDown(self):
+		self.node.close()
+
+	def token(self,*entries):
+		return MRTokenRingProtocol.createTokenPDU("03",list(entries))
+
+	# Un mensaje repetido (ej: reenviado al cambiar la generacion) no se entrega otra vez, pero se vuelve a confirmar
+	def testDuplicatesAreAcknowledged(self):
+		message = (1,MRTokenRingProtocol.createPDU("02","01","02","hola"))
+		ack = (0,MRTokenRingProtocol.createAckPDU("01","02",1))
+		self.node.holdToken(self.token(message))
+		self.assertEqual(self.node.lastEntries(),[ack])
+		self.node.holdToken(self.token(message))
+		self.assertEqual(self.node.lastEntries(),[ack])
+		self.assertEqual(list(self.node.inbox),[("02",1,"hola")])
+		self.assertEqual((self.node.delivered,self.node.duplicates),(1,1))
+
+	# Los mensajes para otros nodos se reenvian y los propios se agregan al final del lote hasta que llega su ack (acumulativo)
+	def testAcks(self):
+		forwarded = (5,MRTokenRingProtocol.createPDU("02","03","02","de paso"))
+		firstId = self.node.send("02","uno")
+		secondId = self.node.send("02","dos")
+		self.node.holdToken(self.token(forwarded))
+		self.assertEqual(self.node.lastEntries(),[forwarded,(firstId,MRTokenRingProtocol.createPDU("01","02","02","uno")),
+			(secondId,MRTokenRingProtocol.createPDU("01","02","02","dos"))])
+		self.assertEqual(self.node.unackedCount,2)
+		self.node.holdToken(self.token((0,MRTokenRingProtocol.createAckPDU("02","01",secondId))))
+		self.assertEqual(self.node.lastEntries(),[])
+		self.assertEqual((self.node.unackedCount,self.node.acknowledged),(0,2))
+
+	# Un mensaje que vuelve a su origen no tiene destino en el anillo
+	def testUndeliverable(self):
+		messageId = self.node.send("09","perdido")
+		self.node.holdToken(self.token())
+		self.node.holdToken(self.token(self.node.lastEntries()[0]))
+		self.assertEqual(self.node.lastEntries(),[])
+		self.assertEqual((self.node.unackedCount,self.node.undeliverable),(0,1))
+
+	def testHoldBudget(self):
+		self.node.holdMessages = 2
+		for index in range(5):
+			self.node.send("02","m%d" % index)
+		self.node.holdToken(self.token())
+		self.assertEqual(len(self.node.lastEntries()),2)
+		self.assertEqual(len(self.node.outbound),3)
+
+
+### ELECCIONES ############################################
+
+# Anillo de OfflineNodes: las tramas se entregan al sucesor de a una, en orden, desde el test
+class ElectionTest(unittest.TestCase):
+
+	def setUp(self):
+		self.nodes = [OfflineNode(nodeId) for nodeId in ("01","02","03")]
+		self.pending = collections.deque()   # (indice del nodo destino,trama)
+
+	def tearDown(self):
+		for node in self.nodes:
+			node.close()
+
+	def collect(self):
+		for index,node in enumerate(self.nodes):
+			while node.frames:
+				self.pending.append(((index + 1) % len(self.nodes),node.frames.pop(0)))
+
+	# Entrega hasta steps tramas. Retorna la mayor cantidad de tokens que hubo en circulacion
+	def pump(self,steps):
+		maxTokens = 0
+		for step in range(steps):
+			self.collect()
+			maxTokens = max(maxTokens,len([frame for index,frame in self.pending if frame[4:6] == "01"]))
+			if not self.pending:
+				break
+			index, frame = self.pending.popleft()
+			if frame[4:6] == "01":
+				self.nodes[index].holdToken(frame)
+			else:
+				self.nodes[index].handleClaim(frame)
+		return maxTokens
+
+	def totalRegenerations(self):
+		return sum(node.regenerations for node in self.nodes)
+
+	# El token se pierde con un mensaje: una eleccion crea un unico token y el mensaje se reenvia y se entrega una vez
+	def testLostToken(self):
+		self.nodes[0].send("03","hola")
+		self.nodes[0].holdToken(MRTokenRingProtocol.createTokenPDU("03",[]))
+		self.nodes[0].frames = []   # Se pierde el token
+		self.nodes[1].startElection()
+		self.assertEqual(self.pump(30),1)
+		self.assertEqual(self.totalRegenerations(),1)
+		self.assertEqual(self.nodes[1].regenerations,1)
+		self.assertEqual([node.generation for node in self.nodes],[1,1,1])
+		self.assertEqual(list(self.nodes[2].inbox),[("01",1,"hola")])
+		self.assertEqual(self.nodes[0].unackedCount,0)
+		self.assertTrue(all(node.holds > 2 for node in self.nodes[1:]))
+
+	# Postulaciones concurrentes de la misma generacion: gana el mayor id de nodo
+	def testConcurrentClaimsSameGeneration(self):
+		self.nodes[1].startElection()
+		self.nodes[2].startElection()
+		self.assertEqual(self.pump(30),1)
+		self.assertEqual([node.regenerations for node in self.nodes],[0,0,1])
+		self.assertEqual([node.bestClaim for node in self.nodes],[(1,"03")] * 3)
+		self.assertEqual([node.generation for node in self.nodes],[1,1,1])
+
+	# Gana la mayor generacion aunque el id sea menor
+	def testConcurrentClaimsHigherGeneration(self):
+		self.nodes[0].generation = 2
+		for node in self.nodes:
+			node.startElection()
+		self.assertEqual(self.pump(30),1)
+		self.assertEqual([node.regenerations for node in self.nodes],[1,0,0])
+		self.assertEqual([node.generation for node in self.nodes],[3,3,3])
+
+	# Un token de una generacion anterior que reaparece se descarta
+	def testStaleTokenIsDiscarded(self):
+		self.nodes[2].startElection()
+		self.pump(6)
+		self.nodes[1].holdToken(MRTokenRingProtocol.createTokenPDU("01",[],0))
+		self.assertEqual(self.nodes[1].discardedTokens,1)
+		self.assertEqual(self.nodes[1].frames,[])
+
+
+### EMPALMES ###############################################
+
+class SpliceTest(unittest.TestCase):
+
+	def setUp(self):
+		self.nodes = [TokenRingNode(nodeId,"127.0.0.1",0) for nodeId in ("01","02","03")]
+		self.nodes[0].setRing([(node.nodeId,node.address[0],node.address[1]) for node in self.nodes])
+		self.nodes[0].successor = self.nodes[0].connectSuccessor(self.nodes[1].address[0],self.nodes[1].address[1],0)
+		self.nodes[1].close()   # Muere el sucesor: la conexion pendiente se resetea
+
+	def tearDown(self):
+		for node in self.nodes:
+			node.close()
+
+	# El nodo se conecta con el siguiente vivo e inicia una eleccion por el token que pudo perderse
+	def testDeadSuccessorIsSplicedOut(self):
+		node, last = self.nodes[0], self.nodes[2]
+		node.successorFailed()
+		self.assertEqual((node.successorIndex,node.splices,node.elections),(2,1,1))
+		last.acceptPredecessor()
+		last.predecessor.settimeout(2.0)
+		last.receiveFrames()
+		self.assertEqual(last.bestClaim,(1,"01"))
+
+	# Sin otro nodo vivo el nodo termina
+	def testNoLiveNodes(self):
+		self.nodes[2].close()
+		self.assertFalse(self.nodes[0].spliceSuccessor())
+		self.assertEqual(self.nodes[0].successor,None)
+		self.assertFalse(self.nodes[0].running)
+
+
+### ANILLO EN EL PROCESO ###################################
+
+# Cada nodo corre en un thread, con conexiones TCP reales entre ellos
+class RingTestCase(unittest.TestCase):
+
+	def createRing(self,nodes):
+		self.nodes = nodes
+		ring = [(node.nodeId,node.address[0],node.address[1]) for node in nodes]
+		for node in nodes:
+			node.setRing(ring)
+		self.threads = []
+
+	def startRing(self):
+		for index,node in enumerate(self.nodes):
+			thread = threading.Thread(target = self.runNode,args = (node,index == 0))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def runNode(self,node,initialToken):
+		node.run(initialToken = initialToken)
+
+	def waitFor(self,condition,timeout = 5.0):
+		deadline = time.time() + timeout
+		while not condition() and time.time() < deadline:
+			time.sleep(0.01)
+		self.assertTrue(condition())
+
+	# La finalizacion da la vuelta desde el primer nodo y todos terminan
+	def stopRing(self):
+		self.nodes[0].stop()
+		for thread in self.threads:
+			thread.join(5.0)
+			self.assertFalse(thread.is_alive())
+
+
+class RingDeliveryTest(RingTestCase):
+
+	messagesNumber = 50
+
+	def setUp(self):
+		self.createRing([TokenRingNode(nodeId,"127.0.0.1",0,holdMessages = 8) for nodeId in ("01","02","03")])
+
+	def tearDown(self):
+		for node in self.nodes:
+			node.close()
+
+	# Cada nodo envia a los demas: los mensajes de cada origen llegan completos, en orden y sin repetir
+	def testDeliveryOrder(self):
+		for node in self.nodes:
+			for index in range(self.messagesNumber):
+				for dest in self.nodes:
+					if dest is not node:
+						node.send(dest.nodeId,"%s-%d" % (node.nodeId,index))
+		self.startRing()
+		expected = self.messagesNumber * (len(self.nodes) - 1)
+		self.waitFor(lambda: all(len(node.inbox) == expected and node.unackedCount == 0 for node in self.nodes))
+		self.stopRing()
+		for node in self.nodes:
+			for source in self.nodes:
+				if source is not node:
+					received = [(messageId,message) for sourceId,messageId,message in node.inbox if sourceId == source.nodeId]
+					self.assertEqual([message for messageId,message in received],["%s-%d" % (source.nodeId,index) for index in range(self.messagesNumber)])
+					self.assertEqual(sorted(received),received)
+			self.assertEqual((node.duplicates,node.undeliverable),(0,0))
+
+
+class NodeCrash(Exception):
+	pass
+
+# Nodo que termina (cerrando sus conexiones) al recibir el token si crash es True: el token se pierde con el
+class CrashingNode(TokenRingNode):
+
+	crash = False
+
+	def holdToken(self,token):
+		if self.crash:
+			raise NodeCrash()
+		TokenRingNode.holdToken(self,token)
+
+
+class RingFailureTest(RingTestCase):
+
+	def setUp(self):
+		self.createRing([CrashingNode(nodeId,"127.0.0.1",0) for nodeId in ("01","02","03")])
+		for node in self.nodes:
+			node.tokenTimeout = 0.2
+
+	def tearDown(self):
+		for node in self.nodes:
+			node.close()
+
+	def runNode(self,node,initialToken):
+		try:
+			node.run(initialToken = initialToken)
+		except NodeCrash:
+			pass
+
+	# Cae el nodo del medio con el token: el anillo se empalma, se regenera un token y siguen circulando los mensajes
+	def testRingSurvivesCrash(self):
+		first, middle, last = self.nodes
+		self.startRing()
+		self.waitFor(lambda: last.holds > 10)
+		middle.crash = True
+		self.threads[1].join(5.0)
+		self.assertFalse(self.threads[1].is_alive())
+		self.waitFor(lambda: first.splices == 1 and first.generation == 1 and last.generation == 1)
+		holds = first.holds
+		first.send("03","despues")
+		last.send("01","de la falla")
+		self.waitFor(lambda: len(last.inbox) == 1 and len(first.inbox) == 1 and first.holds > holds + 10)
+		self.threads = [self.threads[0],self.threads[2]]
+		self.stopRing()
+		self.assertEqual(first.regenerations + last.regenerations,1)
+		self.assertEqual((first.successorIndex,first.unackedCount,last.unackedCount),(2,0,0))
+
+
+# Banco de pruebas (un proceso por nodo) con una medicion corta
+class RunRingTest(unittest.TestCase):
+
+	def testShortRing(self):
+		options = parseArguments(["--nodes","3","--duration","0.5","--warmup","0","--window","4"])
+		result = runRing(3,options)
+		self.assertEqual(result["nodes"],3)
+		self.assertTrue(result["delivered"] > 0)
+		self.assertEqual((result["duplicates"],result["undeliverable"]),(0,0))
+		self.assertTrue(result["rotationsPerSecond"] > 0)
+		self.assertFalse("failure" in result)
+
+
+if __name__ == "__main__":
+	unittest.main()